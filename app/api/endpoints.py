@@ -1,101 +1,357 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Response
+from fastapi import APIRouter, HTTPException, Request, status, Response
+from fastapi.responses import StreamingResponse
 from app.models.schemas import (
     QueryRequest,
     QueryResponse,
+    BatchQueryRequest,
+    BatchQueryResponse,
+    BatchAnswer,
     UploadResponse,
+    JobStatusResponse,
+    ReportListResponse,
     DeleteRequest,
     DeleteResponse,
     DeleteAllResponse,
+    StatsResponse,
+    ReadinessResponse,
 )
-from app.services import vector_store, agent_service
-from app.config import TEMP_UPLOAD_DIR
+from app.services import vector_store, agent_service, ingest_jobs
+from app.services import embedding_pipeline, query_router, uploads
+from app.services.answer_cache import answer_cache
+from app.services.registry import registry
+from app.services.reports import ReportFilter
+from app.services.web_search import get_web_search
+from app.config import TEMP_UPLOAD_DIR, UPLOAD_MAX_BYTES, BATCH_QUERY_MAX_QUESTIONS
 from app.config import ADMIN
-import shutil
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from typing import Awaitable
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
-@router.post("/upload", response_model=UploadResponse)
-async def upload_pdf(
-    response: Response, user_id: str = Form(...), file: UploadFile = File(...)
-):
-    """
-    Uploads a PDF report, processes it with OCR, and creates a
-    user-specific vector store.
-    """
-    if not file.filename or not file.filename.endswith(".pdf"):
+# The upload body is parsed by hand (see uploads.areceive_pdf_upload), so
+# the form is described for the OpenAPI docs here
+_UPLOAD_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["user_id", "file"],
+                    "properties": {
+                        "user_id": {"type": "string"},
+                        "file": {"type": "string", "format": "binary"},
+                    },
+                }
+            }
+        },
+    }
+}
 
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        return UploadResponse(
-            statusCode=400,
-            filename="",
-            message="Invalid file type. Only PDF allowed..",
-        )
 
+@router.post("/upload", response_model=UploadResponse, openapi_extra=_UPLOAD_FORM)
+async def upload_pdf(request: Request, response: Response):
+    """
+    Uploads a PDF report and queues it for OCR and indexing.
+    Returns a job id right away; poll /jobs/{job_id} for progress.
+
+    The file is hashed and size-checked while it streams to disk. A report
+    already in the user's index is not processed again, and an identical
+    upload still in progress returns that upload's job.
+    """
     # Ensure the temporary upload directory exists
     TEMP_UPLOAD_DIR.mkdir(exist_ok=True)
     # ---
 
-    # Use a unique name for the temp file to avoid conflicts
-    temp_path = TEMP_UPLOAD_DIR / f"{user_id}_{file.filename}"
+    # Name the temp file after the job so concurrent uploads never collide
+    job_id = ingest_jobs.new_job_id()
+    temp_path = TEMP_UPLOAD_DIR / f"{job_id}.pdf"
 
-    # Save uploaded file temporarily
     try:
-        # Save uploaded file temporarily
-        with temp_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        file.file.close()
+        upload = await uploads.areceive_pdf_upload(request, temp_path, UPLOAD_MAX_BYTES)
+    except uploads.UploadRejected as e:
+        response.status_code = e.status_code
+        return UploadResponse(
+            filename=e.filename, statusCode=e.status_code, message=str(e)
+        )
 
-        # Process and create vector store
-        print(f"Processing upload for user {user_id}...")
-        success = vector_store.create_vector_store(user_id, temp_path)
+    user_id = upload.fields.get("user_id")
+    if not user_id:
+        temp_path.unlink(missing_ok=True)
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return UploadResponse(
+            filename=upload.filename, statusCode=400, message="user_id is required."
+        )
 
-        if success:
+    try:
+        if await asyncio.to_thread(
+            vector_store.has_report, user_id, upload.document_id
+        ):
+            temp_path.unlink(missing_ok=True)
+            logger.info("Upload for user %s skipped: report already indexed", user_id)
             return UploadResponse(
-                filename=file.filename,
+                filename=upload.filename,
                 statusCode=200,
-                message="Report processed and indexed successfully.",
-            )
-        else:
-            response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
-            return UploadResponse(
-                filename=file.filename,
-                statusCode=500,
-                message="Failed to process and index the PDF.",
+                message="Report is already indexed; nothing to process.",
+                document_id=upload.document_id,
             )
 
+        # Queue the report for the background ingestion workers
+        job_id, coalesced = await asyncio.to_thread(
+            ingest_jobs.submit_job,
+            job_id,
+            user_id,
+            upload.filename,
+            temp_path,
+            upload.sha256,
+        )
+        logger.info("Queued upload for user %s as job %s", user_id, job_id)
+
+        response.status_code = status.HTTP_202_ACCEPTED
+        return UploadResponse(
+            filename=upload.filename,
+            statusCode=202,
+            message=(
+                "An identical report is already being processed."
+                if coalesced
+                else "Report queued for processing."
+            ),
+            job_id=job_id,
+            document_id=upload.document_id,
+        )
+
     except Exception as e:
+        temp_path.unlink(missing_ok=True)
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return UploadResponse(
-            filename=file.filename,
+            filename=upload.filename,
             statusCode=500,
             message=f"Server Error : {e}",
         )
 
 
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str, response: Response):
+    """
+    Reports the stage and progress of a background ingestion job.
+    """
+    job = await asyncio.to_thread(ingest_jobs.get_job, job_id)
+    if job is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return JobStatusResponse(
+            job_id=job_id,
+            user_id="",
+            filename="",
+            stage="",
+            progress=0.0,
+            error="Job not found.",
+            created_at=0.0,
+            updated_at=0.0,
+            statusCode=404,
+        )
+
+    return JobStatusResponse(
+        job_id=job["id"],
+        user_id=job["user_id"],
+        filename=job["filename"],
+        stage=job["stage"],
+        progress=ingest_jobs.job_progress(job["stage"]),
+        error=job["error"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+        statusCode=200,
+    )
+
+
+def _report_filter(request: QueryRequest | BatchQueryRequest) -> ReportFilter | None:
+    report_filter = ReportFilter(
+        document_ids=(
+            tuple(request.document_ids) if request.document_ids is not None else None
+        ),
+        date_from=request.date_from.isoformat() if request.date_from else None,
+        date_to=request.date_to.isoformat() if request.date_to else None,
+    )
+    return report_filter or None
+
+
+# How often a running query checks that its client is still there
+_DISCONNECT_POLL_SECONDS = 0.5
+# nginx's "client closed request"; nobody is left to read it
+_CLIENT_CLOSED_REQUEST = 499
+
+
+async def _unless_disconnected(http_request: Request, work: Awaitable[dict]):
+    """
+    Awaits work, cancelling it (agent, LLM calls and all) as soon as the
+    client disconnects instead of finishing it for nobody. Returns None
+    in that case.
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=_DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+
+
 @router.post("/query", response_model=QueryResponse)
-async def query_agent(request: QueryRequest, response: Response):
+async def query_agent(request: QueryRequest, response: Response, http_request: Request):
     """
     Sends a query to the LangChain agent, which will use the
-    user's indexed report to answer.
+    user's indexed report to answer. The agent runs within per-request
+    budgets and is cancelled if the client disconnects.
     """
-    print(f"Received query from {request.user_id}: {request.query}")
-    response_dict = agent_service.run_agent_query(request.user_id, request.query)
+    response_dict = await _unless_disconnected(
+        http_request,
+        agent_service.arun_agent_query(
+            request.user_id,
+            request.query,
+            use_cache=not request.no_cache,
+            report_filter=_report_filter(request),
+        ),
+    )
+    if response_dict is None:
+        return Response(status_code=_CLIENT_CLOSED_REQUEST)
     response.status_code = response_dict["code"]
     return QueryResponse(
         query=request.query,
         message=response_dict["message"],
         statusCode=response_dict["code"],
+        cached=response_dict.get("cached", False),
+        stopped=response_dict.get("stopped"),
+    )
+
+
+@router.post("/query/stream")
+async def query_agent_stream(request: QueryRequest):
+    """
+    Streaming variant of /query using Server-Sent Events. Emits
+    "retrieval", "tool_start", "tool_end" and "token" events as the agent
+    runs, then "done" with the full answer (or "error").
+    """
+
+    async def event_stream():
+        async for event, data in agent_service.astream_agent_query(
+            request.user_id,
+            request.query,
+            use_cache=not request.no_cache,
+            report_filter=_report_filter(request),
+        ):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so events reach the client immediately
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/query/batch", response_model=BatchQueryResponse)
+async def query_agent_batch(
+    request: BatchQueryRequest, response: Response, http_request: Request
+):
+    """
+    Answers a set of questions about the user's reports in one request
+    (e.g. a dashboard's fixed questions): one index load, one embedding
+    call and one search for all of them, and report questions answered
+    together in a few LLM calls. Each answer carries its own timing.
+    """
+    if not 1 <= len(request.queries) <= BATCH_QUERY_MAX_QUESTIONS:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return BatchQueryResponse(
+            user_id=request.user_id,
+            message=f"Send between 1 and {BATCH_QUERY_MAX_QUESTIONS} queries.",
+            statusCode=400,
+        )
+
+    started = time.perf_counter()
+    result = await _unless_disconnected(
+        http_request,
+        agent_service.arun_batch_query(
+            request.user_id,
+            request.queries,
+            use_cache=not request.no_cache,
+            report_filter=_report_filter(request),
+        ),
+    )
+    if result is None:
+        return Response(status_code=_CLIENT_CLOSED_REQUEST)
+    response.status_code = result["code"]
+    if result["code"] != status.HTTP_200_OK:
+        return BatchQueryResponse(
+            user_id=request.user_id,
+            message=result["message"],
+            statusCode=result["code"],
+        )
+
+    return BatchQueryResponse(
+        user_id=request.user_id,
+        answers=[
+            BatchAnswer(
+                query=answer["query"],
+                message=answer["message"],
+                statusCode=answer["code"],
+                route=answer["route"],
+                cached=answer["cached"],
+                stopped=answer["stopped"],
+                seconds=answer["seconds"],
+            )
+            for answer in result["answers"]
+        ],
+        llm_calls=result["llm_calls"],
+        seconds=round(time.perf_counter() - started, 3),
+        statusCode=status.HTTP_200_OK,
     )
 
 
+@router.get("/reports/{user_id}", response_model=ReportListResponse)
+async def list_reports(user_id: str, response: Response):
+    """
+    Lists the reports in a user's index, oldest first.
+    """
+    reports = await asyncio.to_thread(vector_store.list_reports, user_id)
+    if reports is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return ReportListResponse(user_id=user_id, reports=[], statusCode=404)
+    return ReportListResponse(user_id=user_id, reports=reports, statusCode=200)
+
+
+@router.delete("/reports/{user_id}/{document_id}", response_model=DeleteResponse)
+async def delete_report(user_id: str, document_id: str, response: Response):
+    """
+    Removes one report from a user's index; the other reports are kept
+    without being re-processed.
+    """
+    success = await vector_store.aremove_report(user_id, document_id)
+    if success:
+        return DeleteResponse(message="Report removed successfully", statusCode=200)
+    response.status_code = status.HTTP_404_NOT_FOUND
+    return DeleteResponse(statusCode=404, message="Report not found.")
+
+
 @router.delete("/delete_index", response_model=DeleteResponse)
 async def delete_index(request: DeleteRequest, response: Response):
     """
     Deletes the FAISS index folder associated with a user_id.
     """
     print(f"Received delete request for user {request.user_id}")
-    success = vector_store.delete_vector_store(request.user_id)
+    success = await asyncio.to_thread(vector_store.delete_vector_store, request.user_id)
 
     if success:
         return DeleteResponse(message="User index deleted successfully", statusCode=200)
@@ -111,8 +367,9 @@ async def delete_index(request: DeleteRequest, response: Response):
 @router.delete("/delete/all", response_model=DeleteAllResponse)
 async def delete_all(key: str, response: Response):
     """
-    Deletes ALL FAISS index folders by recursively deleting the main
-    storage directory and then recreating it.
+    Deletes ALL FAISS index folders, each under its user's write lock so
+    uploads and queries running on other workers never see a half-deleted
+    index.
     """
     print("Received request to delete ALL user indices.")
     try:
@@ -140,14 +397,10 @@ async def delete_all(key: str, response: Response):
                 statusCode=400,
             )
 
-        # 2. Delete the entire directory tree
-        print(f"Deleting directory: {base_path}")
-        shutil.rmtree(base_path)
-
-        # 3. CRITICAL: Recreate the base directory
-        # If you don't do this, future attempts to save indexes will fail.
+        # 2. Delete every index (the directory itself stays, with its lock files)
+        print(f"Deleting indexes in: {base_path}")
         base_path.mkdir(parents=True, exist_ok=True)
-        print(f"Recreated empty directory: {base_path}")
+        await asyncio.to_thread(vector_store.delete_all_vector_stores)
 
         return DeleteAllResponse(
             message="All user indices have been deleted successfully.",
@@ -164,3 +417,38 @@ async def delete_all(key: str, response: Response):
             message=f"An error occurred while deleting all indices: {e}",
             path_cleared="",
         )
+
+
+@router.get("/stats", response_model=StatsResponse)
+async def get_stats():
+    """
+    Returns this worker's cache counters (index, embedding and answer
+    caches), embedding batch metrics, per-route query latencies and web
+    search counters, plus the shared index's size when that backend is
+    enabled.
+    """
+    shared_index = None
+    if vector_store.uses_shared_index():
+        shared_index = await asyncio.to_thread(vector_store.get_shared_store().stats)
+    return StatsResponse(
+        index_cache=vector_store.index_cache.stats(),
+        embedding_cache=await asyncio.to_thread(vector_store.get_embeddings().stats),
+        embedding_pipeline=embedding_pipeline.metrics.stats(),
+        routes=query_router.metrics.stats(),
+        answer_cache=answer_cache.stats(),
+        shared_index=shared_index,
+        web_search=get_web_search().stats(),
+        statusCode=200,
+    )
+
+
+@router.get("/ready", response_model=ReadinessResponse)
+async def readiness(response: Response):
+    """
+    Readiness probe: 200 once this worker has built its LLM, embeddings
+    and agent clients, 503 while warm-up is still running (or failed).
+    """
+    warm_up = registry.status()
+    if not warm_up["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return ReadinessResponse(**warm_up, statusCode=response.status_code or 200)
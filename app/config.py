@@ -19,6 +19,157 @@ DATA_DIR = Path(os.getenv("DATA_DIR", "."))
 FAISS_INDEX_DIR = DATA_DIR / "faiss_indexes"
 TEMP_UPLOAD_DIR = DATA_DIR / "temp_uploads"
 
+# --- Models ---
+LLM_MODEL = "gemini-2.0-flash-lite"
+
+# --- Embeddings ---
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+# Persistent content-addressed cache of chunk and query embeddings
+EMBEDDING_CACHE_DIR = DATA_DIR / "embedding_cache"
+EMBEDDING_CACHE_MAX_BYTES = (
+    int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+)
+
+# Embedding requests: batch shape, and retry/backoff on quota errors
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_BATCH_MAX_CHARS = int(os.getenv("EMBED_BATCH_MAX_CHARS", "30000"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_SECONDS = float(os.getenv("EMBED_BACKOFF_SECONDS", "1.0"))
+EMBED_BACKOFF_MAX_SECONDS = float(os.getenv("EMBED_BACKOFF_MAX_SECONDS", "30"))
+
+# --- Index Cache ---
+# Loaded FAISS indexes are kept in memory per worker, bounded by size and idle time.
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_MB", "512")) * 1024 * 1024
+INDEX_CACHE_IDLE_SECONDS = float(os.getenv("INDEX_CACHE_IDLE_SECONDS", "900"))
+
+# --- Concurrency Limits (per worker) ---
+# OCR runs in a process pool (one page per task); the other stages are
+# bounded async calls.
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", "2"))
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", str(OCR_MAX_WORKERS)))
+# In-flight embedding requests, shared by all uploads on the worker
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+RETRIEVAL_CONCURRENCY = int(os.getenv("RETRIEVAL_CONCURRENCY", "32"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "4"))
+
+# --- OCR ---
+# Pages with at least this many extractable characters skip Tesseract
+OCR_MIN_CHARS_PER_PAGE = int(os.getenv("OCR_MIN_CHARS_PER_PAGE", "50"))
+
+# --- Query Routing ---
+# Report-local questions skip the ReAct agent and use a single LLM call
+QUERY_ROUTING_ENABLED = os.getenv("QUERY_ROUTING_ENABLED", "true").lower() == "true"
+
+# --- Agent Budgets ---
+# Per-request limits on a ReAct agent run: reasoning steps, wall-clock
+# seconds and LLM tokens (prompt + completion). A run that reaches one
+# stops and answers from what it has gathered, within
+# AGENT_STOP_ANSWER_SECONDS more.
+AGENT_MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "6"))
+AGENT_MAX_SECONDS = float(os.getenv("AGENT_MAX_SECONDS", "45"))
+AGENT_MAX_TOKENS = int(os.getenv("AGENT_MAX_TOKENS", "30000"))
+AGENT_STOP_ANSWER_SECONDS = float(os.getenv("AGENT_STOP_ANSWER_SECONDS", "10"))
+
+# --- Batch Queries ---
+# /query/batch: questions per request, and report questions answered
+# together in one LLM call
+BATCH_QUERY_MAX_QUESTIONS = int(os.getenv("BATCH_QUERY_MAX_QUESTIONS", "25"))
+BATCH_QUERY_GROUP_SIZE = int(os.getenv("BATCH_QUERY_GROUP_SIZE", "5"))
+
+# --- Semantic Answer Cache ---
+# Near-identical repeat questions against an unchanged index reuse the answer
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_PER_USER = int(os.getenv("ANSWER_CACHE_MAX_PER_USER", "64"))
+ANSWER_CACHE_MAX_USERS = int(os.getenv("ANSWER_CACHE_MAX_USERS", "1000"))
+
+# --- Uploads ---
+# Uploads are hashed and written to disk as they arrive; a body larger
+# than this is refused with 413 without reading the rest
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+
+# --- Background Ingestion Jobs ---
+INGEST_DB_PATH = DATA_DIR / "ingest_jobs.sqlite3"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "120"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "1.0"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+
+# --- Web Search ---
+# "duckduckgo", or "stub" for offline runs. Results are cached on disk by
+# normalized query; identical concurrent searches share one request.
+WEB_SEARCH_BACKEND = os.getenv("WEB_SEARCH_BACKEND", "duckduckgo")
+WEB_SEARCH_POOL_SIZE = int(os.getenv("WEB_SEARCH_POOL_SIZE", "2"))
+WEB_SEARCH_TIMEOUT_SECONDS = float(os.getenv("WEB_SEARCH_TIMEOUT_SECONDS", "8"))
+WEB_SEARCH_MAX_RESULTS = int(os.getenv("WEB_SEARCH_MAX_RESULTS", "5"))
+WEB_SEARCH_CACHE_PATH = DATA_DIR / "web_search_cache.sqlite3"
+WEB_SEARCH_CACHE_TTL_SECONDS = float(os.getenv("WEB_SEARCH_CACHE_TTL_SECONDS", "86400"))
+WEB_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("WEB_SEARCH_CACHE_MAX_ENTRIES", "10000"))
+
+# --- Observability ---
+# Per-request stage spans and token counts are exported on /metrics; with
+# TRACE_LOG_ENABLED each request's trace is also logged as one JSON line
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+TRACE_LOG_ENABLED = os.getenv("TRACE_LOG_ENABLED", "false").lower() == "true"
+
+# --- Chunking ---
+# "layout" keeps headings, paragraphs and table rows together in chunks of
+# at most CHUNK_MAX_TOKENS; "recursive" is the original 150-character splitter
+CHUNKING_STRATEGY = os.getenv("CHUNKING_STRATEGY", "layout")
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "20"))
+
+# --- Retrieval ---
+# MMR over the fetch_k nearest chunks; a BM25 weight above 0 blends in
+# lexical matching (exact analyte names such as "HbA1c")
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "5"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+RETRIEVAL_LAMBDA_MULT = float(os.getenv("RETRIEVAL_LAMBDA_MULT", "0.5"))
+RETRIEVAL_BM25_WEIGHT = float(os.getenv("RETRIEVAL_BM25_WEIGHT", "0.0"))
+
+# --- Context Assembly ---
+# Token budget (local estimate) for the health data in a question's prompt,
+# after merging overlapping chunks and dropping duplicate lines
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+
+# --- Structured Lab Values ---
+# Analyte/value/unit/range rows parsed at ingestion; queries naming a known
+# analyte get these (with range status computed locally) instead of chunks
+LAB_VALUES_ENABLED = os.getenv("LAB_VALUES_ENABLED", "true").lower() == "true"
+LAB_VALUES_DIR = FAISS_INDEX_DIR / "lab_values"
+
+# --- Report Summaries ---
+# Page summaries rolled up into a report summary at ingestion; getAllChunks
+# returns this bounded view and raw chunks are paged on demand
+REPORT_SUMMARY_ENABLED = os.getenv("REPORT_SUMMARY_ENABLED", "true").lower() == "true"
+REPORT_SUMMARIES_DIR = FAISS_INDEX_DIR / "summaries"
+PAGE_SUMMARY_MAX_CHARS = int(os.getenv("PAGE_SUMMARY_MAX_CHARS", "600"))
+REPORT_SUMMARY_MAX_CHARS = int(os.getenv("REPORT_SUMMARY_MAX_CHARS", "1500"))
+# Largest input to one roll-up call; longer reports are rolled up in levels
+SUMMARY_ROLLUP_MAX_CHARS = int(os.getenv("SUMMARY_ROLLUP_MAX_CHARS", "8000"))
+if SUMMARY_ROLLUP_MAX_CHARS < 2 * REPORT_SUMMARY_MAX_CHARS:
+    raise ValueError(
+        "SUMMARY_ROLLUP_MAX_CHARS must be at least twice REPORT_SUMMARY_MAX_CHARS."
+    )
+GET_ALL_CHUNKS_MAX_CHARS = int(os.getenv("GET_ALL_CHUNKS_MAX_CHARS", "4000"))
+REPORT_CHUNKS_PAGE_SIZE = int(os.getenv("REPORT_CHUNKS_PAGE_SIZE", "20"))
+
+# --- Vector Backend ---
+# "per_user" keeps one FAISS folder per user; "shared" puts every user in a
+# few sharded ID-mapped indexes filtered by user id range.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "per_user")
+SHARED_INDEX_DIR = FAISS_INDEX_DIR / "shared"
+SHARED_INDEX_SHARDS = int(os.getenv("SHARED_INDEX_SHARDS", "8"))
+# Deleted chunks are tombstoned and physically removed by periodic compaction
+SHARED_INDEX_COMPACT_INTERVAL_SECONDS = float(
+    os.getenv("SHARED_INDEX_COMPACT_INTERVAL_SECONDS", "3600")
+)
+SHARED_INDEX_COMPACT_MIN_TOMBSTONE_RATIO = float(
+    os.getenv("SHARED_INDEX_COMPACT_MIN_TOMBSTONE_RATIO", "0.2")
+)
+
 
 # import os
 # from dotenv import load_dotenv
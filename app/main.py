@@ -1,16 +1,86 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from app.api.endpoints import router as api_router
+from app.config import (
+    LOG_LEVEL,
+    SHARED_INDEX_COMPACT_INTERVAL_SECONDS,
+    SHARED_INDEX_COMPACT_MIN_TOMBSTONE_RATIO,
+)
+from app.services import (
+    concurrency,
+    embedding_pipeline,
+    ingest_jobs,
+    vector_store,
+)
+from app.services.answer_cache import answer_cache
+from app.services.registry import registry
+from app.services.shared_index import compaction_loop
+from app.services.tracing import render_metrics
+from app.services.web_search import get_web_search
+
+logging.basicConfig(
+    level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the LLM/embedding clients once per worker, without delaying
+    # startup; /api/ready reports when they are done.
+    warm_up = asyncio.create_task(registry.awarm_up())
+    await ingest_jobs.start_workers()
+    background = [warm_up]
+    if vector_store.uses_shared_index():
+        background.append(
+            asyncio.create_task(
+                compaction_loop(
+                    vector_store.get_shared_store(),
+                    SHARED_INDEX_COMPACT_INTERVAL_SECONDS,
+                    SHARED_INDEX_COMPACT_MIN_TOMBSTONE_RATIO,
+                )
+            )
+        )
+    yield
+    for task in background:
+        task.cancel()
+    await ingest_jobs.stop_workers()
+    # Stop the OCR process pool so worker restarts do not leak processes
+    concurrency.shutdown()
+
 
 app = FastAPI(
     title="Health Report RAG Agent",
     description="API for uploading health reports and querying them with a LangChain agent.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Include all the API routes from endpoints.py
 app.include_router(api_router, prefix="/api")
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    This worker's request/stage/tool latency histograms and LLM token
+    counters, plus cache and search counters, in Prometheus text format.
+    """
+    return PlainTextResponse(
+        render_metrics(
+            {
+                "index_cache": vector_store.index_cache.stats(),
+                "answer_cache": answer_cache.stats(),
+                "embedding_pipeline": embedding_pipeline.metrics.stats(),
+                "web_search": get_web_search().stats(),
+            }
+        ),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 @app.get("/", include_in_schema=False)
 async def root():
     return {
@@ -1,9 +1,18 @@
+from datetime import date
+
 from pydantic import BaseModel
 
 
 class QueryRequest(BaseModel):
     user_id: str
     query: str
+    # Skip the semantic answer cache and always compute a fresh answer
+    no_cache: bool = False
+    # Only use these reports (ids from /reports/{user_id}) and/or reports
+    # dated within this inclusive range
+    document_ids: list[str] | None = None
+    date_from: date | None = None
+    date_to: date | None = None
 
 
 class QueryResponse(BaseModel):
@@ -11,6 +20,43 @@ class QueryResponse(BaseModel):
     query: str
     message: str
     statusCode: int
+    cached: bool = False
+    # Set when the agent ran out of its budget (iterations, seconds, tokens
+    # or repeats) and answered from what it had found so far
+    stopped: str | None = None
+
+
+class BatchQueryRequest(BaseModel):
+    user_id: str
+    queries: list[str]
+    no_cache: bool = False
+    document_ids: list[str] | None = None
+    date_from: date | None = None
+    date_to: date | None = None
+
+
+class BatchAnswer(BaseModel):
+
+    query: str
+    message: str
+    statusCode: int
+    # report_local, full_report, web_search or cached
+    route: str
+    cached: bool = False
+    # The agent budget this answer ran out of, as in QueryResponse
+    stopped: str | None = None
+    # From the start of the batch until this answer was ready
+    seconds: float
+
+
+class BatchQueryResponse(BaseModel):
+
+    user_id: str
+    answers: list[BatchAnswer] = []
+    llm_calls: int = 0
+    seconds: float = 0.0
+    message: str = ""
+    statusCode: int
 
 
 class UploadResponse(BaseModel):
@@ -18,6 +64,38 @@ class UploadResponse(BaseModel):
     filename: str
     message: str
     statusCode: int
+    job_id: str | None = None
+    # Content hash of the uploaded report (the id used by /reports)
+    document_id: str | None = None
+
+
+class JobStatusResponse(BaseModel):
+    """Response model for polling a background ingestion job."""
+
+    job_id: str
+    user_id: str
+    filename: str
+    stage: str
+    progress: float
+    error: str | None = None
+    created_at: float
+    updated_at: float
+    statusCode: int
+
+
+class ReportInfo(BaseModel):
+    document_id: str | None
+    report_date: str | None
+    filename: str | None
+    chunks: int
+
+
+class ReportListResponse(BaseModel):
+    """Response model for the report list endpoint."""
+
+    user_id: str
+    reports: list[ReportInfo]
+    statusCode: int
 
 
 class DeleteRequest(BaseModel):
@@ -36,3 +114,26 @@ class DeleteAllResponse(BaseModel):
     message: str
     path_cleared: str
     statusCode: int
+
+
+class StatsResponse(BaseModel):
+    """Response model for the stats endpoint."""
+
+    index_cache: dict
+    embedding_cache: dict
+    embedding_pipeline: dict
+    routes: dict
+    answer_cache: dict
+    shared_index: dict | None = None
+    web_search: dict | None = None
+    statusCode: int
+
+
+class ReadinessResponse(BaseModel):
+    """Response model for the readiness endpoint."""
+
+    ready: bool
+    ready_after_seconds: float | None = None
+    build_seconds: dict
+    error: str | None = None
+    statusCode: int
@@ -0,0 +1,192 @@
+import contextvars
+import functools
+import inspect
+from dataclasses import dataclass
+from typing import Any, Callable
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from app.config import AGENT_MAX_ITERATIONS, AGENT_MAX_SECONDS, AGENT_MAX_TOKENS
+from app.services.chunking import count_tokens
+from app.services.tracing import AGENT_REPEATED_TOOL_CALLS, token_usage
+
+# An identical tool call (same tool, same input) is answered from the
+# run's memo this many times; one more means the agent is going in circles
+MAX_REPEATED_CALLS = 1
+
+# Tool name under which AgentExecutor feeds parse errors back to the model
+_PARSE_ERROR_TOOL = "_Exception"
+
+
+@dataclass(frozen=True)
+class AgentBudget:
+    """Limits for one agent run."""
+
+    max_iterations: int = AGENT_MAX_ITERATIONS
+    max_seconds: float = AGENT_MAX_SECONDS
+    max_tokens: int = AGENT_MAX_TOKENS
+
+
+class BudgetExhausted(Exception):
+    """Stops an agent run that reached one of its budgets."""
+
+    def __init__(self, budget: str):
+        super().__init__(f"Agent {budget} budget exhausted")
+        # "iterations", "seconds", "tokens" or "repeats"
+        self.budget = budget
+
+
+_current_run: contextvars.ContextVar["AgentRun | None"] = contextvars.ContextVar(
+    "current_agent_run", default=None
+)
+
+
+class AgentRun(AsyncCallbackHandler):
+    """
+    Budget accounting for one agent run, passed to it as a callback
+    handler. Every reasoning step starts with an LLM call, so steps and
+    tokens are checked there: the call that would exceed max_iterations or
+    max_tokens raises BudgetExhausted instead of being sent. A tool call
+    repeated more than MAX_REPEATED_CALLS times (or the same parse error
+    over and over) raises it too. Wall-clock time is left to the caller.
+
+    Tool observations are kept so a stopped run can still be answered
+    from what it found, and tool results are memoized for the run (see
+    memoized) while it is active.
+    """
+
+    # Exceptions raised here must stop the run rather than be logged
+    raise_error = True
+
+    def __init__(self, budget: AgentBudget):
+        self.budget = budget
+        self.iterations = 0
+        self.tokens = 0
+        self.repeated_calls = 0
+        # (tool, input, output) of each tool call, in order
+        self.observations: list[tuple[str, str, str]] = []
+        self._memo: dict[tuple, Any] = {}
+        self._calls: dict[tuple[str, str], int] = {}
+        self._prompt_tokens: dict[UUID, int] = {}
+        self._tools: dict[UUID, tuple[str, str]] = {}
+
+    def activate(self) -> contextvars.Token:
+        """Makes this the run whose memo tool calls in this context use."""
+        return _current_run.set(self)
+
+    @staticmethod
+    def deactivate(token: contextvars.Token) -> None:
+        _current_run.reset(token)
+
+    def _start_llm(self, run_id: UUID, prompt_tokens: int) -> None:
+        if self.iterations >= self.budget.max_iterations:
+            raise BudgetExhausted("iterations")
+        if self.tokens + prompt_tokens > self.budget.max_tokens:
+            raise BudgetExhausted("tokens")
+        self.iterations += 1
+        self._prompt_tokens[run_id] = prompt_tokens
+
+    async def on_llm_start(
+        self, serialized: dict, prompts: list[str], *, run_id: UUID, **kwargs
+    ) -> None:
+        self._start_llm(run_id, sum(count_tokens(prompt) for prompt in prompts))
+
+    async def on_chat_model_start(
+        self, serialized: dict, messages: list, *, run_id: UUID, **kwargs
+    ) -> None:
+        self._start_llm(
+            run_id,
+            sum(
+                count_tokens(str(message.content))
+                for batch in messages
+                for message in batch
+            ),
+        )
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        estimated_prompt = self._prompt_tokens.pop(run_id, 0)
+        usage = token_usage(response)
+        if usage is None:
+            usage = (
+                estimated_prompt,
+                sum(
+                    count_tokens(generation.text)
+                    for generations in response.generations
+                    for generation in generations
+                ),
+            )
+        self.tokens += sum(usage)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self.tokens += self._prompt_tokens.pop(run_id, 0)
+
+    async def on_tool_start(
+        self, serialized: dict, input_str: str, *, run_id: UUID, **kwargs
+    ) -> None:
+        tool = serialized.get("name", "")
+        key = (tool, " ".join(str(input_str).split()))
+        seen = self._calls.get(key, 0)
+        if seen > MAX_REPEATED_CALLS:
+            raise BudgetExhausted("repeats")
+        self._calls[key] = seen + 1
+        self._tools[run_id] = (tool, str(input_str))
+
+    async def on_tool_end(self, output, *, run_id: UUID, **kwargs) -> None:
+        tool, tool_input = self._tools.pop(run_id, ("", ""))
+        if tool != _PARSE_ERROR_TOOL:
+            self.observations.append((tool, tool_input, str(output)))
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._tools.pop(run_id, None)
+
+    def recall(self, key: tuple) -> tuple[bool, Any]:
+        """(True, result) for a tool call made before in this run."""
+        if key not in self._memo:
+            return False, None
+        self.repeated_calls += 1
+        AGENT_REPEATED_TOOL_CALLS.inc()
+        return True, self._memo[key]
+
+    def remember(self, key: tuple, result: Any) -> None:
+        self._memo[key] = result
+
+
+def memoized(name: str, fn: Callable) -> Callable:
+    """
+    Wraps a tool function (sync or async) so that, inside an active
+    AgentRun, an identical call returns the result of the first one
+    instead of fetching or searching again.
+    """
+
+    def key(args: tuple, kwargs: dict) -> tuple:
+        return (name, args, tuple(sorted(kwargs.items())))
+
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            run = _current_run.get()
+            if run is None:
+                return await fn(*args, **kwargs)
+            found, result = run.recall(key(args, kwargs))
+            if not found:
+                result = await fn(*args, **kwargs)
+                run.remember(key(args, kwargs), result)
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        run = _current_run.get()
+        if run is None:
+            return fn(*args, **kwargs)
+        found, result = run.recall(key(args, kwargs))
+        if not found:
+            result = fn(*args, **kwargs)
+            run.remember(key(args, kwargs), result)
+        return result
+
+    return wrapper
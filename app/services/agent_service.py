@@ -1,61 +1,150 @@
-from app.config import GOOGLE_API_KEY
-from app.services.vector_store import load_vector_store
+import asyncio
+import logging
+import re
+import time
+from typing import AsyncIterator
+from uuid import UUID
+from app.config import (
+    GOOGLE_API_KEY,
+    LLM_MODEL,
+    QUERY_ROUTING_ENABLED,
+    ANSWER_CACHE_ENABLED,
+    LAB_VALUES_ENABLED,
+    REPORT_CHUNKS_PAGE_SIZE,
+    BATCH_QUERY_GROUP_SIZE,
+    CONTEXT_MAX_TOKENS,
+    AGENT_MAX_ITERATIONS,
+    AGENT_STOP_ANSWER_SECONDS,
+)
+from app.services.vector_store import get_report_summary, get_user_chunks_page
 from fastapi import Response, status
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.agents import create_react_agent, AgentExecutor
-from langchain import hub
-from langchain_community.tools import DuckDuckGoSearchRun, tool
 from langchain.tools import StructuredTool
 from pydantic import BaseModel, Field
-from app.services.vector_store import get_retriever
+from app.services.vector_store import (
+    aget_retriever,
+    get_embeddings,
+    get_index_version,
+    lab_value_store,
+)
+from app.services.agent_budget import (
+    AgentBudget,
+    AgentRun,
+    BudgetExhausted,
+    memoized,
+)
+from app.services.chunking import count_tokens
+from app.services.context import assemble_context
+from app.services.lab_values import LabValue, format_lab_values
+from app.services.reports import ReportFilter
+from app.services.registry import registry
+from app.services.web_search import get_web_search
+from app.services.tracing import (
+    AGENT_BUDGET_EXHAUSTED,
+    CONTEXT_TOKENS,
+    Trace,
+    TracingCallbackHandler,
+    span,
+    trace_request,
+)
+from app.services.prompts import REACT_PROMPT
+from app.services.answer_cache import answer_cache
+from app.services.concurrency import stage_limit
+from app.services.query_router import (
+    REPORT_LOCAL,
+    WEB_SEARCH,
+    classify_query,
+    metrics as route_metrics,
+)
 from langchain_core.documents import Document
 from langchain.prompts import PromptTemplate
+from langchain_core.callbacks import AsyncCallbackHandler
+
+logger = logging.getLogger(__name__)
 
 # --- 1. Define Agent Tools ---
 
 
-@tool
-def search(query: str) -> str:
-    """
+def search_fn(query: str) -> str:
+    return get_web_search().search(query)
+
+
+async def asearch_fn(query: str) -> str:
+    # Cached, coalesced with identical in-flight searches, and time-bounded
+    return await get_web_search().asearch(query)
+
+
+# Tool results are memoized per agent run (see agent_budget.memoized), so
+# a repeated identical call costs nothing
+search = StructuredTool.from_function(
+    func=memoized("search", search_fn),
+    coroutine=memoized("search", asearch_fn),
+    name="search",
+    description="""
     Use this tool to search the web when the user query requires external info.
     Format strictly:
     Action: search
     Action Input: <your query>
-    """
-    search_tool = DuckDuckGoSearchRun()
-    results = search_tool.invoke(query)
-    return results
+    """,
+)
 
 
 class GetAllChunksInput(BaseModel):
     user_id: str = Field(..., description="Unique identifier of the user.")
 
 
+NO_DATA_MESSAGE = "No specific data found for this query."
+
+NO_REPORT_MESSAGE = (
+    "Error: No health report found for this user. Please upload a document first."
+)
+
+
 def getAllChunks_fn(user_id: str) -> list[str]:
-    print(f"🔍 [Tool] Fetching all chunks for user {user_id}...")
-    vectorstore = load_vector_store(user_id)
+    try:
+        summary = get_report_summary(user_id)
+        if summary is not None:
+            return summary
+        # No summary yet (still being built, or summarizing failed): fall
+        # back to the first page of raw chunks so the size stays bounded
+        return getReportChunks_fn(user_id)
+    except Exception as e:
+        logger.exception("getAllChunks failed for user %s", user_id)
+        return [f"Error fetching data: {e}"]
 
-    if vectorstore is None:
-        return [
-            "Error: No health report found for this user. Please upload a document first."
-        ]
 
+def getReportChunks_fn(user_id: str, page: int = 1) -> list[str]:
+    # The ReAct agent passes the whole Action Input as one string, so
+    # "user123 2" / "user123, page 2" also select a page
+    match = re.fullmatch(
+        r"\s*['\"]?(\S+?)['\"]?(?:[\s,:]+(?:page\s*)?(\d+))?\s*", user_id
+    )
+    if match:
+        user_id, page = match[1], int(match[2] or page)
+    page = max(1, page)
     try:
-        # Access all documents from the docstore
-        docs = [doc.page_content for doc in vectorstore.docstore._dict.values()]
-        print(f"✅ [Tool] Retrieved {len(docs)} chunks for user {user_id}")
-        return docs
+        result = get_user_chunks_page(user_id, page, REPORT_CHUNKS_PAGE_SIZE)
+        if result is None:
+            return [NO_REPORT_MESSAGE]
+        chunks, total_pages = result
+        if page > total_pages:
+            return [f"(Page {page} does not exist; there are {total_pages} pages.)"]
+        footer = f"(Raw chunks page {page} of {total_pages}."
+        if page < total_pages:
+            footer += f' Use "{user_id} {page + 1}" for the next page.'
+        return chunks + [footer + ")"]
     except Exception as e:
-        print(f"❌ [Tool] Error while fetching chunks for user {user_id}: {e}")
+        logger.exception("getReportChunks failed for user %s", user_id)
         return [f"Error fetching data: {e}"]
 
 
 getAllChunks = StructuredTool.from_function(
-    func=getAllChunks_fn,
+    func=memoized("getAllChunks", getAllChunks_fn),
     name="getAllChunks",
     description=""""
 Purpose:
 Use this tool only when the user's question requires understanding the entire health report, not just a few sections or lab results.
+It returns a bounded overview: the report summary, the out-of-range lab values and per-page summaries.
 
 When to use:
 
@@ -75,32 +164,73 @@ If the question focuses on a specific test, metric, or section (e.g., “What do
     args_schema=GetAllChunksInput,
 )
 
-# --- 2. Initialize Agent ---
 
-# llm
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash-lite",
-    google_api_key=GOOGLE_API_KEY,
-    temperature=0.2,
-    # convert_system_message_to_human=True,  # Helps with some ReAct prompts
-)
+class GetReportChunksInput(BaseModel):
+    user_id: str = Field(..., description="Unique identifier of the user.")
+    page: int = Field(1, description="1-based page of raw chunks to return.")
 
-tools = [search, getAllChunks]
 
-# Pull the standard ReAct prompt
-prompt_template = hub.pull("hwchase17/react")
+getReportChunks = StructuredTool.from_function(
+    func=memoized("getReportChunks", getReportChunks_fn),
+    name="getReportChunks",
+    description="""
+Purpose:
+Returns the raw text chunks of the user's health report, one page at a time.
 
-# Create the agent
-agent = create_react_agent(llm=llm, prompt=prompt_template, tools=tools)
+When to use:
+Only when the summary from getAllChunks lacks a detail you need (an exact
+line of the report that the summary left out).
 
-# Create the agent executor
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=tools,
-    verbose=True,  # Logs agent "thinking" to console
-    handle_parsing_errors=True,
+Action Input: the user id, optionally followed by a page number
+(e.g. "user123" for the first page, "user123 2" for the next).
+""",
+    args_schema=GetReportChunksInput,
 )
 
+# --- 2. Initialize Agent ---
+
+tools = [search, getAllChunks, getReportChunks]
+
+
+def _build_llm():
+    # Imported lazily: the Google client library is slow to import
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=LLM_MODEL,
+        google_api_key=GOOGLE_API_KEY,
+        temperature=0.2,
+        # convert_system_message_to_human=True,  # Helps with some ReAct prompts
+    )
+
+
+def _build_agent_executor() -> AgentExecutor:
+    # Create the agent from the vendored standard ReAct prompt
+    agent = create_react_agent(llm=get_llm(), prompt=REACT_PROMPT, tools=tools)
+
+    # Create the agent executor
+    return AgentExecutor(
+        agent=agent,
+        tools=tools,
+        handle_parsing_errors=True,
+        # Each run is bounded by its own budget (see _ainvoke_agent), which
+        # stops it with a best-effort answer first; this is only a backstop
+        max_iterations=AGENT_MAX_ITERATIONS + 1,
+    )
+
+
+registry.register("llm", _build_llm)
+registry.register("agent_executor", _build_agent_executor)
+
+
+def get_llm():
+    return registry.get("llm")
+
+
+def get_agent_executor() -> AgentExecutor:
+    return registry.get("agent_executor")
+
+
 # --- 3. Define the Agent's Input Prompt Template ---
 
 # This prompt guides the agent on *how* to answer the user's query
@@ -126,84 +256,853 @@ Your task:
     input_variables=["data", "query", "user_id"],
 )
 
-# --- 4. Main Query Function ---
+# --- 4. Budgeted Agent Runs ---
+
+# Asked of the LLM, without tools, when an agent run is stopped by a budget
+STOPPED_PROMPT_TEMPLATE = PromptTemplate(
+    template="""{input}
+
+You were looking into this with tools and have to stop now. What the tools returned:
+{findings}
+
+Without using any more tools, give the user your best answer now from the
+health data and the findings above. If something could not be determined,
+say so briefly.
+""",
+    input_variables=["input", "findings"],
+)
+
+STOPPED_FALLBACK_MESSAGE = (
+    "I'm sorry, I couldn't finish looking into this in time. "
+    "Please try again, or ask a more specific question."
+)
+
+
+def _stopped_findings(run: AgentRun) -> str:
+    """
+    The run's tool observations for the stop prompt, each distinct one
+    once: the newest that fit in CONTEXT_MAX_TOKENS, in the order found.
+    """
+    findings: list[str] = []
+    seen = set()
+    used = 0
+    for tool, tool_input, output in reversed(run.observations):
+        if (tool, output) in seen:
+            continue
+        seen.add((tool, output))
+        finding = f"{tool}({tool_input}):\n{output}"
+        used += count_tokens(finding)
+        if findings and used > CONTEXT_MAX_TOKENS:
+            break
+        findings.append(finding)
+    return "\n\n".join(reversed(findings)) or "(nothing yet)"
+
+
+async def _ainvoke_agent(
+    agent_input: str, callbacks: list, budget: AgentBudget | None = None
+) -> tuple[str, str | None]:
+    """
+    Runs the ReAct agent on agent_input within a budget (AGENT_MAX_* by
+    default): reasoning steps, LLM tokens and wall-clock seconds, with
+    identical tool calls answered from the run's memo and a loop of them
+    stopped. A run that reaches a budget is answered by one more LLM call
+    over what its tools returned, itself bounded by
+    AGENT_STOP_ANSWER_SECONDS, so a request never holds a worker much
+    longer than max_seconds.
+
+    Returns (answer, stopped): stopped is None for a finished run, else
+    the budget that ran out ("iterations", "seconds", "tokens" or
+    "repeats"). Cancelling the caller cancels the run.
+    """
+    run = AgentRun(budget or AgentBudget())
+    token = run.activate()
+    try:
+        response = await asyncio.wait_for(
+            get_agent_executor().ainvoke(
+                {"input": agent_input}, config={"callbacks": [*callbacks, run]}
+            ),
+            run.budget.max_seconds,
+        )
+        return response["output"], None
+    except BudgetExhausted as e:
+        stopped = e.budget
+    except asyncio.TimeoutError:
+        stopped = "seconds"
+    finally:
+        run.deactivate(token)
+
+    AGENT_BUDGET_EXHAUSTED.inc(budget=stopped)
+    logger.warning(
+        "Agent stopped by its %s budget after %d steps and %d tokens",
+        stopped,
+        run.iterations,
+        run.tokens,
+    )
+    with span(
+        "agent_stopped",
+        budget=stopped,
+        steps=run.iterations,
+        tokens=run.tokens,
+        repeated_calls=run.repeated_calls,
+    ):
+        prompt = STOPPED_PROMPT_TEMPLATE.invoke(
+            {"input": agent_input, "findings": _stopped_findings(run)}
+        ).to_string()
+        try:
+            reply = await asyncio.wait_for(
+                get_llm().ainvoke(prompt, config={"callbacks": callbacks}),
+                AGENT_STOP_ANSWER_SECONDS,
+            )
+            return reply.content, stopped
+        except Exception:
+            logger.exception("Best-effort answer after the %s budget failed", stopped)
+            return STOPPED_FALLBACK_MESSAGE, stopped
+
+
+# --- 5. Main Query Function ---
 
 
 def run_agent_query(user_id: str, query: str) -> dict:
+    """Synchronous wrapper around arun_agent_query for non-async callers."""
+    return asyncio.run(arun_agent_query(user_id, query))
+
+
+async def _aprepare_agent_input(
+    user_id: str, query: str, report_filter: ReportFilter | None = None
+) -> tuple[str | None, dict]:
     """
-    Runs the full RAG-then-Agent workflow:
-    1. Fetches the user's retriever.
-    2. Gets relevant docs.
-    3. Formats a prompt with the docs.
-    4. Invokes the agent with the rich prompt.
+    Steps 1-3 of the workflow: loads the retriever, fetches relevant docs
+    (from the reports report_filter selects, if given) and formats the
+    agent prompt.
+    Returns (agent_input, info); agent_input is None on failure, and info
+    is then the error response ({"code", "message"}). On success info holds
+    the number of chunks retrieved and of structured lab values used.
+
+    When the query names analytes found in the user's structured lab
+    values, those rows (with range status already computed) replace the
+    retrieved chunks as the prompt's health data.
     """
 
-    print(f"--- Starting new query for {user_id} ---")
+    # Step 0: Structured lab values for the analytes the query names
+    if LAB_VALUES_ENABLED:
+        try:
+            with span("lab_values") as attrs:
+                lab_values = await asyncio.to_thread(
+                    lab_value_store.find, user_id, query, report_filter
+                )
+                attrs["matched"] = len(lab_values)
+        except Exception as e:
+            logger.warning("Structured lab values skipped: %s", e)
+            lab_values = []
+        if lab_values:
+            agent_input = _format_agent_input(
+                user_id, query, _assemble_context(_lab_value_docs(lab_values))
+            )
+            if agent_input is not None:
+                return agent_input, {"chunks": 0, "lab_values": len(lab_values)}
 
     # Step 1: Load the retriever (as requested from Cell 114)
-    retriever = get_retriever(user_id)
+    with span("index_load"):
+        async with stage_limit("retrieval"):
+            retriever = await aget_retriever(user_id, report_filter)
     if not retriever:
-        return {
+        return None, {
             "code": status.HTTP_404_NOT_FOUND,
             "message": f"I'm sorry, but I couldn't find a health report for user {user_id}. Please upload one first.",
         }
 
-    print(f"✅ Retriever loaded for {user_id}")
-
     # Step 2: Fetch relevant docs (as requested from Cell 115)
     try:
-        docs: list[Document] = retriever.invoke(query)
+        with span("retrieval") as attrs:
+            async with stage_limit("retrieval"):
+                docs: list[Document] = await retriever.ainvoke(query)
+            attrs["chunks"] = len(docs)
         if not docs:
-            print(
-                "⚠️ No relevant documents found by retriever, agent will have to rely on tools."
-            )
-            fetched_data = ["No specific data found for this query."]
+            # The agent will have to rely on its tools
+            fetched_data = NO_DATA_MESSAGE
         else:
             # (From Cell 121)
-            fetched_data = [doc.page_content for doc in docs]
-            print(f"✅ Retriever found {len(fetched_data)} relevant chunks.")
+            fetched_data = _assemble_context(docs)
 
-    except Exception as e:
-        print(f"❌ Error during retrieval: {e}")
-        return {
+    except Exception:
+        logger.exception("Retrieval failed for user %s", user_id)
+        return None, {
             "code": status.HTTP_500_INTERNAL_SERVER_ERROR,
             "message": "I'm sorry, I encountered an error while retrieving your health data.",
         }
 
     # Step 3: Format the prompt with fetched data (as requested from Cell 123)
+    agent_input = _format_agent_input(user_id, query, fetched_data)
+    if agent_input is None:
+        return None, {
+            "code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+            "message": "I'm sorry, I encountered an error while preparing your query.",
+        }
+    return agent_input, {"chunks": len(docs), "lab_values": 0}
+
+
+def _lab_value_docs(lab_values: list[LabValue]) -> list[Document]:
+    return [Document(page_content=line) for line in format_lab_values(lab_values)]
+
+
+def _assemble_context(
+    docs: list[Document], max_tokens: int = CONTEXT_MAX_TOKENS
+) -> str:
+    """
+    The prompt's health data: merged, de-duplicated passages in page order
+    within the token budget (see app.services.context). The tokens saved
+    against the raw chunk list are recorded on the "context" span and the
+    rag_context_tokens_total counter; every agent step resends them.
+    """
+    with span("context") as attrs:
+        context = assemble_context(docs, max_tokens)
+        attrs.update(context.attrs())
+    CONTEXT_TOKENS.inc(context.raw_tokens, type="raw")
+    CONTEXT_TOKENS.inc(context.tokens, type="assembled")
+    return context.text
+
+
+def _format_agent_input(user_id: str, query: str, fetched_data: str) -> str | None:
+    try:
+        with span("prompt"):
+            agent_input_prompt = PROMPT_TEMPLATE.invoke(
+                {
+                    "data": fetched_data,
+                    "query": query,
+                    "user_id": user_id,
+                }
+            )
+
+    except Exception:
+        logger.exception("Formatting the agent prompt failed")
+        return None
+
+    return agent_input_prompt.to_string()
+
+
+def _choose_route(query: str, info: dict) -> str:
+    """Routes the query; without retrieved context only the agent can help."""
+    if not QUERY_ROUTING_ENABLED:
+        return WEB_SEARCH
+    route = classify_query(query)
+    if route == REPORT_LOCAL and info["chunks"] == 0 and not info["lab_values"]:
+        return WEB_SEARCH
+    return route
+
+
+async def _acheck_answer_cache(
+    user_id: str,
+    query: str,
+    use_cache: bool,
+    report_filter: ReportFilter | None = None,
+) -> tuple[str | None, tuple | None]:
+    """
+    Looks the query up in the semantic answer cache.
+    Returns (cached_answer, cache_key); cache_key is passed to
+    _store_answer once a fresh answer is ready, and is None when caching
+    does not apply (disabled, no index, embedding failed, or the query is
+    restricted to some reports).
+    """
+    if not ANSWER_CACHE_ENABLED or report_filter:
+        return None, None
     try:
-        agent_input_prompt = PROMPT_TEMPLATE.invoke(
-            {
-                "data": fetched_data,
-                "query": query,
-                "user_id": user_id,
+        index_version = await asyncio.to_thread(get_index_version, user_id)
+        if index_version is None:
+            return None, None
+        with span("answer_cache"):
+            query_vector = await get_embeddings().aembed_query(query)
+    except Exception as e:
+        logger.warning("Answer cache skipped: %s", e)
+        return None, None
+
+    cache_key = (query_vector, index_version)
+    if not use_cache:
+        return None, cache_key
+    return answer_cache.lookup(user_id, query_vector, index_version), cache_key
+
+
+def _store_answer(
+    user_id: str, query: str, cache_key: tuple | None, answer: str
+) -> None:
+    if cache_key is not None:
+        query_vector, index_version = cache_key
+        answer_cache.store(user_id, query_vector, query, answer, index_version)
+
+
+async def arun_agent_query(
+    user_id: str,
+    query: str,
+    use_cache: bool = True,
+    report_filter: ReportFilter | None = None,
+) -> dict:
+    """
+    Runs the full RAG-then-Agent workflow without blocking the event loop:
+    0. Returns a cached answer for a near-identical earlier query, unless
+       use_cache is False.
+    1. Fetches the user's retriever, restricted to the reports
+       report_filter selects (by document id or report date), if given.
+    2. Gets relevant docs.
+    3. Formats a prompt with the docs.
+    4. Answers report-local questions with a single LLM call, and invokes
+       the agent with the rich prompt only when tools are needed, within
+       its budget (see _ainvoke_agent). An answer the agent gave after
+       running out of budget is marked "stopped" and not cached.
+
+    Each stage is recorded as a span of the request's trace (see
+    app.services.tracing), including every LLM and tool call with token
+    counts.
+    """
+    with trace_request("query", user_id=user_id) as trace:
+        return await _arun_agent_query(user_id, query, use_cache, report_filter, trace)
+
+
+async def _arun_agent_query(
+    user_id: str,
+    query: str,
+    use_cache: bool,
+    report_filter: ReportFilter | None,
+    trace: Trace,
+) -> dict:
+    started = time.perf_counter()
+
+    cached_answer, cache_key = await _acheck_answer_cache(
+        user_id, query, use_cache, report_filter
+    )
+    if cached_answer is not None:
+        trace.attrs["route"] = "cached"
+        return {"code": status.HTTP_200_OK, "message": cached_answer, "cached": True}
+
+    agent_input, info = await _aprepare_agent_input(user_id, query, report_filter)
+    if agent_input is None:
+        return info
+
+    route = _choose_route(query, info)
+    trace.attrs["route"] = route
+    config = {"callbacks": [TracingCallbackHandler(trace)]}
+
+    try:
+        # Step 4a: Report-local question, the retrieved context is enough
+        if route == REPORT_LOCAL:
+            async with stage_limit("llm"):
+                answer = await get_llm().ainvoke(agent_input, config=config)
+            _store_answer(user_id, query, cache_key, answer.content)
+            return {
+                "code": status.HTTP_200_OK,
+                "message": answer.content,
             }
-        )
 
-        print(f"✅ Prompt formatted for agent.")
+        # Step 4b: Invoke the agent with the RAG-filled prompt (as requested)
+        async with stage_limit("llm"):
+            message, stopped = await _ainvoke_agent(agent_input, config["callbacks"])
+
+        if stopped:
+            # A best-effort answer is not worth reusing
+            return {"code": status.HTTP_200_OK, "message": message, "stopped": stopped}
+        _store_answer(user_id, query, cache_key, message)
+        return {
+            "code": status.HTTP_200_OK,
+            "message": message,
+        }
 
     except Exception as e:
-        print(f"❌ Error formatting prompt: {e}")
+        logger.exception("Agent execution failed for user %s", user_id)
         return {
             "code": status.HTTP_500_INTERNAL_SERVER_ERROR,
-            "message": "I'm sorry, I encountered an error while preparing your query.",
+            "message": f"I'm sorry, I encountered an error while processing your request : {e}.",
         }
 
-    # Step 4: Invoke the agent with the RAG-filled prompt (as requested)
-    try:
-        response = agent_executor.invoke(
-            {"input": agent_input_prompt.to_string()}  # Pass the formatted string
+    finally:
+        route_metrics.record(route, time.perf_counter() - started)
+
+
+# --- 6. Streaming Query Function ---
+
+
+class StreamingEventsHandler(AsyncCallbackHandler):
+    """
+    Forwards agent progress to a queue as it happens: tool start/finish
+    and the tokens of the final answer. ReAct output is streamed as
+    "Thought/Action/..." text, so only what follows "Final Answer:" is
+    forwarded as answer tokens.
+    """
+
+    FINAL_ANSWER_MARKER = "Final Answer:"
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self._text: dict[UUID, str] = {}
+        self._emitted: dict[UUID, int] = {}
+        self._tools: dict[UUID, str] = {}
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs) -> None:
+        text = self._text.get(run_id, "") + token
+        self._text[run_id] = text
+        marker = text.find(self.FINAL_ANSWER_MARKER)
+        if marker == -1:
+            return
+        start = max(
+            marker + len(self.FINAL_ANSWER_MARKER), self._emitted.get(run_id, 0)
         )
+        if start < len(text):
+            piece = text[start:]
+            if run_id not in self._emitted:
+                piece = piece.lstrip()
+            self._emitted[run_id] = len(text)
+            if piece:
+                await self.queue.put(("token", {"text": piece}))
 
-        print(f"✅ Agent execution complete.")
-        return {
+    async def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        self._text.pop(run_id, None)
+        self._emitted.pop(run_id, None)
+
+    async def on_tool_start(
+        self, serialized: dict, input_str: str, *, run_id: UUID, **kwargs
+    ) -> None:
+        self._tools[run_id] = serialized.get("name", "")
+        await self.queue.put(
+            ("tool_start", {"tool": self._tools[run_id], "input": input_str})
+        )
+
+    async def on_tool_end(self, output, *, run_id: UUID, **kwargs) -> None:
+        await self.queue.put(("tool_end", {"tool": self._tools.pop(run_id, "")}))
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        await self.queue.put(
+            ("tool_end", {"tool": self._tools.pop(run_id, ""), "error": str(error)})
+        )
+
+
+async def astream_agent_query(
+    user_id: str,
+    query: str,
+    use_cache: bool = True,
+    report_filter: ReportFilter | None = None,
+) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Streaming variant of arun_agent_query. Yields (event, data) pairs:
+    "retrieval" once context is ready, "tool_start"/"tool_end" around each
+    tool call (agent route only), "token" for pieces of the final answer,
+    then "done" with the full answer (or "error"). A cached answer is sent
+    as a single "done" event with "cached": true, an agent answer given
+    after running out of budget carries "stopped".
+    """
+    with trace_request("stream", user_id=user_id) as trace:
+        async for event, data in _astream_agent_query(
+            user_id, query, use_cache, report_filter, trace
+        ):
+            yield event, data
+
+
+async def _astream_agent_query(
+    user_id: str,
+    query: str,
+    use_cache: bool,
+    report_filter: ReportFilter | None,
+    trace: Trace,
+) -> AsyncIterator[tuple[str, dict]]:
+    started = time.perf_counter()
+
+    cached_answer, cache_key = await _acheck_answer_cache(
+        user_id, query, use_cache, report_filter
+    )
+    if cached_answer is not None:
+        trace.attrs["route"] = "cached"
+        yield "done", {
             "code": status.HTTP_200_OK,
-            "message": response["output"],
+            "message": cached_answer,
+            "cached": True,
         }
+        return
+
+    agent_input, info = await _aprepare_agent_input(user_id, query, report_filter)
+    if agent_input is None:
+        yield "error", info
+        return
+
+    yield "retrieval", {
+        "chunks": info["chunks"],
+        "lab_values": info["lab_values"],
+        "elapsed": round(time.perf_counter() - started, 3),
+    }
+
+    route = _choose_route(query, info)
+    trace.attrs["route"] = route
+    tracing = TracingCallbackHandler(trace)
+    stream = (
+        _astream_direct_answer(agent_input, tracing)
+        if route == REPORT_LOCAL
+        else _astream_agent(agent_input, tracing)
+    )
+    try:
+        async for event, data in stream:
+            if event == "done" and not data.get("stopped"):
+                _store_answer(user_id, query, cache_key, data["message"])
+            yield event, data
+    finally:
+        route_metrics.record(route, time.perf_counter() - started)
+
+
+async def _astream_direct_answer(
+    agent_input: str, tracing: TracingCallbackHandler
+) -> AsyncIterator[tuple[str, dict]]:
+    """Streams a single direct LLM answer for report-local questions."""
+    try:
+        parts = []
+        async with stage_limit("llm"):
+            async for chunk in get_llm().astream(
+                agent_input, config={"callbacks": [tracing]}
+            ):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield "token", {"text": chunk.content}
+        yield "done", {"code": status.HTTP_200_OK, "message": "".join(parts)}
 
     except Exception as e:
-        print(f"❌ Error during agent execution: {e}")
-        return {
+        logger.exception("Streaming direct answer failed")
+        yield "error", {
+            "code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+            "message": f"I'm sorry, I encountered an error while processing your request : {e}.",
+        }
+
+
+async def _astream_agent(
+    agent_input: str, tracing: TracingCallbackHandler
+) -> AsyncIterator[tuple[str, dict]]:
+    """Runs the agent, yielding tool and final-answer events as they happen."""
+    queue: asyncio.Queue = asyncio.Queue()
+    handler = StreamingEventsHandler(queue)
+
+    async def run_agent() -> tuple[str, str | None]:
+        try:
+            async with stage_limit("llm"):
+                return await _ainvoke_agent(agent_input, [handler, tracing])
+        finally:
+            await queue.put(None)
+
+    task = asyncio.create_task(run_agent())
+    try:
+        while (item := await queue.get()) is not None:
+            yield item
+        message, stopped = await task
+        done = {"code": status.HTTP_200_OK, "message": message}
+        if stopped:
+            done["stopped"] = stopped
+        yield "done", done
+
+    except Exception as e:
+        logger.exception("Streaming agent execution failed")
+        yield "error", {
             "code": status.HTTP_500_INTERNAL_SERVER_ERROR,
             "message": f"I'm sorry, I encountered an error while processing your request : {e}.",
         }
+
+    finally:
+        # Client went away mid-stream: stop the agent instead of finishing it
+        if not task.done():
+            task.cancel()
+
+
+# --- 7. Batch Query Function ---
+
+# Several report questions answered in one LLM call over their merged
+# context; each answer starts with its question's marker
+BATCH_PROMPT_TEMPLATE = PromptTemplate(
+    template="""
+You are given a user's personal health report data and several questions about it.
+
+User ID: {user_id}
+
+Health Data:
+{data}
+
+Questions:
+{questions}
+
+Answer every question separately. For each answer:
+1. Analyze whether each reported value it concerns is within or outside its normal range.
+2. Respond naturally and helpfully:
+   - ✅ Within range → Give a reassuring message and include the stats.
+   - ⚠️ Outside range → Give a kind, short explanation of possible causes and one-line advice or precaution.
+3. Adapt your tone to sound caring, knowledgeable, and clear — like a friendly health advisor.
+4. Keep your explanation concise and professional.
+5. Include the numeric stats and normal ranges where relevant.
+
+Start each answer on a new line with its question's marker (e.g. [[Q1]]),
+answer the questions in order, and do not combine answers.
+""",
+    input_variables=["data", "questions", "user_id"],
+)
+
+_ANSWER_MARKER = re.compile(r"^\s*\[\[Q(\d+)\]\][ \t]*:?", re.MULTILINE)
+
+
+def _split_answers(text: str, count: int) -> dict[int, str]:
+    """Answers of a batch reply by 0-based question number (missing ones left out)."""
+    markers = list(_ANSWER_MARKER.finditer(text))
+    answers = {}
+    for marker, following in zip(markers, markers[1:] + [None]):
+        number = int(marker[1]) - 1
+        end = following.start() if following else len(text)
+        answer = text[marker.end() : end].strip()
+        if 0 <= number < count and answer and number not in answers:
+            answers[number] = answer
+    return answers
+
+
+def _group_by_context(contexts: dict[int, list[str]], size: int) -> list[list[int]]:
+    """
+    Groups questions for consolidated LLM calls, at most `size` each. A
+    group grows with the question whose context overlaps its merged
+    context most, so shared chunks are sent once per call.
+    """
+    remaining = list(contexts)
+    groups = []
+    while remaining:
+        group = [remaining.pop(0)]
+        merged = set(contexts[group[0]])
+        while remaining and len(group) < size:
+            best = max(remaining, key=lambda i: len(merged & set(contexts[i])))
+            remaining.remove(best)
+            group.append(best)
+            merged.update(contexts[best])
+        groups.append(group)
+    return groups
+
+
+async def arun_batch_query(
+    user_id: str,
+    queries: list[str],
+    use_cache: bool = True,
+    report_filter: ReportFilter | None = None,
+) -> dict:
+    """
+    Answers a fixed set of questions about one user's reports (a dashboard)
+    in one pass instead of one arun_agent_query per question:
+    1. Loads the index once and embeds all questions in one request.
+    2. Answers near-identical earlier questions from the answer cache.
+    3. Retrieves context for every question with one nearest-neighbour
+       search over the query matrix (structured lab values, when a
+       question names them, replace its chunks as in arun_agent_query).
+    4. Groups report-local questions by overlapping context and answers
+       each group with one LLM call over its merged, de-duplicated
+       context; a question missing from a group's reply is retried on
+       its own. Questions that need tools run through the agent.
+
+    Returns {"code", "message"} if the batch cannot run, else
+    {"code": 200, "answers", "llm_calls"}; each answer has the query,
+    code, message, route, cached, stopped (the agent budget it ran out
+    of, if any) and seconds (from the start of the batch until that
+    answer was ready).
+    """
+    with trace_request("batch", user_id=user_id, questions=len(queries)) as trace:
+        return await _arun_batch_query(
+            user_id, queries, use_cache, report_filter, trace
+        )
+
+
+async def _arun_batch_query(
+    user_id: str,
+    queries: list[str],
+    use_cache: bool,
+    report_filter: ReportFilter | None,
+    trace: Trace,
+) -> dict:
+    started = time.perf_counter()
+    answers: list[dict | None] = [None] * len(queries)
+    llm_calls = 0
+
+    def finish(
+        i: int,
+        route: str,
+        message: str,
+        code: int = status.HTTP_200_OK,
+        stopped: str | None = None,
+    ) -> None:
+        seconds = time.perf_counter() - started
+        answers[i] = {
+            "query": queries[i],
+            "code": code,
+            "message": message,
+            "route": route,
+            "cached": route == "cached",
+            "stopped": stopped,
+            "seconds": round(seconds, 3),
+        }
+        if route != "cached":
+            route_metrics.record(route, seconds)
+
+    # Step 1: One index load and one embedding request for all questions
+    with span("index_load"):
+        async with stage_limit("retrieval"):
+            retriever = await aget_retriever(user_id, report_filter)
+    if not retriever:
+        return {
+            "code": status.HTTP_404_NOT_FOUND,
+            "message": f"I'm sorry, but I couldn't find a health report for user {user_id}. Please upload one first.",
+        }
+    try:
+        with span("embedding") as attrs:
+            query_vectors = await get_embeddings().aembed_queries(queries)
+            attrs["queries"] = len(queries)
+    except Exception:
+        logger.exception("Embedding batch queries failed for user %s", user_id)
+        return {
+            "code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+            "message": "I'm sorry, I encountered an error while preparing your queries.",
+        }
+
+    # Step 2: Answer cache, keyed by the vectors already computed
+    index_version = None
+    if ANSWER_CACHE_ENABLED and not report_filter:
+        index_version = await asyncio.to_thread(get_index_version, user_id)
+    if use_cache and index_version is not None:
+        with span("answer_cache") as attrs:
+            for i, query_vector in enumerate(query_vectors):
+                cached = answer_cache.lookup(user_id, query_vector, index_version)
+                if cached is not None:
+                    finish(i, "cached", cached)
+            attrs["hits"] = sum(answer is not None for answer in answers)
+    pending = [i for i in range(len(queries)) if answers[i] is None]
+
+    # Step 3: Context for every remaining question
+    contexts: dict[int, list[Document]] = {}
+    info: dict[int, dict] = {}
+    if LAB_VALUES_ENABLED and pending:
+        try:
+            with span("lab_values") as attrs:
+                found = await asyncio.to_thread(
+                    lambda: [
+                        lab_value_store.find(user_id, queries[i], report_filter)
+                        for i in pending
+                    ]
+                )
+                attrs["matched"] = sum(len(values) for values in found)
+        except Exception as e:
+            logger.warning("Structured lab values skipped: %s", e)
+            found = [[] for _ in pending]
+        for i, values in zip(pending, found):
+            if values:
+                contexts[i] = _lab_value_docs(values)
+                info[i] = {"chunks": 0, "lab_values": len(values)}
+
+    need_docs = [i for i in pending if i not in contexts]
+    if need_docs:
+        try:
+            with span("retrieval") as attrs:
+                async with stage_limit("retrieval"):
+                    docs = await asyncio.to_thread(
+                        retriever.select_many,
+                        [queries[i] for i in need_docs],
+                        [query_vectors[i] for i in need_docs],
+                    )
+                attrs["chunks"] = sum(len(found) for found in docs)
+        except Exception:
+            logger.exception("Batch retrieval failed for user %s", user_id)
+            return {
+                "code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "message": "I'm sorry, I encountered an error while retrieving your health data.",
+            }
+        for i, found in zip(need_docs, docs):
+            contexts[i] = found
+            info[i] = {"chunks": len(found), "lab_values": 0}
+
+    # Step 4: Consolidated LLM calls for report questions, the agent for
+    # the rest
+    config = {"callbacks": [TracingCallbackHandler(trace)]}
+    routes = {i: _choose_route(queries[i], info[i]) for i in pending}
+
+    def store(i: int, route: str, message: str) -> None:
+        finish(i, route, message)
+        if index_version is not None:
+            _store_answer(
+                user_id, queries[i], (query_vectors[i], index_version), message
+            )
+
+    def fail(i: int, route: str, e: Exception) -> None:
+        finish(
+            i,
+            route,
+            f"I'm sorry, I encountered an error while processing your request : {e}.",
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+    async def answer_one(i: int) -> None:
+        nonlocal llm_calls
+        data = _assemble_context(contexts[i]) if contexts[i] else NO_DATA_MESSAGE
+        agent_input = _format_agent_input(user_id, queries[i], data)
+        try:
+            if agent_input is None:
+                raise ValueError("the prompt could not be prepared")
+            llm_calls += 1
+            stopped = None
+            async with stage_limit("llm"):
+                if routes[i] == REPORT_LOCAL:
+                    reply = await get_llm().ainvoke(agent_input, config=config)
+                    message = reply.content
+                else:
+                    message, stopped = await _ainvoke_agent(
+                        agent_input, config["callbacks"]
+                    )
+            if stopped:
+                finish(i, routes[i], message, stopped=stopped)
+            else:
+                store(i, routes[i], message)
+        except Exception as e:
+            logger.exception("Batch question failed for user %s", user_id)
+            fail(i, routes[i], e)
+
+    async def answer_group(group: list[int]) -> None:
+        nonlocal llm_calls
+        if len(group) == 1:
+            return await answer_one(group[0])
+        # Chunks retrieved for several questions of the group are sent once
+        merged = [doc for i in group for doc in contexts[i]]
+        try:
+            data = (
+                _assemble_context(merged, CONTEXT_MAX_TOKENS * len(group))
+                if merged
+                else NO_DATA_MESSAGE
+            )
+            with span("prompt"):
+                prompt = BATCH_PROMPT_TEMPLATE.invoke(
+                    {
+                        "data": data,
+                        "questions": "\n".join(
+                            f"[[Q{n}]] {queries[i]}" for n, i in enumerate(group, 1)
+                        ),
+                        "user_id": user_id,
+                    }
+                ).to_string()
+            llm_calls += 1
+            async with stage_limit("llm"):
+                reply = await get_llm().ainvoke(prompt, config=config)
+            split = _split_answers(reply.content, len(group))
+        except Exception:
+            logger.exception("Consolidated LLM call failed for user %s", user_id)
+            split = {}
+        for n, i in enumerate(group):
+            if n in split:
+                store(i, REPORT_LOCAL, split[n])
+        missing = [i for n, i in enumerate(group) if n not in split]
+        if missing:
+            logger.warning(
+                "Batch reply missed %d of %d answers; asking separately",
+                len(missing),
+                len(group),
+            )
+            await asyncio.gather(*(answer_one(i) for i in missing))
+
+    local = {
+        i: [doc.page_content for doc in contexts[i]]
+        for i in pending
+        if routes[i] == REPORT_LOCAL
+    }
+    groups = _group_by_context(local, max(1, BATCH_QUERY_GROUP_SIZE))
+    await asyncio.gather(
+        *(answer_group(group) for group in groups),
+        *(answer_one(i) for i in pending if routes[i] != REPORT_LOCAL),
+    )
+
+    trace.attrs["route"] = "batch"
+    trace.attrs["llm_calls"] = llm_calls
+    return {"code": status.HTTP_200_OK, "answers": answers, "llm_calls": llm_calls}
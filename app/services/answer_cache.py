@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.config import (
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_MAX_PER_USER,
+    ANSWER_CACHE_MAX_USERS,
+)
+
+
+@dataclass
+class _Entry:
+    vector: np.ndarray  # unit-normalized query embedding
+    query: str
+    answer: str
+    index_version: tuple
+    created: float
+
+
+class AnswerCache:
+    """
+    Per-user semantic cache of final answers.
+
+    A cached answer is reused when a new query's embedding has cosine
+    similarity >= threshold with a previous query from the same user, and
+    the user's index has not changed since (index_version). Entries expire
+    after ttl_seconds; each user keeps at most max_per_user entries and at
+    most max_users users are kept, both evicted least recently used.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        ttl_seconds: float,
+        max_per_user: int,
+        max_users: int,
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_per_user = max_per_user
+        self.max_users = max_users
+        self._users: "OrderedDict[str, OrderedDict[int, _Entry]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def lookup(
+        self, user_id: str, vector: list[float], index_version: tuple
+    ) -> str | None:
+        """Returns the best matching cached answer, or None."""
+        query_vector = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            entries = self._users.get(user_id)
+            if not entries:
+                return None
+
+            for entry_id in [
+                entry_id
+                for entry_id, entry in entries.items()
+                if now - entry.created > self.ttl_seconds
+                or entry.index_version != index_version
+            ]:
+                del entries[entry_id]
+                self.expirations += 1
+            if not entries:
+                del self._users[user_id]
+                return None
+
+            ids = list(entries)
+            matrix = np.stack([entries[entry_id].vector for entry_id in ids])
+            similarities = matrix @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            entries.move_to_end(ids[best])
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return entries[ids[best]].answer
+
+    def store(
+        self,
+        user_id: str,
+        vector: list[float],
+        query: str,
+        answer: str,
+        index_version: tuple,
+    ) -> None:
+        entry = _Entry(
+            self._normalize(vector), query, answer, index_version, time.time()
+        )
+        with self._lock:
+            entries = self._users.setdefault(user_id, OrderedDict())
+            self._users.move_to_end(user_id)
+            entries[self._next_id] = entry
+            self._next_id += 1
+            self.stores += 1
+
+            while len(entries) > self.max_per_user:
+                entries.popitem(last=False)
+                self.evictions += 1
+            while len(self._users) > self.max_users:
+                _, evicted = self._users.popitem(last=False)
+                self.evictions += len(evicted)
+
+    def invalidate(self, user_id: str) -> None:
+        """Drops every cached answer for a user (their index changed)."""
+        with self._lock:
+            if self._users.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += len(self._users)
+            self._users.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "entries": sum(len(entries) for entries in self._users.values()),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Shared by the query path (lookups) and vector_store (invalidation)
+answer_cache = AnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    max_per_user=ANSWER_CACHE_MAX_PER_USER,
+    max_users=ANSWER_CACHE_MAX_USERS,
+)
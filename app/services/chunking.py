@@ -0,0 +1,295 @@
+import re
+import statistics
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Protocol
+
+import pdfplumber
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Words, numbers and single punctuation marks. Subword tokenizers split a
+# little finer, but this tracks their counts closely enough for sizing
+# chunks without pulling in a tokenizer.
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    return len(_TOKEN.findall(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """text cut after its first max_tokens tokens (as count_tokens counts)."""
+    if max_tokens <= 0:
+        return ""
+    for number, match in enumerate(_TOKEN.finditer(text), start=1):
+        if number == max_tokens:
+            return text[: match.end()]
+    return text
+
+
+class Chunker(Protocol):
+    """Turns a loaded report (one Document per page) into index chunks."""
+
+    name: str
+
+    def split(self, pdf_path: Path, pages: list[Document]) -> list[Document]: ...
+
+
+class RecursiveChunker:
+    """The original fixed-size character splitter (150 chars, 20 overlap)."""
+
+    name = "recursive"
+
+    def __init__(self, chunk_size: int = 150, chunk_overlap: int = 20):
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+
+    def split(self, pdf_path: Path, pages: list[Document]) -> list[Document]:
+        return self.splitter.split_documents(pages)
+
+
+@dataclass
+class _Line:
+    text: str
+    heading: bool = False
+    table: int | None = None  # id of the table the line belongs to
+    break_before: bool = False  # paragraph/section gap above the line
+
+
+_NUMERIC = re.compile(r"\d")
+_ROW_LIKE = re.compile(
+    r"\d[\d,]*(?:\.\d+)?\s*(?:-|–|to)\s*\d|[<>]=?\s*\d|\d\s+\S+\s+\d"
+)
+
+
+def _looks_like_heading(text: str) -> bool:
+    text = text.strip()
+    if not text or len(text) > 60 or _NUMERIC.search(text):
+        return False
+    letters = [c for c in text if c.isalpha()]
+    return text.endswith(":") or (len(letters) >= 3 and text.upper() == text)
+
+
+def _attach_table_headers(lines: list[_Line]) -> list[_Line]:
+    """
+    Moves a table's header row ("Test  Result  Unit  Range") into the
+    table: the line right above its first row, unless that line is the
+    only heading of its section.
+    """
+    for i in range(1, len(lines)):
+        line, above = lines[i], lines[i - 1]
+        starts_table = line.table is not None and above.table != line.table
+        if not starts_table or line.break_before or above.table is not None:
+            continue
+        if above.heading and not (i >= 2 and lines[i - 2].heading):
+            continue
+        above.heading = False
+        above.table = line.table
+    return lines
+
+
+def _text_lines(text: str) -> list[_Line]:
+    """Line structure recovered from plain text (OCR'd pages)."""
+    lines: list[_Line] = []
+    gap = False
+    table = 0
+    for raw in text.splitlines():
+        raw = raw.strip()
+        if not raw:
+            gap = True
+            continue
+        heading = _looks_like_heading(raw)
+        row = not heading and bool(_ROW_LIKE.search(raw))
+        if row and not (lines and lines[-1].table == table):
+            table += 1
+        lines.append(
+            _Line(raw, heading=heading, table=table if row else None, break_before=gap)
+        )
+        gap = False
+    return _attach_table_headers(lines)
+
+
+def _layout_lines(page: pdfplumber.page.Page) -> list[_Line]:
+    """
+    Line structure from pdfplumber's layout: headings by font size/weight,
+    tables by detected table bounding boxes (falling back to row shape for
+    unruled tables), and paragraph breaks by vertical gaps.
+    """
+    raw_lines = [line for line in page.extract_text_lines() if line["text"].strip()]
+    if not raw_lines:
+        return []
+    sizes = [statistics.median(c["size"] for c in line["chars"]) for line in raw_lines]
+    body_size = statistics.median(sizes)
+    heights = [line["bottom"] - line["top"] for line in raw_lines]
+    line_height = statistics.median(heights) or 1
+    boxes = [table.bbox for table in page.find_tables()]
+
+    lines: list[_Line] = []
+    previous_bottom = None
+    unruled = len(boxes)
+    for raw, size in zip(raw_lines, sizes):
+        text = raw["text"].strip()
+        middle = (raw["top"] + raw["bottom"]) / 2
+        table = next(
+            (
+                i
+                for i, (_, top, _, bottom) in enumerate(boxes)
+                if top <= middle <= bottom
+            ),
+            None,
+        )
+        bold = all("Bold" in c.get("fontname", "") for c in raw["chars"])
+        heading = table is None and (
+            size > body_size * 1.15
+            or (bold and len(text) <= 60 and not _NUMERIC.search(text))
+            or _looks_like_heading(text)
+        )
+        if table is None and not heading and _ROW_LIKE.search(text):
+            # Consecutive row-shaped lines outside any ruled table form
+            # one unruled table
+            if not (lines and lines[-1].table == unruled):
+                unruled += 1
+            table = unruled
+        gap = (
+            previous_bottom is not None
+            and raw["top"] - previous_bottom > 0.8 * line_height
+        )
+        lines.append(_Line(text, heading=heading, table=table, break_before=gap))
+        previous_bottom = raw["bottom"]
+    return _attach_table_headers(lines)
+
+
+class LayoutChunker:
+    """
+    Chunks by layout instead of by character count.
+
+    Each page is read as lines (with pdfplumber layout for text-layer
+    pages, from the text for OCR'd pages) grouped into blocks: a heading
+    starts a section, table rows form a table block, and vertical gaps
+    separate paragraphs. Blocks are packed into chunks of at most
+    max_tokens without ever splitting a line, so a lab row keeps its
+    value, unit and reference range together. A table too long for one
+    chunk continues in the next, repeating its section heading and header
+    row; long paragraphs overlap by overlap_tokens.
+    """
+
+    name = "layout"
+
+    def __init__(self, max_tokens: int = 200, overlap_tokens: int = 20):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def split(self, pdf_path: Path, pages: list[Document]) -> list[Document]:
+        chunks: list[Document] = []
+        with pdfplumber.open(pdf_path) as pdf:
+            for doc in pages:
+                if doc.metadata.get("extraction") == "text_layer":
+                    page = pdf.pages[doc.metadata["page"]]
+                    lines = _layout_lines(page)
+                    page.close()
+                else:
+                    lines = _text_lines(doc.page_content)
+                chunks += [
+                    Document(page_content=text, metadata=dict(doc.metadata))
+                    for text in self._pack(lines)
+                ]
+        return chunks
+
+    def _blocks(self, lines: list[_Line]) -> list[tuple[str | None, list[_Line]]]:
+        """(section heading, lines) blocks; table rows always share a block."""
+        blocks: list[tuple[str | None, list[_Line]]] = []
+        heading: str | None = None
+        for line in lines:
+            if line.heading:
+                heading = line.text
+                blocks.append((heading, []))
+                continue
+            current = blocks[-1][1] if blocks else []
+            if not blocks or (
+                current
+                and (
+                    line.table != current[-1].table
+                    or (line.table is None and line.break_before)
+                )
+            ):
+                blocks.append((heading, []))
+            blocks[-1][1].append(line)
+        return [(heading, block) for heading, block in blocks if block]
+
+    def _pack(self, lines: list[_Line]) -> list[str]:
+        chunks: list[str] = []
+        current: list[str] = []
+        size = 0
+        current_heading = None
+
+        def flush():
+            nonlocal current, size
+            if current:
+                chunks.append("\n".join(current))
+            current, size = [], 0
+
+        for heading, block in self._blocks(lines):
+            block_texts = [line.text for line in block]
+            block_size = sum(count_tokens(text) for text in block_texts)
+            prefix = [heading] if heading and heading != current_heading else []
+            prefix_size = sum(count_tokens(text) for text in prefix)
+
+            # Whole block fits in the current chunk (or a fresh one)
+            if size + prefix_size + block_size > self.max_tokens:
+                flush()
+                prefix = [heading] if heading else []
+                prefix_size = sum(count_tokens(text) for text in prefix)
+            if prefix_size + block_size <= self.max_tokens:
+                current += prefix + block_texts
+                size += prefix_size + block_size
+                current_heading = heading
+                continue
+
+            # Block larger than a chunk: split between lines
+            is_table = block[0].table is not None
+            repeat = prefix + (block_texts[:1] if is_table else [])
+            current, size = list(prefix), prefix_size
+            for i, text in enumerate(block_texts):
+                tokens = count_tokens(text)
+                if (
+                    current
+                    and size + tokens > self.max_tokens
+                    and len(current) > len(repeat)
+                ):
+                    flush()
+                    if is_table:
+                        carry = repeat
+                    else:
+                        carry, carried = [], 0
+                        for previous in reversed(block_texts[:i]):
+                            carried += count_tokens(previous)
+                            if carried > self.overlap_tokens:
+                                break
+                            carry.insert(0, previous)
+                        carry = prefix + carry
+                    current = list(carry)
+                    size = sum(count_tokens(t) for t in current)
+                current.append(text)
+                size += tokens
+            current_heading = heading
+        flush()
+        return chunks
+
+
+CHUNKERS = {
+    RecursiveChunker.name: RecursiveChunker,
+    LayoutChunker.name: LayoutChunker,
+}
+
+
+def get_chunker(name: str, max_tokens: int, overlap_tokens: int) -> Chunker:
+    """Builds the named chunking strategy ("recursive" ignores the sizes)."""
+    if name not in CHUNKERS:
+        raise ValueError(
+            f"Unknown chunking strategy {name!r}; use one of {list(CHUNKERS)}."
+        )
+    if name == RecursiveChunker.name:
+        return RecursiveChunker()
+    return CHUNKERS[name](max_tokens=max_tokens, overlap_tokens=overlap_tokens)
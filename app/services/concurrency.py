@@ -0,0 +1,75 @@
+import asyncio
+import functools
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+from app.config import (
+    OCR_MAX_WORKERS,
+    OCR_CONCURRENCY,
+    EMBED_CONCURRENCY,
+    RETRIEVAL_CONCURRENCY,
+    LLM_CONCURRENCY,
+    SEARCH_CONCURRENCY,
+)
+
+# --- Per-stage concurrency limits ---
+# Each request stage gets its own semaphore so, e.g., a burst of uploads
+# cannot use up every slot that queries need for the LLM.
+
+STAGE_LIMITS = {
+    "ocr": OCR_CONCURRENCY,
+    "embedding": EMBED_CONCURRENCY,
+    "retrieval": RETRIEVAL_CONCURRENCY,
+    "llm": LLM_CONCURRENCY,
+    "search": SEARCH_CONCURRENCY,
+}
+
+# Semaphores are bound to the event loop they are first used on, so keep
+# one set per loop (sync wrappers run their own loop via asyncio.run).
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def stage_limit(stage: str) -> asyncio.Semaphore:
+    """Returns the semaphore bounding concurrent work for a pipeline stage."""
+    loop_semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    if stage not in loop_semaphores:
+        loop_semaphores[stage] = asyncio.Semaphore(STAGE_LIMITS[stage])
+    return loop_semaphores[stage]
+
+
+# --- CPU-bound work ---
+
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Lazily creates the bounded process pool used for OCR.
+    'spawn' avoids forking a gunicorn worker that already has threads.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=OCR_MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+async def run_in_process(func: Callable[..., Any], *args: Any) -> Any:
+    """Runs a picklable top-level function in the process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_process_pool(), functools.partial(func, *args)
+    )
+
+
+def shutdown() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
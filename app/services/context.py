@@ -0,0 +1,212 @@
+import re
+from dataclasses import dataclass
+
+from langchain_core.documents import Document
+
+from app.services.chunking import count_tokens, truncate_tokens
+
+# Chunk numbers come from chunk_id "<document_id>:<n>"; neighbouring
+# numbers are neighbouring text of the same report
+_CHUNK_NUMBER = re.compile(r":(\d+)$")
+# Shortest shared text that counts as chunk overlap rather than chance
+_MIN_OVERLAP_CHARS = 8
+
+
+@dataclass
+class AssembledContext:
+    """The prompt context built from retrieved chunks, with its savings."""
+
+    text: str
+    chunks: int  # chunks (or lab value lines) given
+    passages: int  # passages in the text after merging
+    raw_tokens: int  # tokens of the chunks as a Python list repr
+    tokens: int
+    duplicate_lines: int
+    truncated: bool  # the token budget cut passages
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.raw_tokens - self.tokens)
+
+    def attrs(self) -> dict:
+        """Span attributes describing the assembly."""
+        return {
+            "chunks": self.chunks,
+            "passages": self.passages,
+            "raw_tokens": self.raw_tokens,
+            "tokens": self.tokens,
+            "saved_tokens": self.saved_tokens,
+            "duplicate_lines": self.duplicate_lines,
+            "truncated": self.truncated,
+        }
+
+
+@dataclass
+class _Passage:
+    rank: int  # best retrieval rank of its chunks
+    document_id: str | None
+    report_date: str | None
+    page: int | None
+    number: int | None  # chunk number of its last chunk
+    text: str
+
+
+def _chunk_number(doc: Document) -> int | None:
+    match = _CHUNK_NUMBER.search(str(doc.metadata.get("chunk_id", "")))
+    return int(match[1]) if match else None
+
+
+def _join_overlapping(first: str, second: str) -> str:
+    """first + second, without the text second repeats from first's end."""
+    for size in range(min(len(first), len(second)), _MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+def _merge(docs: list[Document]) -> list[_Passage]:
+    """
+    Passages of consecutive chunks of the same report page joined into
+    one (their overlap kept once), in report, page and chunk order. Chunks
+    without a page (lab value lines, legacy chunks) stay separate and
+    come first.
+    """
+
+    def position(rank: int) -> tuple:
+        doc = docs[rank]
+        page = doc.metadata.get("page")
+        number = _chunk_number(doc)
+        return (
+            page is not None,
+            doc.metadata.get("report_date") or "",
+            doc.metadata.get("document_id") or "",
+            page if page is not None else -1,
+            number if number is not None else rank,
+            rank,
+        )
+
+    passages: list[_Passage] = []
+    seen_chunks: set[str] = set()
+    for rank in sorted(range(len(docs)), key=position):
+        doc = docs[rank]
+        chunk_id = doc.metadata.get("chunk_id")
+        if chunk_id is not None:
+            if chunk_id in seen_chunks:
+                continue
+            seen_chunks.add(chunk_id)
+        number = _chunk_number(doc)
+        document_id = doc.metadata.get("document_id")
+        previous = passages[-1] if passages else None
+        if (
+            previous is not None
+            and number is not None
+            and previous.number == number - 1
+            and previous.document_id == document_id
+            and previous.page == doc.metadata.get("page")
+        ):
+            previous.text = _join_overlapping(previous.text, doc.page_content)
+            previous.number = number
+            previous.rank = min(previous.rank, rank)
+            continue
+        passages.append(
+            _Passage(
+                rank=rank,
+                document_id=document_id,
+                report_date=doc.metadata.get("report_date"),
+                page=doc.metadata.get("page"),
+                number=number,
+                text=doc.page_content,
+            )
+        )
+    return passages
+
+
+def _header(passage: _Passage, several_reports: bool) -> str | None:
+    if passage.page is None:
+        return None
+    if several_reports and passage.report_date:
+        return f"[Report of {passage.report_date}, page {passage.page + 1}]"
+    return f"[Page {passage.page + 1}]"
+
+
+def assemble_context(docs: list[Document], max_tokens: int) -> AssembledContext:
+    """
+    Builds the prompt's health data from retrieved chunks, in place of
+    the Python list repr of their texts:
+    - consecutive chunks of a page are merged, their overlap kept once
+    - lines already included from the same report are dropped
+    - the most relevant passages (by retrieval order) are kept within
+      max_tokens, estimated with chunking.count_tokens; if even the first
+      line does not fit, it is cut to the budget rather than sending none
+    - passages are printed in report and page order under page headers
+
+    Tokens saved against the list repr are reported on the result.
+    """
+    raw_tokens = count_tokens(str([doc.page_content for doc in docs]))
+    passages = _merge(docs)
+    several_reports = len({p.document_id for p in passages if p.page is not None}) > 1
+
+    # Spend the budget on the most relevant passages first; duplicate
+    # lines are dropped in that order too, so the budget counts what is sent
+    seen_lines: set[tuple[str | None, str]] = set()
+    kept: dict[int, list[str]] = {}
+    used = 0
+    duplicates = 0
+    truncated = False
+    for index in sorted(range(len(passages)), key=lambda i: passages[i].rank):
+        passage = passages[index]
+        header = _header(passage, several_reports)
+        lines = []
+        cost = count_tokens(header) if header else 0
+        for line in passage.text.splitlines():
+            key = (passage.document_id, " ".join(line.split()).casefold())
+            if not key[1]:
+                continue
+            if key in seen_lines:
+                duplicates += 1
+                continue
+            tokens = count_tokens(line)
+            if used + cost + tokens > max_tokens:
+                truncated = True
+                if not kept and not lines:
+                    if cost >= max_tokens:
+                        # Not even room for the page header
+                        header, cost = None, 0
+                    line = truncate_tokens(line, max_tokens - cost)
+                    if line:
+                        lines.append(line.strip())
+                        cost += count_tokens(line)
+                break
+            seen_lines.add(key)
+            lines.append(line.strip())
+            cost += tokens
+        if lines:
+            kept[index] = ([header] if header else []) + lines
+            used += cost
+        if truncated:
+            break
+
+    blocks: list[str] = []
+    previous_header = None
+    for index in sorted(kept):
+        lines = kept[index]
+        header = _header(passages[index], several_reports)
+        if blocks and header == previous_header:
+            # Same page as the passage before (or both without a page)
+            if header is not None:
+                lines = lines[1:]
+            blocks[-1] += "\n" + "\n".join(lines)
+            continue
+        previous_header = header
+        blocks.append("\n".join(lines))
+    text = "\n\n".join(blocks)
+
+    return AssembledContext(
+        text=text,
+        chunks=len(docs),
+        passages=len(kept),
+        raw_tokens=raw_tokens,
+        tokens=count_tokens(text),
+        duplicate_lines=duplicates,
+        truncated=truncated,
+    )
@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import inspect
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DIGEST_SIZE = 32  # sha256
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes chunk text so trivially different copies share a cache key."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(model: str, kind: str, text: str) -> bytes:
+    """
+    Content address of an embedding. `kind` separates document and query
+    embeddings, which use different task types for the same model.
+    """
+    payload = f"{model}\0{kind}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).digest()
+
+
+def _select_entries(conn: sqlite3.Connection, digests: list[bytes]) -> list[tuple]:
+    """(digest, slot) rows for the given digests, in SQLite-sized batches."""
+    unique = list(dict.fromkeys(digests))
+    rows = []
+    for start in range(0, len(unique), 500):
+        batch = unique[start : start + 500]
+        rows += conn.execute(
+            f"SELECT digest, slot FROM entries WHERE digest IN "
+            f"({','.join('?' * len(batch))})",
+            batch,
+        ).fetchall()
+    return rows
+
+
+class EmbeddingStore:
+    """
+    Persistent, size-bounded store of embedding vectors.
+
+    Vectors live in a preallocated memory-mapped float32 matrix
+    (vectors.f32, one row per slot). A SQLite table maps content hashes to
+    slots and tracks last use for LRU eviction. Each slot also records the
+    digest it holds (digests.bin), so a reader can tell when another
+    process recycled the slot while it was reading.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.dim: int | None = None
+        self.capacity = 0
+        self._vectors: np.memmap | None = None
+        self._digests: np.memmap | None = None
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+                CREATE TABLE IF NOT EXISTS entries (
+                    digest BLOB PRIMARY KEY,
+                    slot INTEGER NOT NULL UNIQUE,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+                """)
+            row = conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            if row is not None:
+                self._open(row[0])
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.cache_dir / "index.sqlite3", timeout=30, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _open(self, dim: int) -> None:
+        self.dim = dim
+        self.capacity = max(1, self.max_bytes // (dim * 4))
+        vectors_path = self.cache_dir / "vectors.f32"
+        digests_path = self.cache_dir / "digests.bin"
+        for path, size in (
+            (vectors_path, self.capacity * dim * 4),
+            (digests_path, self.capacity * DIGEST_SIZE),
+        ):
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)  # sparse; pages are allocated on write
+        self._vectors = np.memmap(
+            vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, dim)
+        )
+        self._digests = np.memmap(
+            digests_path, dtype=np.uint8, mode="r+", shape=(self.capacity, DIGEST_SIZE)
+        )
+
+    def get_many(self, digests: list[bytes]) -> dict[bytes, list[float]]:
+        """Returns the cached vectors for whichever digests are present."""
+        if self.dim is None or not digests:
+            return {}
+
+        found: dict[bytes, list[float]] = {}
+        with self._lock, closing(self._connect()) as conn:
+            for digest, slot in _select_entries(conn, digests):
+                vector = np.array(self._vectors[slot])
+                # Checked after the copy: a concurrent writer clears the slot
+                # digest before overwriting the vector.
+                if self._digests[slot].tobytes() == digest:
+                    found[digest] = vector.tolist()
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE digest = ?",
+                    [(now, digest) for digest in found],
+                )
+        return found
+
+    def put_many(self, items: dict[bytes, list[float]]) -> None:
+        """Stores vectors, evicting the least recently used entries if full."""
+        if not items:
+            return
+
+        with self._lock, closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.dim is None:
+                    row = conn.execute(
+                        "SELECT value FROM meta WHERE key = 'dim'"
+                    ).fetchone()
+                    dim = row[0] if row else len(next(iter(items.values())))
+                    conn.execute(
+                        "INSERT OR IGNORE INTO meta (key, value) VALUES ('dim', ?)",
+                        (dim,),
+                    )
+                    self._open(dim)
+
+                existing = {digest for digest, _ in _select_entries(conn, list(items))}
+                new_items = [
+                    (digest, vector)
+                    for digest, vector in items.items()
+                    if digest not in existing and len(vector) == self.dim
+                ][: self.capacity]
+                slots = self._allocate_slots(conn, len(new_items))
+
+                now = time.time()
+                for (digest, vector), slot in zip(new_items, slots):
+                    self._digests[slot] = 0
+                    self._vectors[slot] = vector
+                    self._digests[slot] = np.frombuffer(digest, dtype=np.uint8)
+                self._vectors.flush()
+                self._digests.flush()
+                conn.executemany(
+                    "INSERT INTO entries (digest, slot, last_used) VALUES (?, ?, ?)",
+                    [
+                        (digest, slot, now)
+                        for (digest, _), slot in zip(new_items, slots)
+                    ],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _allocate_slots(self, conn: sqlite3.Connection, count: int) -> list[int]:
+        # Slots are filled in order and recycled in place, so everything
+        # past the highest slot in use is free.
+        max_slot = conn.execute("SELECT MAX(slot) FROM entries").fetchone()[0]
+        next_slot = 0 if max_slot is None else max_slot + 1
+        slots = list(range(next_slot, min(next_slot + count, self.capacity)))
+        # Recycle the least recently used entries
+        if len(slots) < count:
+            victims = conn.execute(
+                "SELECT digest, slot FROM entries ORDER BY last_used LIMIT ?",
+                (count - len(slots),),
+            ).fetchall()
+            conn.executemany(
+                "DELETE FROM entries WHERE digest = ?", [(d,) for d, _ in victims]
+            )
+            slots += [slot for _, slot in victims]
+            self.evictions += len(victims)
+        return slots
+
+    def __len__(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings client so identical (normalized) texts are only
+    embedded once per model. Only cache misses reach the underlying API.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, store: EmbeddingStore):
+        self.underlying = underlying
+        self.model = model
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, kind: str, texts: list[str]):
+        digests = [cache_key(self.model, kind, text) for text in texts]
+        found = self.store.get_many(digests)
+        missing: dict[bytes, str] = {}
+        for digest, text in zip(digests, texts):
+            if digest not in found and digest not in missing:
+                missing[digest] = text
+        hits = sum(1 for digest in digests if digest in found)
+        self.hits += hits
+        self.misses += len(digests) - hits
+        return digests, found, missing
+
+    def _store(self, found: dict, missing: dict[bytes, str], vectors: list) -> None:
+        # Round to float32 so fresh and cached embeddings are identical
+        computed = {
+            digest: np.asarray(vector, dtype=np.float32).tolist()
+            for digest, vector in zip(missing, vectors)
+        }
+        self.store.put_many(computed)
+        found.update(computed)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        digests, found, missing = self._lookup("document", texts)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            self._store(found, missing, vectors)
+        return [found[digest] for digest in digests]
+
+    def embed_query(self, text: str) -> list[float]:
+        digests, found, missing = self._lookup("query", [text])
+        if missing:
+            self._store(found, missing, [self.underlying.embed_query(text)])
+        return found[digests[0]]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        digests, found, missing = await asyncio.to_thread(
+            self._lookup, "document", texts
+        )
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            await asyncio.to_thread(self._store, found, missing, vectors)
+        return [found[digest] for digest in digests]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        digests, found, missing = await asyncio.to_thread(self._lookup, "query", [text])
+        if missing:
+            vector = await self.underlying.aembed_query(text)
+            await asyncio.to_thread(self._store, found, missing, [vector])
+        return found[digests[0]]
+
+    async def aembed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Query embeddings for several texts, with every cache miss sent in
+        one batched request instead of one request per query.
+        """
+        digests, found, missing = await asyncio.to_thread(self._lookup, "query", texts)
+        if missing:
+            vectors = await asyncio.to_thread(
+                self._embed_queries, list(missing.values())
+            )
+            await asyncio.to_thread(self._store, found, missing, vectors)
+        return [found[digest] for digest in digests]
+
+    def _embed_queries(self, texts: list[str]) -> list[list[float]]:
+        # Google's client embeds queries as documents with the query task
+        # type (its embed_query does the same for one text)
+        if "task_type" in inspect.signature(self.underlying.embed_documents).parameters:
+            task_type = getattr(self.underlying, "task_type", None)
+            return self.underlying.embed_documents(
+                texts, task_type=task_type or "RETRIEVAL_QUERY"
+            )
+        return [self.underlying.embed_query(text) for text in texts]
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "entries": len(self.store),
+            "capacity": self.store.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.store.evictions,
+        }
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import AsyncIterator
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.config import (
+    EMBED_BATCH_SIZE,
+    EMBED_BATCH_MAX_CHARS,
+    EMBED_MAX_RETRIES,
+    EMBED_BACKOFF_SECONDS,
+    EMBED_BACKOFF_MAX_SECONDS,
+)
+from app.services.concurrency import stage_limit
+
+logger = logging.getLogger(__name__)
+
+
+class BatchMetrics:
+    """Per-batch latency and retry counters for the embedding stage."""
+
+    def __init__(self, window: int = 1000):
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.batches = 0
+        self.texts = 0
+        self.retries = 0
+        self.failures = 0
+
+    def record(self, seconds: float, size: int) -> None:
+        self.latencies.append(seconds)
+        self.batches += 1
+        self.texts += size
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "retries": self.retries,
+            "failures": self.failures,
+            "batch_latency_p50": percentile(0.50),
+            "batch_latency_p95": percentile(0.95),
+            "batch_latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
+metrics = BatchMetrics()
+
+
+def make_batches(
+    docs: list[Document],
+    max_items: int = EMBED_BATCH_SIZE,
+    max_chars: int = EMBED_BATCH_MAX_CHARS,
+) -> list[list[Document]]:
+    """
+    Groups chunks into batches that fill one embedding request: at most
+    max_items texts and roughly max_chars characters per batch.
+    """
+    batches: list[list[Document]] = []
+    current: list[Document] = []
+    current_chars = 0
+    for doc in docs:
+        size = len(doc.page_content)
+        if current and (len(current) >= max_items or current_chars + size > max_chars):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(doc)
+        current_chars += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for quota / rate-limit errors that are worth retrying."""
+    text = f"{type(error).__name__} {error}".lower()
+    return any(
+        marker in text
+        for marker in ("resourceexhausted", "429", "quota", "rate limit", "ratelimit")
+    )
+
+
+async def embed_batch(embeddings: Embeddings, texts: list[str]) -> list[list[float]]:
+    """
+    Embeds one batch, retrying rate-limit errors with full-jitter
+    exponential backoff. The stage semaphore bounds in-flight requests
+    across all uploads on this worker.
+    """
+    attempt = 0
+    while True:
+        try:
+            async with stage_limit("embedding"):
+                started = time.perf_counter()
+                vectors = await embeddings.aembed_documents(texts)
+            metrics.record(time.perf_counter() - started, len(texts))
+            return vectors
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt >= EMBED_MAX_RETRIES:
+                metrics.failures += 1
+                raise
+            delay = random.uniform(
+                0, min(EMBED_BACKOFF_MAX_SECONDS, EMBED_BACKOFF_SECONDS * 2**attempt)
+            )
+            attempt += 1
+            metrics.retries += 1
+            logger.warning(
+                "Embedding rate limited, retry %d in %.2fs: %s", attempt, delay, e
+            )
+            await asyncio.sleep(delay)
+
+
+async def aembed_chunks(
+    docs: list[Document], embeddings: Embeddings
+) -> AsyncIterator[tuple[list[Document], list[list[float]]]]:
+    """
+    Embeds chunks in concurrent batches, yielding (batch, vectors) pairs in
+    completion order.
+    """
+
+    async def run(batch: list[Document]):
+        vectors = await embed_batch(embeddings, [doc.page_content for doc in batch])
+        return batch, vectors
+
+    tasks = [asyncio.create_task(run(batch)) for batch in make_batches(docs)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import random
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.services.chunking import count_tokens
+from app.services.retrieval import tokenize
+
+
+class FakeRateLimitError(Exception):
+    """Mimics the quota error raised by the Gemini API."""
+
+    def __init__(self):
+        super().__init__("429 Resource has been exhausted (e.g. check quota).")
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic local embedding backend for offline tests and benchmarks.
+
+    Vectors are derived from a hash of the text, so identical texts always
+    embed identically. With bag_of_words=True a vector is instead the sum
+    of per-word hash vectors, so texts sharing words are close and
+    offline retrieval quality (e.g. chunking hit rates) means something.
+    Like the Gemini client, calls with more than
+    `max_batch_size` texts are sent as several sequential requests. Each
+    request sleeps for `latency` seconds plus `per_text_latency` per text,
+    and fails with a FakeRateLimitError with probability
+    `rate_limit_probability`.
+    """
+
+    def __init__(
+        self,
+        dim: int = 768,
+        latency: float = 0.05,
+        per_text_latency: float = 0.0,
+        rate_limit_probability: float = 0.0,
+        max_batch_size: int = 100,
+        seed: int = 0,
+        bag_of_words: bool = False,
+    ):
+        self.dim = dim
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.rate_limit_probability = rate_limit_probability
+        self.max_batch_size = max_batch_size
+        self.bag_of_words = bag_of_words
+        self._random = random.Random(seed)
+        self.requests = 0
+        self.texts = 0
+
+    def _hash_vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(
+            hashlib.sha256(text.encode("utf-8")).digest()[:8], "little"
+        )
+        return np.random.default_rng(seed).standard_normal(self.dim)
+
+    def _vector(self, text: str) -> list[float]:
+        if self.bag_of_words and tokenize(text):
+            vector = sum(self._hash_vector(word) for word in tokenize(text))
+        else:
+            vector = self._hash_vector(text)
+        return (vector / np.linalg.norm(vector)).astype(np.float32).tolist()
+
+    def _start_request(self, texts: list[str]) -> float:
+        self.requests += 1
+        if self._random.random() < self.rate_limit_probability:
+            raise FakeRateLimitError()
+        self.texts += len(texts)
+        return self.latency + self.per_text_latency * len(texts)
+
+    def _requests(self, texts: list[str]) -> list[list[str]]:
+        size = self.max_batch_size
+        return [texts[i : i + size] for i in range(0, len(texts), size)]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        for request in self._requests(texts):
+            time.sleep(self._start_request(request))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        for request in self._requests(texts):
+            await asyncio.sleep(self._start_request(request))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeSearchBackend:
+    """
+    Local stand-in for the web search backend: returns `results_per_query`
+    canned results per query after `latency` seconds, and counts calls.
+    """
+
+    def __init__(self, latency: float = 0.2, results_per_query: int = 3):
+        self.latency = latency
+        self.results_per_query = results_per_query
+        self.calls = 0
+
+    async def asearch(self, query: str, max_results: int) -> list[dict[str, str]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [
+            {
+                "title": f"Result {i + 1} for {query}",
+                "href": f"https://example.org/{i}?q={query.replace(' ', '+')}",
+                "body": f"Reference information about {query} (source {i + 1}).",
+            }
+            for i in range(min(max_results, self.results_per_query))
+        ]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic local chat model for offline benchmarks.
+
+    Each call sleeps for `latency` seconds plus `per_token_latency` per
+    generated token. ReAct agent prompts get `tool_steps` turns of
+    "Action: search" before a "Final Answer", so the agent loop, tool
+    calls and answer streaming all run; batch prompts get one marked
+    answer per question, and other prompts a short answer directly. Token usage is reported like a real provider's.
+    """
+
+    latency: float = 0.5
+    per_token_latency: float = 0.0
+    tool_steps: int = 1
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages: list[BaseMessage]) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        # Observations in the scratchpad (not the one in the instructions)
+        observations = len(
+            re.findall(r"Observation:(?! the result of the action)", prompt)
+        )
+        if "Action Input:" in prompt and observations < self.tool_steps:
+            query = prompt.rsplit("User Query:", 1)[-1].strip().split("\n", 1)[0]
+            topic = " ".join(tokenize(query)[:6])
+            return (
+                "Thought: I should look this up.\n"
+                f"Action: search\nAction Input: {topic or 'lab reference ranges'}"
+            )
+        answer = "Your results are within the reference ranges shown in the report."
+        # Batch prompts list their questions as "[[Q1]] ..." lines
+        questions = re.findall(r"^\[\[Q(\d+)\]\] ", prompt, re.MULTILINE)
+        if questions:
+            return "\n".join(f"[[Q{n}]] {answer}" for n in questions)
+        if "Action Input:" in prompt:
+            return f"Thought: I now know the final answer\nFinal Answer: {answer}"
+        return answer
+
+    def _result(self, messages: list[BaseMessage]) -> tuple[ChatResult, float]:
+        self.calls += 1
+        text = self._reply(messages)
+        prompt_tokens = sum(count_tokens(str(message.content)) for message in messages)
+        completion_tokens = count_tokens(text)
+        message = AIMessage(
+            content=text,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        )
+        delay = self.latency + self.per_token_latency * completion_tokens
+        return ChatResult(generations=[ChatGeneration(message=message)]), delay
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        result, delay = self._result(messages)
+        time.sleep(delay)
+        return result
+
+    async def _agenerate(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        result, delay = self._result(messages)
+        await asyncio.sleep(delay)
+        return result
+
+
+def fake_ocr_page(pdf_path: Path, page_number: int, latency: float = 0.5) -> str:
+    """
+    Stand-in for app.services.ocr.ocr_page: sleeps `latency` seconds in the
+    OCR worker process and returns a fixed lab table for the page.
+    """
+    time.sleep(latency)
+    return (
+        f"SCANNED PAGE {page_number + 1}\n"
+        "Test Result Unit Reference Range\n"
+        "Hemoglobin 13.5 g/dL 13.0-17.0\n"
+        "Glucose, Fasting 104 mg/dL 70-99\n"
+        "TSH 2.1 uIU/mL 0.4-4.0"
+    )
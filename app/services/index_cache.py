@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from app.services.mmap_store import MMAP_FILES, current_index_path
+
+# Files of the mmap index layout; their mtimes identify an index version.
+INDEX_FILES = MMAP_FILES
+_SIGNATURE_ATTEMPTS = 3
+
+
+@dataclass
+class _Entry:
+    value: Any
+    signature: tuple
+    size_bytes: int
+    last_used: float
+
+
+def index_signature(index_path: Path) -> tuple | None:
+    """
+    Returns (version/name, mtime_ns, size) for each file of the current
+    index version, or None if the index is missing. Another gunicorn
+    worker publishing a new version changes the signature, which is how
+    stale cache entries are detected.
+    """
+    for _ in range(_SIGNATURE_ATTEMPTS):
+        version_path = current_index_path(index_path)
+        if version_path is None:
+            return None
+        try:
+            signature = []
+            for name in INDEX_FILES:
+                st = os.stat(version_path / name)
+                signature.append(
+                    (f"{version_path.name}/{name}", st.st_mtime_ns, st.st_size)
+                )
+            return tuple(signature)
+        except FileNotFoundError:
+            # Pruned right after the pointer was read; follow it again
+            continue
+    return None
+
+
+class IndexCache:
+    """
+    Bounded LRU cache of loaded vector stores keyed by user_id.
+
+    Entries are evicted when the total (on-disk) size of cached indexes
+    exceeds max_bytes, or when they have not been used for idle_seconds.
+    """
+
+    def __init__(self, max_bytes: int, idle_seconds: float):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_reloads = 0
+        self.size_evictions = 0
+        self.idle_evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str, index_path: Path, loader: Callable[[], Any]) -> Any:
+        """
+        Returns the cached index for user_id, calling loader() on a miss or
+        when the files on disk no longer match the cached signature.
+        """
+        signature = index_signature(index_path)
+        if signature is None:
+            self.invalidate(user_id)
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry.signature == signature:
+                    entry.last_used = now
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return entry.value
+                self._remove(user_id)
+                self.stale_reloads += 1
+            self.misses += 1
+
+        # Load outside the lock so a slow disk read does not block other users.
+        value = loader()
+        if value is None:
+            return None
+
+        size_bytes = sum(size for _, _, size in signature)
+        with self._lock:
+            if user_id in self._entries:
+                self._remove(user_id)
+            self._entries[user_id] = _Entry(value, signature, size_bytes, now)
+            self._total_bytes += size_bytes
+            self._evict_size()
+        return value
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            if user_id in self._entries:
+                self._remove(user_id)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_reloads": self.stale_reloads,
+                "size_evictions": self.size_evictions,
+                "idle_evictions": self.idle_evictions,
+                "invalidations": self.invalidations,
+            }
+
+    # --- Internal helpers (caller holds the lock) ---
+
+    def _remove(self, user_id: str) -> None:
+        entry = self._entries.pop(user_id)
+        self._total_bytes -= entry.size_bytes
+
+    def _evict_idle(self, now: float) -> None:
+        expired = [
+            user_id
+            for user_id, entry in self._entries.items()
+            if now - entry.last_used > self.idle_seconds
+        ]
+        for user_id in expired:
+            self._remove(user_id)
+            self.idle_evictions += 1
+
+    def _evict_size(self) -> None:
+        # Always keep the most recently inserted entry, even if it alone
+        # exceeds the budget; otherwise every load would be wasted.
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            user_id = next(iter(self._entries))
+            self._remove(user_id)
+            self.size_evictions += 1
@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+from app.config import (
+    INGEST_DB_PATH,
+    INGEST_WORKERS,
+    INGEST_LEASE_SECONDS,
+    INGEST_POLL_SECONDS,
+    INGEST_MAX_ATTEMPTS,
+)
+from app.services import vector_store
+from app.services.reports import document_id_from_sha256
+from app.services.tracing import trace_request
+
+logger = logging.getLogger(__name__)
+
+# Ordered pipeline stages; "done" and "failed" are terminal.
+STAGES = (
+    "queued",
+    "ocr",
+    "chunking",
+    "embedding",
+    "indexing",
+    "summarizing",
+    "done",
+    "failed",
+)
+TERMINAL_STAGES = ("done", "failed")
+RUNNING_STAGES = ("ocr", "chunking", "embedding", "indexing", "summarizing")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    pdf_path TEXT NOT NULL,
+    content_hash TEXT,
+    stage TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_user_stage ON jobs (user_id, stage);
+CREATE INDEX IF NOT EXISTS jobs_stage_created ON jobs (stage, created_at);
+"""
+
+# Identifies this process when claiming jobs (several gunicorn workers
+# share one job table).
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_worker_tasks: list[asyncio.Task] = []
+
+
+# --- Job Table ---
+
+
+def _connect() -> sqlite3.Connection:
+    INGEST_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(INGEST_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def init_db() -> None:
+    with closing(_connect()) as conn:
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "content_hash" not in columns:
+            # Job tables created before uploads were hashed
+            conn.execute("ALTER TABLE jobs ADD COLUMN content_hash TEXT")
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def submit_job(
+    job_id: str,
+    user_id: str,
+    filename: str,
+    pdf_path: Path,
+    content_hash: str | None = None,
+) -> tuple[str, bool]:
+    """
+    Queues an uploaded PDF for ingestion.
+
+    If the user already has a queued or running job for the same content
+    (SHA-256 of the upload), the new upload is dropped and that job is
+    returned instead of processing the report twice. Different reports
+    always get their own job, since each one is added to the index.
+    Returns (job_id, coalesced).
+    """
+    now = time.time()
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = None
+            if content_hash is not None:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE user_id = ? AND content_hash = ? "
+                    "AND stage NOT IN ('done', 'failed') ORDER BY created_at LIMIT 1",
+                    (user_id, content_hash),
+                ).fetchone()
+            if row is not None:
+                conn.execute("COMMIT")
+                pdf_path.unlink(missing_ok=True)
+                return row["id"], True
+
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, filename, pdf_path, content_hash, "
+                "stage, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, user_id, filename, str(pdf_path), content_hash, now, now),
+            )
+            conn.execute("COMMIT")
+            return job_id, False
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def get_job(job_id: str) -> dict | None:
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def job_progress(stage: str) -> float:
+    """Fraction of the pipeline completed once a job has reached `stage`."""
+    if stage == "failed":
+        return 0.0
+    return STAGES.index(stage) / STAGES.index("done")
+
+
+def claim_job() -> dict | None:
+    """
+    Atomically takes the oldest queued job whose user has no other job in
+    progress, so two workers never rebuild the same user's index at once.
+    """
+    now = time.time()
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"""
+                SELECT * FROM jobs AS j
+                WHERE j.stage = 'queued'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM jobs AS r
+                      WHERE r.user_id = j.user_id
+                        AND r.stage IN ({",".join("?" * len(RUNNING_STAGES))})
+                  )
+                ORDER BY j.created_at
+                LIMIT 1
+                """,
+                RUNNING_STAGES,
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET stage = 'ocr', worker = ?, attempts = attempts + 1, "
+                "lease_until = ?, updated_at = ? WHERE id = ?",
+                (WORKER_ID, now + INGEST_LEASE_SECONDS, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    job = dict(row)
+    job["attempts"] += 1
+    return job
+
+
+def update_stage(job_id: str, stage: str, error: str | None = None) -> None:
+    now = time.time()
+    lease_until = None if stage in TERMINAL_STAGES else now + INGEST_LEASE_SECONDS
+    with closing(_connect()) as conn:
+        conn.execute(
+            "UPDATE jobs SET stage = ?, error = ?, lease_until = ?, updated_at = ? "
+            "WHERE id = ? AND worker = ?",
+            (stage, error, lease_until, now, job_id, WORKER_ID),
+        )
+
+
+def renew_lease(job_id: str) -> None:
+    with closing(_connect()) as conn:
+        conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ?",
+            (time.time() + INGEST_LEASE_SECONDS, job_id, WORKER_ID),
+        )
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Puts jobs whose worker stopped renewing its lease (crash, restart,
+    redeploy) back in the queue, or fails them once they have used up
+    INGEST_MAX_ATTEMPTS. Returns the number of jobs requeued.
+    """
+    now = time.time()
+    placeholders = ",".join("?" * len(RUNNING_STAGES))
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                f"UPDATE jobs SET stage = 'failed', error = 'Exceeded maximum attempts', "
+                f"lease_until = NULL, updated_at = ? "
+                f"WHERE stage IN ({placeholders}) AND lease_until < ? AND attempts >= ?",
+                (now, *RUNNING_STAGES, now, INGEST_MAX_ATTEMPTS),
+            )
+            cursor = conn.execute(
+                f"UPDATE jobs SET stage = 'queued', worker = NULL, lease_until = NULL, "
+                f"updated_at = ? WHERE stage IN ({placeholders}) AND lease_until < ?",
+                (now, *RUNNING_STAGES, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return cursor.rowcount
+
+
+def release_job(job_id: str) -> None:
+    """Returns a job this worker was processing to the queue (shutdown)."""
+    with closing(_connect()) as conn:
+        conn.execute(
+            "UPDATE jobs SET stage = 'queued', worker = NULL, lease_until = NULL, "
+            "attempts = MAX(attempts - 1, 0), updated_at = ? WHERE id = ? AND worker = ?",
+            (time.time(), job_id, WORKER_ID),
+        )
+
+
+# --- Worker Pool ---
+
+
+async def _keep_lease(job_id: str) -> None:
+    while True:
+        await asyncio.sleep(INGEST_LEASE_SECONDS / 3)
+        await asyncio.to_thread(renew_lease, job_id)
+
+
+async def process_job(job: dict) -> None:
+    job_id = job["id"]
+    pdf_path = Path(job["pdf_path"])
+    document_id = (
+        document_id_from_sha256(job["content_hash"]) if job["content_hash"] else None
+    )
+    if document_id is not None and await asyncio.to_thread(
+        vector_store.has_report, job["user_id"], document_id
+    ):
+        # Indexed by an identical upload that finished after this one queued
+        await asyncio.to_thread(update_stage, job_id, "done")
+        logger.info(
+            "Ingestion job %s skipped: report %s already indexed.", job_id, document_id
+        )
+        pdf_path.unlink(missing_ok=True)
+        return
+    logger.info("Processing ingestion job %s for user %s", job_id, job["user_id"])
+
+    async def on_stage(stage: str) -> None:
+        await asyncio.to_thread(update_stage, job_id, stage)
+
+    lease_task = asyncio.create_task(_keep_lease(job_id))
+    try:
+        with trace_request("ingest", user_id=job["user_id"], job_id=job_id):
+            success = await vector_store.acreate_vector_store(
+                job["user_id"],
+                pdf_path,
+                on_stage=on_stage,
+                delete_input=False,
+                filename=job["filename"],
+                document_id=document_id,
+            )
+    except asyncio.CancelledError:
+        # Worker is shutting down: hand the job back so it resumes later.
+        await asyncio.to_thread(release_job, job_id)
+        raise
+    finally:
+        lease_task.cancel()
+
+    if success:
+        await asyncio.to_thread(update_stage, job_id, "done")
+        logger.info("Ingestion job %s done.", job_id)
+    else:
+        await asyncio.to_thread(
+            update_stage, job_id, "failed", "Failed to process and index the PDF."
+        )
+        logger.warning("Ingestion job %s failed.", job_id)
+    pdf_path.unlink(missing_ok=True)
+
+
+async def _worker_loop() -> None:
+    while True:
+        try:
+            job = await asyncio.to_thread(claim_job)
+        except Exception as e:
+            logger.exception("Error claiming ingestion job: %s", e)
+            job = None
+
+        if job is None:
+            await asyncio.sleep(INGEST_POLL_SECONDS)
+            continue
+
+        try:
+            await process_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Error in ingestion job %s: %s", job["id"], e)
+            await asyncio.to_thread(update_stage, job["id"], "failed", str(e))
+
+
+async def _reaper_loop() -> None:
+    while True:
+        try:
+            requeued = await asyncio.to_thread(requeue_stale_jobs)
+            if requeued:
+                logger.info("Requeued %d interrupted ingestion job(s).", requeued)
+        except Exception as e:
+            logger.exception("Error requeueing stale ingestion jobs: %s", e)
+        await asyncio.sleep(INGEST_LEASE_SECONDS / 2)
+
+
+async def start_workers() -> None:
+    """Starts this worker process's ingestion pool (called from the app lifespan)."""
+    await asyncio.to_thread(init_db)
+    _worker_tasks.append(asyncio.create_task(_reaper_loop()))
+    for _ in range(INGEST_WORKERS):
+        _worker_tasks.append(asyncio.create_task(_worker_loop()))
+
+
+async def stop_workers() -> None:
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
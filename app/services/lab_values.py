@@ -0,0 +1,304 @@
+import json
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import pdfplumber
+from langchain_core.documents import Document
+
+from app.services.reports import ReportFilter
+
+_NUMBER = r"\d[\d,]*(?:\.\d+)?"
+_VALUE = re.compile(rf"^(?P<qualifier>[<>]=?)?\s*(?P<number>-?{_NUMBER})$")
+_VALUE_WITH_UNIT = re.compile(
+    rf"^(?P<value>[<>]?=?\s*{_NUMBER})\s*(?P<unit>[A-Za-zµ%][^\s]*)$"
+)
+_RANGE = re.compile(rf"^(?P<low>{_NUMBER})\s*(?:-|–|to)\s*(?P<high>{_NUMBER})$")
+_BOUND = re.compile(rf"^(?P<op><=?|>=?|≤|≥|up to|below|above)\s*(?P<limit>{_NUMBER})$")
+_FLAG = re.compile(r"^(?:H|L|HIGH|LOW|\*)$", re.IGNORECASE)
+# "Analyte  value [flag] [unit]  reference" on one text line (pdfplumber
+# joins table cells with single spaces, and OCR output looks the same)
+_LINE = re.compile(
+    rf"^(?P<analyte>[A-Za-z][A-Za-z0-9 ,()/%.+\-]*?)\s+"
+    rf"(?P<value>[<>]?=?\s*{_NUMBER})\s*"
+    r"(?:(?P<flag>H|L|HIGH|LOW|\*)\s+)?"
+    r"(?P<unit>(?:[A-Za-zµ%]|10\^)[^\s]*)?\s*"
+    rf"(?P<ref>(?:<=?|>=?|≤|≥)\s*{_NUMBER}|{_NUMBER}\s*(?:-|–|to)\s*{_NUMBER})$",
+    re.IGNORECASE,
+)
+
+# Query words that refer to an analyte by another name
+ALIASES = {
+    "a1c": "hba1c",
+    "sugar": "glucose",
+    "lipid": "cholesterol",
+    "lipids": "cholesterol",
+    "thyroid": "tsh",
+    "hb": "hemoglobin",
+    "haemoglobin": "hemoglobin",
+}
+# Analyte words too generic to identify a test on their own
+_GENERIC_WORDS = {
+    "total",
+    "count",
+    "level",
+    "serum",
+    "blood",
+    "ratio",
+    "test",
+    "plasma",
+}
+
+
+def _words(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+@dataclass
+class LabValue:
+    analyte: str
+    value: float
+    value_text: str
+    unit: str
+    reference: str
+    low: float | None
+    high: float | None
+    page: int | None = None
+    document_id: str | None = None
+    report_date: str | None = None
+
+    @property
+    def status(self) -> str | None:
+        """ "low", "high" or "normal" against the report's range; None if unknown."""
+        if self.low is None and self.high is None:
+            return None
+        # "<200" means 200 itself is already out of range
+        strict = self.reference.lstrip()[:1]
+        if self.low is not None and (
+            self.value < self.low or (strict == ">" and self.value == self.low)
+        ):
+            return "low"
+        if self.high is not None and (
+            self.value > self.high or (strict == "<" and self.value == self.high)
+        ):
+            return "high"
+        return "normal"
+
+    def describe(self) -> str:
+        status = {
+            "low": "below range",
+            "high": "above range",
+            "normal": "within range",
+            None: "no reference range",
+        }[self.status]
+        unit = f" {self.unit}" if self.unit else ""
+        reference = f" (reference {self.reference})" if self.reference else ""
+        dated = f" [report of {self.report_date}]" if self.report_date else ""
+        return f"{self.analyte}: {self.value_text}{unit}{reference} -> {status}{dated}"
+
+
+def parse_reference_range(text: str) -> tuple[float | None, float | None] | None:
+    """'13.0-17.0' -> (13.0, 17.0), '<200' -> (None, 200.0), '>40' -> (40.0, None)."""
+    text = text.strip()
+    match = _RANGE.match(text)
+    if match:
+        return _number(match["low"]), _number(match["high"])
+    match = _BOUND.match(text.lower())
+    if match:
+        limit = _number(match["limit"])
+        if match["op"] in ("<", "<=", "≤", "up to", "below"):
+            return None, limit
+        return limit, None
+    return None
+
+
+def parse_row(cells: list[str | None], page: int | None = None) -> LabValue | None:
+    """
+    Reads one table row as analyte / value / unit / reference range.
+    Cells may be split or merged differently from report to report, so
+    each field is recognised by shape rather than by column position.
+    """
+    cells = [" ".join(cell.split()) for cell in cells if cell and cell.strip()]
+    if len(cells) < 2 or not cells[0][0].isalpha():
+        return None
+    analyte, rest = cells[0], cells[1:]
+
+    value_text = unit = reference = ""
+    bounds = None
+    for cell in rest:
+        if not value_text:
+            match = _VALUE.match(cell) or _VALUE_WITH_UNIT.match(cell)
+            if match:
+                value_text = (match.groupdict().get("value") or cell).strip()
+                unit = match.groupdict().get("unit") or ""
+                continue
+        elif bounds is None and parse_reference_range(cell) is not None:
+            bounds, reference = parse_reference_range(cell), cell
+        elif not unit and not _FLAG.match(cell) and len(cell) <= 12:
+            unit = cell
+    if not value_text:
+        return None
+    number = _VALUE.match(value_text.replace(" ", ""))
+    if number is None:
+        return None
+    low, high = bounds or (None, None)
+    return LabValue(
+        analyte=analyte,
+        value=_number(number["number"]),
+        value_text=value_text,
+        unit=unit,
+        reference=reference,
+        low=low,
+        high=high,
+        page=page,
+    )
+
+
+def parse_text_lines(text: str, page: int | None = None) -> list[LabValue]:
+    """Lab rows from plain text, for unruled tables and OCR'd pages."""
+    values = []
+    for line in text.splitlines():
+        match = _LINE.match(line.strip())
+        if match:
+            cells = [match["analyte"], match["value"], match["unit"], match["ref"]]
+            value = parse_row(cells, page)
+            if value is not None:
+                values.append(value)
+    return values
+
+
+def extract_lab_values(pdf_path: Path, pages: list[Document]) -> list[LabValue]:
+    """
+    Extracts lab rows from a loaded report. Text-layer pages go through
+    pdfplumber's table extraction first (ruled tables), then fall back to
+    line parsing; OCR'd pages only have text, so they are line-parsed.
+    """
+    values: list[LabValue] = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for doc in pages:
+            page_number = doc.metadata.get("page")
+            found: list[LabValue] = []
+            if doc.metadata.get("extraction") == "text_layer":
+                page = pdf.pages[page_number]
+                for table in page.extract_tables():
+                    found += filter(
+                        None, (parse_row(row, page_number) for row in table)
+                    )
+                page.close()
+            if not found:
+                found = parse_text_lines(doc.page_content, page_number)
+            values += found
+
+    # Repeated headers/footers can list the same row on several pages
+    seen = set()
+    unique = []
+    for value in values:
+        key = (value.analyte.lower(), value.value_text, value.unit)
+        if key not in seen:
+            seen.add(key)
+            unique.append(value)
+    return unique
+
+
+def _analyte_words(analyte: str) -> set[str]:
+    return {
+        word
+        for word in _words(analyte)
+        if word not in _GENERIC_WORDS and len(word) >= 3
+    }
+
+
+def match_query(values: list[LabValue], query: str) -> list[LabValue]:
+    """The values whose analyte the query mentions (by name, word or alias)."""
+    words = set(_words(query))
+    words |= {ALIASES[word] for word in words if word in ALIASES}
+    padded_query = f" {' '.join(_words(query))} "
+    return [
+        value
+        for value in values
+        if f" {' '.join(_words(value.analyte))} " in padded_query
+        or _analyte_words(value.analyte) & words
+    ]
+
+
+def format_lab_values(values: list[LabValue]) -> list[str]:
+    header = (
+        "Structured lab values from the report "
+        "(range status computed from the report's reference ranges):"
+    )
+    return [header] + [f"- {value.describe()}" for value in values]
+
+
+class LabValueStore:
+    """
+    Per-user structured lab values, one small JSON file per user next to
+    the indexes. Loaded files are cached per worker and reloaded when
+    their mtime changes.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._cache: dict[str, tuple[int, list[LabValue]]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: str) -> Path:
+        return self.root / f"{user_id}.json"
+
+    def save(self, user_id: str, values: list[LabValue]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(user_id)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        tmp_path.write_text(json.dumps([asdict(value) for value in values]))
+        os.replace(tmp_path, path)
+
+    def load(self, user_id: str) -> list[LabValue]:
+        path = self._path(user_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._cache.pop(user_id, None)
+            return []
+        with self._lock:
+            cached = self._cache.get(user_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        values = [LabValue(**row) for row in json.loads(path.read_text())]
+        with self._lock:
+            self._cache[user_id] = (mtime, values)
+        return values
+
+    def delete(self, user_id: str) -> None:
+        self._path(user_id).unlink(missing_ok=True)
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def replace_report(
+        self, user_id: str, document_id: str, values: list[LabValue]
+    ) -> None:
+        """Stores one report's values, replacing any earlier ones of it."""
+        kept = [v for v in self.load(user_id) if v.document_id != document_id]
+        self.save(user_id, kept + values)
+
+    def remove_report(self, user_id: str, document_id: str) -> None:
+        kept = [v for v in self.load(user_id) if v.document_id != document_id]
+        if kept:
+            self.save(user_id, kept)
+        else:
+            self.delete(user_id)
+
+    def find(
+        self, user_id: str, query: str, report_filter: ReportFilter | None = None
+    ) -> list[LabValue]:
+        values = self.load(user_id)
+        if report_filter:
+            values = [
+                v for v in values if report_filter.matches(v.document_id, v.report_date)
+            ]
+        return match_query(values, query)
@@ -0,0 +1,473 @@
+import fcntl
+import json
+import mmap
+import os
+import re
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from app.services.reports import ReportFilter
+from app.services.retrieval import mmr_select
+
+# On-disk layout of a per-user index, replacing FAISS.save_local's
+# index.faiss + index.pkl:
+#   vectors.npy   float32 (n, dim), memory-mapped
+#   norms.npy     float32 (n,) squared L2 norms, so a search is one matvec
+#   offsets.npy   int64 (2, n + 1) byte offsets into texts.bin / metadata.bin
+#   texts.bin     UTF-8 chunk texts, back to back
+#   metadata.bin  one JSON object per chunk, back to back
+# Nothing is unpickled, and the mapped pages live in the OS page cache, so
+# gunicorn workers serving the same user share one copy.
+MMAP_FILES = ("vectors.npy", "norms.npy", "offsets.npy", "texts.bin", "metadata.bin")
+
+# Each write creates a new immutable version directory (v000001, ...) and
+# then atomically replaces the CURRENT pointer file naming it. Readers
+# only follow the pointer and never lock; writers serialize on a per-index
+# file lock. Superseded versions are removed after a later write, and a
+# reader that mapped one keeps reading its (unlinked) files.
+CURRENT_FILE = "CURRENT"
+LOCK_DIR = ".locks"
+_VERSION = re.compile(r"^v(\d+)$")
+# Old versions kept for readers that resolved the pointer just before a swap
+_KEEP_OLD_VERSIONS = 1
+_OPEN_ATTEMPTS = 3
+
+_held_locks = threading.local()
+
+
+@contextmanager
+def index_write_lock(path: Path) -> Iterator[None]:
+    """
+    Serializes writers of the index at path across threads and processes
+    with an exclusive flock. The lock file lives in a sibling .locks
+    directory, so deleting the index never deletes a held lock. Re-entrant
+    within a thread, so a multi-step update can hold it across helpers
+    that take it themselves.
+    """
+    held = _held_locks.__dict__.setdefault("paths", set())
+    key = str(path)
+    if key in held:
+        yield
+        return
+    lock_dir = path.parent / LOCK_DIR
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    with open(lock_dir / f"{path.name}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def current_index_path(path: Path) -> Path | None:
+    """
+    The directory holding the current version of the index at path, or
+    None if there is no index.
+    """
+    try:
+        version = (path / CURRENT_FILE).read_text().strip()
+    except (FileNotFoundError, NotADirectoryError):
+        # Written before indexes were versioned: the files sit in path
+        return path if (path / MMAP_FILES[0]).exists() else None
+    return path / version
+
+
+def _version_number(name: str) -> int:
+    match = _VERSION.match(name)
+    return int(match[1]) if match else 0
+
+
+def _pack(items: Iterable[bytes]) -> tuple[bytes, np.ndarray]:
+    blobs = list(items)
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    return b"".join(blobs), offsets
+
+
+def write_mmap_index(
+    path: Path,
+    texts: list[str],
+    metadatas: list[dict],
+    vectors: np.ndarray | list[list[float]],
+) -> None:
+    """
+    Writes a new version of the index at path in the mmap layout and
+    points CURRENT at it, under the index's write lock. Files go to a
+    temp directory that is renamed into place before the pointer moves,
+    so readers never see a partial index.
+    """
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2 or len(matrix) != len(texts) or len(texts) != len(metadatas):
+        raise ValueError("texts, metadatas and vectors must have the same length.")
+
+    text_blob, text_offsets = _pack(text.encode() for text in texts)
+    meta_blob, meta_offsets = _pack(
+        json.dumps(metadata, default=str).encode() for metadata in metadatas
+    )
+
+    with index_write_lock(path):
+        current = current_index_path(path)
+        version = f"v{(_version_number(current.name) if current else 0) + 1:06d}"
+        tmp_path = path / f".{version}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)  # left by a crashed writer
+        tmp_path.mkdir(parents=True)
+        np.save(tmp_path / "vectors.npy", matrix)
+        np.save(tmp_path / "norms.npy", np.einsum("ij,ij->i", matrix, matrix))
+        np.save(tmp_path / "offsets.npy", np.stack([text_offsets, meta_offsets]))
+        (tmp_path / "texts.bin").write_bytes(text_blob)
+        (tmp_path / "metadata.bin").write_bytes(meta_blob)
+        os.replace(tmp_path, path / version)
+
+        pointer_tmp = path / f"{CURRENT_FILE}.tmp"
+        pointer_tmp.write_text(version)
+        os.replace(pointer_tmp, path / CURRENT_FILE)
+        _prune_versions(path, version)
+
+
+def _prune_versions(path: Path, current: str) -> None:
+    """Removes versions older than the last _KEEP_OLD_VERSIONS before current."""
+    if current_index_path(path) != path:
+        # Files of an unversioned index left next to the versions
+        for name in MMAP_FILES:
+            (path / name).unlink(missing_ok=True)
+    older = sorted(
+        (
+            entry
+            for entry in path.iterdir()
+            if _VERSION.match(entry.name)
+            and _version_number(entry.name) < _version_number(current)
+        ),
+        key=lambda entry: _version_number(entry.name),
+    )
+    for entry in older[: max(0, len(older) - _KEEP_OLD_VERSIONS)]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+def delete_mmap_index(path: Path) -> bool:
+    """
+    Removes the index at path under its write lock: the pointer first, so
+    new readers see no index, then the files. Readers that mapped it keep
+    reading the unlinked files. Returns False if there was no index.
+    """
+    with index_write_lock(path):
+        existed = current_index_path(path) is not None
+        (path / CURRENT_FILE).unlink(missing_ok=True)
+        shutil.rmtree(path, ignore_errors=True)
+    return existed
+
+
+def update_mmap_index(
+    path: Path,
+    texts: list[str] = (),
+    metadatas: list[dict] = (),
+    vectors: np.ndarray | list[list[float]] | None = None,
+    drop: Callable[[dict], bool] | None = None,
+) -> int:
+    """
+    Rewrites an index keeping the chunks whose metadata drop() rejects (all
+    of them without drop) and appending the given ones. Kept vectors are
+    copied from the mapped matrix, so nothing is re-embedded. The whole
+    read-modify-write holds the index's write lock, so concurrent updates
+    are never lost; the new version is published like write_mmap_index's
+    and an index left empty is removed. Returns the new chunk count.
+    """
+    with index_write_lock(path):
+        kept_texts, kept_metadatas, kept_vectors = [], [], []
+        if current_index_path(path) is not None:
+            store = MmapVectorStore(path, None)
+            keep = [
+                i
+                for i, metadata in enumerate(store.iter_metadatas())
+                if drop is None or not drop(metadata)
+            ]
+            kept_texts = [store.get_text(i) for i in keep]
+            kept_metadatas = [store.get_metadata(i) for i in keep]
+            kept_vectors = [np.asarray(store.vectors[keep], dtype=np.float32)]
+            del store
+
+        all_texts = kept_texts + list(texts)
+        if not all_texts:
+            delete_mmap_index(path)
+            return 0
+        if len(texts):
+            kept_vectors.append(np.asarray(vectors, dtype=np.float32))
+        write_mmap_index(
+            path,
+            all_texts,
+            kept_metadatas + list(metadatas),
+            np.concatenate(kept_vectors),
+        )
+        return len(all_texts)
+
+
+def _map_bytes(path: Path) -> bytes | mmap.mmap:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""  # mmap cannot map an empty file
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Read-only vector store over the mmap layout written by
+    write_mmap_index. Opening one only maps the files of the current
+    version; vectors and texts are paged in as searches touch them, and
+    later writes do not affect an opened store.
+
+    Scores are squared L2 distances, the same as the FAISS IndexFlatL2
+    indexes it replaces, so MMR and relevance scores behave the same.
+    """
+
+    def __init__(self, path: Path, embedding: Embeddings):
+        self.path = path
+        self.embedding = embedding
+        self._open()
+        self._reports: tuple[np.ndarray, np.ndarray] | None = None
+        self._reports_lock = threading.Lock()
+
+    def _open(self) -> None:
+        for attempt in range(_OPEN_ATTEMPTS):
+            version_path = current_index_path(self.path)
+            if version_path is None:
+                raise FileNotFoundError(f"No index at {self.path}")
+            try:
+                vectors = np.load(version_path / "vectors.npy", mmap_mode="r")
+                norms = np.load(version_path / "norms.npy", mmap_mode="r")
+                offsets = np.load(version_path / "offsets.npy", mmap_mode="r")
+                texts = _map_bytes(version_path / "texts.bin")
+                metadata = _map_bytes(version_path / "metadata.bin")
+                break
+            except FileNotFoundError:
+                # The version was pruned between reading the pointer and
+                # opening it: follow the pointer again
+                if attempt == _OPEN_ATTEMPTS - 1:
+                    raise
+        self.version_path = version_path
+        self.vectors, self._norms, self._offsets = vectors, norms, offsets
+        self._texts, self._metadata = texts, metadata
+        self._reports = None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def get_text(self, i: int) -> str:
+        start, end = self._offsets[0, i], self._offsets[0, i + 1]
+        return self._texts[start:end].decode()
+
+    def get_metadata(self, i: int) -> dict:
+        start, end = self._offsets[1, i], self._offsets[1, i + 1]
+        return json.loads(self._metadata[start:end])
+
+    def get_document(self, i: int) -> Document:
+        return Document(page_content=self.get_text(i), metadata=self.get_metadata(i))
+
+    def iter_texts(self) -> Iterator[str]:
+        return (self.get_text(i) for i in range(len(self)))
+
+    def iter_metadatas(self) -> Iterator[dict]:
+        return (self.get_metadata(i) for i in range(len(self)))
+
+    def iter_documents(self) -> Iterator[Document]:
+        return (self.get_document(i) for i in range(len(self)))
+
+    # --- Reports ---
+
+    def report_columns(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Per-chunk document ids and report dates ("" when unknown), parsed
+        from the metadata once per loaded index.
+        """
+        with self._reports_lock:
+            if self._reports is None:
+                metadatas = list(self.iter_metadatas())
+                self._reports = (
+                    np.array([m.get("document_id") or "" for m in metadatas]),
+                    np.array([m.get("report_date") or "" for m in metadatas]),
+                )
+            return self._reports
+
+    def report_mask(self, report_filter: ReportFilter) -> np.ndarray:
+        """Which chunks belong to the reports report_filter selects."""
+        document_ids, dates = self.report_columns()
+        mask = np.ones(len(self), dtype=bool)
+        if report_filter.document_ids is not None:
+            mask &= np.isin(document_ids, list(report_filter.document_ids))
+        if report_filter.date_from or report_filter.date_to:
+            mask &= dates != ""
+        if report_filter.date_from:
+            mask &= dates >= report_filter.date_from
+        if report_filter.date_to:
+            mask &= dates <= report_filter.date_to
+        return mask
+
+    # --- Search ---
+
+    def nearest(
+        self, embedding: list[float], k: int, mask: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Indices and squared L2 distances of the k nearest vectors, among
+        the rows where mask is true when a mask is given.
+        """
+        nearest, distances = self.nearest_many([embedding], k, mask)
+        return nearest[0], distances[0]
+
+    def nearest_many(
+        self, embeddings, k: int, mask: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        nearest() for a matrix of query vectors, scored against the index
+        in one matrix product: (queries, k) arrays, closest first per row.
+        """
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if mask is not None:
+            k = min(k, int(mask.sum()))
+        k = min(k, len(self))
+        if k <= 0:
+            return (
+                np.empty((len(queries), 0), dtype=np.int64),
+                np.empty((len(queries), 0), dtype=np.float32),
+            )
+        distances = (
+            self._norms
+            - 2 * (queries @ self.vectors.T)
+            + np.einsum("ij,ij->i", queries, queries)[:, None]
+        )
+        if mask is not None:
+            distances = np.where(mask, distances, np.inf)
+        rows = np.arange(len(queries))[:, None]
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        nearest = nearest[rows, np.argsort(distances[rows, nearest], axis=1)]
+        return nearest, distances[rows, nearest]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        ids, distances = self.nearest(embedding, k)
+        return [(self.get_document(int(i)), float(d)) for i, d in zip(ids, distances)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self.embedding.embed_query(query), k
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)
+        ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k)
+
+    def _similarity_search_with_relevance_scores(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        return [
+            (doc, self._euclidean_relevance_score_fn(score))
+            for doc, score in self.similarity_search_with_score(query, k)
+        ]
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> list[Document]:
+        candidates, _ = self.nearest(embedding, fetch_k)
+        if not candidates.size:
+            return []
+        selected = mmr_select(
+            np.asarray(embedding, dtype=np.float32),
+            self.vectors[candidates],
+            k,
+            lambda_mult,
+        )
+        return [self.get_document(int(candidates[i])) for i in selected]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> list[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding.embed_query(query), k, fetch_k, lambda_mult
+        )
+
+    # --- Writes (each one rewrites the index and swaps it in) ---
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: list[dict] | None = None,
+        *,
+        ids: list[str] | None = None,
+        vectors: np.ndarray | list[list[float]] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        """
+        Appends chunks, embedding them unless vectors are given, and maps
+        the updated index. Ids are kept as metadata["chunk_id"].
+        """
+        texts = list(texts)
+        metadatas = [dict(m) for m in metadatas] if metadatas else [{} for _ in texts]
+        ids = ids or [m.get("chunk_id") or uuid.uuid4().hex for m in metadatas]
+        for metadata, chunk_id in zip(metadatas, ids):
+            metadata["chunk_id"] = chunk_id
+        if vectors is None:
+            vectors = self.embedding.embed_documents(texts)
+        update_mmap_index(self.path, texts, metadatas, vectors)
+        self._open()
+        return ids
+
+    def delete(self, ids: list[str] | None = None, **kwargs: Any) -> bool | None:
+        """Removes the chunks with the given ids; False if none matched."""
+        if not ids:
+            return None
+        wanted = set(ids)
+        before = len(self)
+        remaining = update_mmap_index(
+            self.path, drop=lambda metadata: metadata.get("chunk_id") in wanted
+        )
+        if remaining:
+            self._open()
+        return remaining < before
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: list[dict] | None = None,
+        *,
+        path: Path,
+        **kwargs: Any,
+    ) -> "MmapVectorStore":
+        vectors = embedding.embed_documents(texts)
+        write_mmap_index(path, texts, metadatas or [{} for _ in texts], vectors)
+        return cls(path, embedding)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+import ocrmypdf
+import pdfplumber
+import pikepdf
+from langchain_core.documents import Document
+
+from app.config import OCR_MIN_CHARS_PER_PAGE
+from app.services.concurrency import run_in_process, stage_limit
+from app.services.registry import registry
+
+# This module is imported by the OCR worker processes, so it must stay
+# light: no embedding or LLM clients at import time.
+
+logger = logging.getLogger(__name__)
+
+
+def has_text_layer(page: pdfplumber.page.Page) -> bool:
+    """
+    True when a page already carries enough extractable, non-whitespace
+    text to skip OCR (digitally generated reports, or scans that were
+    OCR'd by the lab).
+    """
+    visible = sum(1 for char in page.chars if not char["text"].isspace())
+    return visible >= OCR_MIN_CHARS_PER_PAGE
+
+
+def ocr_page(pdf_path: Path, page_number: int) -> str:
+    """
+    OCRs a single page (0-based) and returns its text.
+    Runs in a worker process; each call OCRs with one Tesseract job, and
+    parallelism comes from the process pool.
+    """
+    with tempfile.TemporaryDirectory(prefix="ocr_page_") as tmp:
+        page_pdf = Path(tmp) / "page.pdf"
+        ocr_output = Path(tmp) / "page.ocr.pdf"
+
+        with pikepdf.open(pdf_path) as source, pikepdf.new() as single:
+            single.pages.append(source.pages[page_number])
+            single.save(page_pdf)
+
+        ocrmypdf.ocr(
+            page_pdf,
+            ocr_output,
+            language="eng",
+            force_ocr=True,
+            progress_bar=False,
+            jobs=1,
+        )
+
+        with pdfplumber.open(ocr_output) as pdf:
+            return pdf.pages[0].extract_text() or ""
+
+
+# The page OCR function run in the process pool. It must be picklable (a
+# top-level function or a partial of one); benchmarks override it with a fake.
+registry.register("ocr_page", lambda: ocr_page)
+
+
+def _read_text_layer(pdf_path: Path) -> tuple[int, dict[int, str]]:
+    """Returns (page count, text of every page that has a usable text layer)."""
+    texts: dict[int, str] = {}
+    with pdfplumber.open(pdf_path) as pdf:
+        total_pages = len(pdf.pages)
+        for page in pdf.pages:
+            if has_text_layer(page):
+                texts[page.page_number - 1] = page.extract_text() or ""
+            # Drop parsed layout objects so long reports stay flat in memory
+            page.close()
+    return total_pages, texts
+
+
+async def aload_pdf_pages(pdf_path: Path) -> list[Document]:
+    """
+    Loads a PDF as one Document per page, in page order.
+
+    Pages with a usable text layer are read directly with pdfplumber; only
+    the remaining (scanned) pages are OCR'd, concurrently in the process
+    pool. metadata["extraction"] records which path each page took.
+    """
+    total_pages, texts = await asyncio.to_thread(_read_text_layer, pdf_path)
+    scanned = [n for n in range(total_pages) if n not in texts]
+    logger.info(
+        "%s: %d page(s) with text layer, %d page(s) to OCR",
+        pdf_path.name,
+        total_pages - len(scanned),
+        len(scanned),
+    )
+
+    async def run_ocr(page_number: int) -> str:
+        async with stage_limit("ocr"):
+            return await run_in_process(registry.get("ocr_page"), pdf_path, page_number)
+
+    ocr_texts = await asyncio.gather(*(run_ocr(n) for n in scanned))
+    for page_number, text in zip(scanned, ocr_texts):
+        texts[page_number] = text
+
+    return [
+        Document(
+            page_content=texts[page_number],
+            metadata={
+                "source": str(pdf_path),
+                "file_path": str(pdf_path),
+                "page": page_number,
+                "total_pages": total_pages,
+                "extraction": "ocr" if page_number in scanned else "text_layer",
+            },
+        )
+        for page_number in range(total_pages)
+    ]
@@ -0,0 +1,84 @@
+import re
+from collections import deque
+
+# --- Routes ---
+
+REPORT_LOCAL = "report_local"  # answered from retrieved chunks in one LLM call
+FULL_REPORT = "full_report"  # needs the whole report (getAllChunks tool)
+WEB_SEARCH = "web_search"  # needs outside information (search tool)
+ROUTES = (REPORT_LOCAL, FULL_REPORT, WEB_SEARCH)
+
+# Whole-report questions: "summarize my report", "give me an overview", ...
+_FULL_REPORT_PATTERNS = [
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r"\bsummar(y|ise|ize|izing|ising)\b",
+        r"\boverview\b",
+        r"\b(whole|entire|complete|full|overall)\b.{0,30}\b(report|results?|tests?|analysis|panel|picture)\b",
+        r"\ball (of )?(my )?(results?|values?|tests?|parameters?|readings?)\b",
+        r"\banaly[sz]e (my |the )?(report|results)\b",
+        r"\banything (else )?(abnormal|wrong|concerning)\b",
+    )
+]
+
+# Questions that need information that is not in the report
+_WEB_SEARCH_PATTERNS = [
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r"\b(latest|recent|new|current)\b.{0,30}\b(guidelines?|news|treatments?)\b",
+        r"\b(search|google|look up|look it up|online|web|internet)\b",
+        r"\b(research|studies|clinical trials?|guidelines?)\b",
+        r"\b(near me|hospital|clinic|specialist|doctor) (near|in|around)\b",
+        r"\b(price|cost|where (can|do) i (buy|get))\b",
+        r"\b(foods?|diet|recipes?|meal plan|exercises?|supplements?)\b.{0,40}\b(to|for|that)\b",
+        r"\b(medications?|medicines?|drugs?)\b.{0,30}\b(for|to|interact)",
+    )
+]
+
+
+def classify_query(query: str) -> str:
+    """
+    Cheap, local routing decision for a user query (no LLM call).
+    Whole-report and web-search questions go to the ReAct agent; everything
+    else is treated as a report-local question.
+    """
+    if any(p.search(query) for p in _FULL_REPORT_PATTERNS):
+        return FULL_REPORT
+    if any(p.search(query) for p in _WEB_SEARCH_PATTERNS):
+        return WEB_SEARCH
+    return REPORT_LOCAL
+
+
+# --- Per-route Latency ---
+
+
+class RouteMetrics:
+    """Request counts and latency percentiles for each route."""
+
+    def __init__(self, window: int = 1000):
+        self._latencies = {route: deque(maxlen=window) for route in ROUTES}
+        self._counts = {route: 0 for route in ROUTES}
+
+    def record(self, route: str, seconds: float) -> None:
+        self._latencies[route].append(seconds)
+        self._counts[route] += 1
+
+    def stats(self) -> dict:
+        result = {}
+        for route in ROUTES:
+            latencies = sorted(self._latencies[route])
+
+            def percentile(p: float) -> float:
+                if not latencies:
+                    return 0.0
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+            result[route] = {
+                "count": self._counts[route],
+                "latency_p50": percentile(0.50),
+                "latency_p95": percentile(0.95),
+            }
+        return result
+
+
+metrics = RouteMetrics()
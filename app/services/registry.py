@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Set when this module is first imported, i.e. early in worker startup
+PROCESS_STARTED = time.perf_counter()
+
+
+class ClientRegistry:
+    """
+    Lazily constructed, process-wide clients (LLM, embeddings, agent).
+
+    Services register a factory per client name at import time; nothing
+    is built until the client is first requested or warm_up() runs from
+    the app lifespan. Instances can be overridden, e.g. with local fakes
+    in benchmarks.
+    """
+
+    def __init__(self):
+        self._factories: dict[str, Callable[[], Any]] = {}
+        self._instances: dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self.build_seconds: dict[str, float] = {}
+        self.ready = False
+        self.ready_after: float | None = None
+        self.warm_up_error: str | None = None
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        self._factories[name] = factory
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                started = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self.build_seconds[name] = time.perf_counter() - started
+            return self._instances[name]
+
+    def override(self, name: str, instance: Any) -> None:
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self) -> None:
+        """Forgets all built instances; they are rebuilt on next use."""
+        with self._lock:
+            self._instances.clear()
+            self.build_seconds.clear()
+            self.ready = False
+            self.ready_after = None
+
+    def warm_up(self) -> None:
+        """Builds every registered client."""
+        for name in list(self._factories):
+            self.get(name)
+        self.ready = True
+        self.ready_after = time.perf_counter() - PROCESS_STARTED
+
+    async def awarm_up(self) -> None:
+        try:
+            await asyncio.to_thread(self.warm_up)
+            logger.info(
+                "Clients ready after %.2fs: %s", self.ready_after, self.build_seconds
+            )
+        except Exception as e:
+            self.warm_up_error = str(e)
+            logger.exception("Error warming up clients: %s", e)
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "ready_after_seconds": self.ready_after,
+            "build_seconds": dict(self.build_seconds),
+            "error": self.warm_up_error,
+        }
+
+
+registry = ClientRegistry()
@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+
+from app.services.concurrency import stage_limit
+from app.services.lab_values import LabValue
+
+PAGE_PROMPT = """Summarize this page of a medical lab report in at most {max_chars}
+characters. Keep every test name with its value, unit and reference range; note
+values flagged abnormal. No advice, no preamble.
+
+Page {page}:
+{text}"""
+
+ROLLUP_PROMPT = """Combine these summaries of parts of one medical lab report into a
+single summary of at most {max_chars} characters. Keep abnormal results with their
+values and ranges, group related tests (e.g. lipid panel, blood count), and mention
+what was tested. No advice, no preamble.
+
+{summaries}"""
+
+REPORTS_ROLLUP_PROMPT = """Combine these summaries of a patient's lab reports, oldest
+first, into a single summary of at most {max_chars} characters. Keep abnormal results
+with their values, ranges and report dates, and note how repeated tests changed
+between reports. No advice, no preamble.
+
+{summaries}"""
+
+
+def page_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _clip(text: str, max_chars: int) -> str:
+    text = text.strip()
+    return text if len(text) <= max_chars else text[: max_chars - 3].rstrip() + "..."
+
+
+async def _ainvoke(llm: BaseChatModel, prompt: str, max_chars: int) -> str:
+    async with stage_limit("llm"):
+        response = await llm.ainvoke(prompt)
+    return _clip(response.content, max_chars)
+
+
+def _groups(summaries: list[str], max_chars: int) -> list[list[str]]:
+    """
+    Splits summaries into consecutive groups of at most max_chars each.
+    Every group but the last holds at least two summaries, so each
+    roll-up level has fewer summaries than the one before.
+    """
+    groups: list[list[str]] = [[]]
+    size = 0
+    for summary in summaries:
+        if len(groups[-1]) >= 2 and size + len(summary) > max_chars:
+            groups.append([])
+            size = 0
+        groups[-1].append(summary)
+        size += len(summary)
+    return groups
+
+
+async def _arollup(
+    llm: BaseChatModel,
+    prompt: str,
+    level: list[str],
+    report_max_chars: int,
+    rollup_max_chars: int,
+) -> str:
+    """
+    Rolls summaries up group by group until one of at most
+    report_max_chars remains. Keeps every LLM call's input bounded,
+    however many summaries there are.
+    """
+    while True:
+        groups = _groups(level, rollup_max_chars)
+        level = await asyncio.gather(
+            *(
+                _ainvoke(
+                    llm,
+                    prompt.format(
+                        max_chars=report_max_chars, summaries="\n\n".join(group)
+                    ),
+                    report_max_chars,
+                )
+                for group in groups
+            )
+        )
+        if len(level) == 1:
+            return level[0]
+
+
+async def asummarize_report(
+    llm: BaseChatModel,
+    pages: list[Document],
+    previous: dict | None,
+    page_max_chars: int,
+    report_max_chars: int,
+    rollup_max_chars: int,
+) -> dict:
+    """
+    Builds the hierarchical summary of a report: one summary per page
+    (concurrent LLM calls), then rolled up group by group until a single
+    report summary of at most report_max_chars remains.
+
+    Page summaries from `previous` are reused for pages whose text has not
+    changed, so re-uploading a corrected or extended report only
+    summarizes the new pages (plus the roll-up).
+    """
+    reusable = {
+        page["hash"]: page["summary"] for page in (previous or {}).get("pages", [])
+    }
+
+    async def summarize_page(doc: Document) -> dict:
+        text = doc.page_content.strip()
+        digest = page_hash(text)
+        if digest in reusable:
+            summary = reusable[digest]
+        elif not text:
+            summary = ""
+        else:
+            summary = await _ainvoke(
+                llm,
+                PAGE_PROMPT.format(
+                    max_chars=page_max_chars, page=doc.metadata["page"] + 1, text=text
+                ),
+                page_max_chars,
+            )
+        return {"page": doc.metadata["page"], "hash": digest, "summary": summary}
+
+    page_summaries = await asyncio.gather(*(summarize_page(doc) for doc in pages))
+    reused = sum(page["hash"] in reusable for page in page_summaries)
+
+    level = [
+        f"Page {page['page'] + 1}: {page['summary']}"
+        for page in page_summaries
+        if page["summary"]
+    ]
+    if not level:
+        report = ""
+    elif len(level) == 1:
+        report = _clip(level[0], report_max_chars)
+    else:
+        report = await _arollup(
+            llm, ROLLUP_PROMPT, level, report_max_chars, rollup_max_chars
+        )
+
+    return {
+        "report": report,
+        "pages": page_summaries,
+        "reused_pages": reused,
+    }
+
+
+def report_label(summary: dict) -> str:
+    return f"Report of {summary.get('report_date')} ({summary.get('filename')})"
+
+
+async def arollup_reports(
+    llm: BaseChatModel,
+    reports: list[dict],
+    report_max_chars: int,
+    rollup_max_chars: int,
+) -> str:
+    """
+    The summary across all of a user's reports (summaries as built by
+    asummarize_report, oldest first). A single report is its own roll-up.
+    """
+    reports = [report for report in reports if report["report"]]
+    if not reports:
+        return ""
+    if len(reports) == 1:
+        return reports[0]["report"]
+    level = [f"{report_label(report)}: {report['report']}" for report in reports]
+    return await _arollup(
+        llm, REPORTS_ROLLUP_PROMPT, level, report_max_chars, rollup_max_chars
+    )
+
+
+def format_summary(
+    rollup: str, reports: list[dict], lab_values: list[LabValue], max_chars: int
+) -> list[str]:
+    """
+    The bounded whole-report view given to the agent: the roll-up of all
+    reports, the out-of-range structured lab values, then page summaries
+    (latest report first) until max_chars is reached.
+    """
+    parts = [f"Report summary: {rollup}"]
+    flagged = [value for value in lab_values if value.status in ("low", "high")]
+    if flagged:
+        parts.append(
+            "Out-of-range values: " + "; ".join(value.describe() for value in flagged)
+        )
+    budget = max_chars - sum(len(part) for part in parts)
+    lines = [
+        (f"{report_label(report)}, page " if len(reports) > 1 else "Page ")
+        + f"{page['page'] + 1}: {page['summary']}"
+        for report in reversed(reports)
+        for page in report["pages"]
+        if page["summary"]
+    ]
+    for line in lines:
+        if len(line) > budget:
+            parts.append(
+                "(More page detail is available with the getReportChunks tool.)"
+            )
+            break
+        parts.append(line)
+        budget -= len(line)
+    return parts
+
+
+class ReportSummaryStore:
+    """
+    Per-user report summaries, one JSON file per user next to the
+    indexes: {"reports": {document_id: summary}, "rollup": str,
+    "rollup_of": [document_id, ...]}, where rollup_of lists the reports
+    the roll-up was built from. Loaded files are cached per worker and
+    reloaded when their mtime changes. Writers hold the user's index
+    write lock.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._cache: dict[str, tuple[int, dict]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: str) -> Path:
+        return self.root / f"{user_id}.json"
+
+    def save(self, user_id: str, summaries: dict) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(user_id)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        tmp_path.write_text(json.dumps(summaries))
+        os.replace(tmp_path, path)
+
+    def load(self, user_id: str) -> dict | None:
+        path = self._path(user_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._cache.pop(user_id, None)
+            return None
+        with self._lock:
+            cached = self._cache.get(user_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        summaries = json.loads(path.read_text())
+        if "reports" not in summaries:
+            # Written when only the latest report was summarized
+            document_id = summaries.get("document_id")
+            summaries = {
+                "reports": {document_id: summaries} if document_id else {},
+                "rollup": summaries["report"],
+                "rollup_of": [document_id] if document_id else [],
+            }
+        with self._lock:
+            self._cache[user_id] = (mtime, summaries)
+        return summaries
+
+    def delete(self, user_id: str) -> None:
+        self._path(user_id).unlink(missing_ok=True)
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def replace_report(self, user_id: str, document_id: str, summary: dict) -> None:
+        """Stores one report's summary; the roll-up is rebuilt separately."""
+        summaries = self.load(user_id) or {"reports": {}, "rollup": "", "rollup_of": []}
+        self.save(
+            user_id,
+            {**summaries, "reports": {**summaries["reports"], document_id: summary}},
+        )
+
+    def remove_report(self, user_id: str, document_id: str) -> None:
+        summaries = self.load(user_id)
+        if summaries is None or document_id not in summaries["reports"]:
+            return
+        reports = {
+            key: value
+            for key, value in summaries["reports"].items()
+            if key != document_id
+        }
+        if reports:
+            self.save(user_id, {**summaries, "reports": reports})
+        else:
+            self.delete(user_id)
+
+    def save_rollup(self, user_id: str, rollup: str, document_ids: list[str]) -> bool:
+        """
+        Stores the roll-up built from these reports' summaries, unless the
+        stored reports changed meanwhile (their writer rebuilds it).
+        """
+        summaries = self.load(user_id)
+        if summaries is None or sorted(summaries["reports"]) != sorted(document_ids):
+            return False
+        self.save(
+            user_id, {**summaries, "rollup": rollup, "rollup_of": list(document_ids)}
+        )
+        return True
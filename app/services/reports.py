@@ -0,0 +1,131 @@
+import datetime
+import hashlib
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from langchain_core.documents import Document
+
+_MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [
+            ("jan", "january"),
+            ("feb", "february"),
+            ("mar", "march"),
+            ("apr", "april"),
+            ("may",),
+            ("jun", "june"),
+            ("jul", "july"),
+            ("aug", "august"),
+            ("sep", "sept", "september"),
+            ("oct", "october"),
+            ("nov", "november"),
+            ("dec", "december"),
+        ],
+        start=1,
+    )
+    for name in names
+}
+_MONTH = r"(?P<month_name>[A-Za-z]{3,9})"
+_DATES = [
+    # 2024-03-02, 2024/03/02
+    re.compile(r"\b(?P<year>\d{4})[-/.](?P<month>\d{1,2})[-/.](?P<day>\d{1,2})\b"),
+    # 02/03/2024, 02-03-2024, 02.03.2024 (day first unless that is impossible)
+    re.compile(r"\b(?P<day>\d{1,2})[-/.](?P<month>\d{1,2})[-/.](?P<year>\d{4})\b"),
+    # 2 Mar 2024, 02-Mar-2024
+    re.compile(rf"\b(?P<day>\d{{1,2}})[\s-]{_MONTH}[\s,-]+(?P<year>\d{{4}})\b"),
+    # Mar 2, 2024
+    re.compile(rf"\b{_MONTH}\s+(?P<day>\d{{1,2}}),?\s+(?P<year>\d{{4}})\b"),
+]
+# Words on a line that say which date it is, most telling first
+_DATE_KEYWORDS = ("report", "collect", "sample", "date")
+# Only the top of a report carries its dates
+_DATE_SEARCH_PAGES = 2
+
+
+def document_id_from_sha256(hexdigest: str) -> str:
+    """The document id of a report whose SHA-256 (hex) is already known."""
+    return hexdigest[:16]
+
+
+def report_document_id(pdf_path: Path) -> str:
+    """
+    Identifies a report by its content, so uploading the same PDF again
+    replaces its chunks instead of adding a duplicate.
+    """
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return document_id_from_sha256(digest.hexdigest())
+
+
+def _to_date(match: re.Match) -> datetime.date | None:
+    fields = match.groupdict()
+    if fields.get("month_name"):
+        month = _MONTHS.get(fields["month_name"].lower())
+        if month is None:
+            return None
+    else:
+        month = int(fields["month"])
+    day, year = int(fields["day"]), int(fields["year"])
+    if month > 12 and day <= 12:
+        day, month = month, day  # 03/28/2024 is month first
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def extract_report_date(pages: list[Document]) -> str | None:
+    """
+    The report's date (ISO format) from its first pages: a date on a line
+    mentioning the report, then the sample collection, then any "date"
+    line, then the first date found. None if the text has no date.
+    """
+    found: list[tuple[int, datetime.date]] = []
+    for doc in pages[:_DATE_SEARCH_PAGES]:
+        for line in doc.page_content.splitlines():
+            lowered = line.lower()
+            rank = next(
+                (i for i, word in enumerate(_DATE_KEYWORDS) if word in lowered),
+                len(_DATE_KEYWORDS),
+            )
+            for pattern in _DATES:
+                for match in pattern.finditer(line):
+                    date = _to_date(match)
+                    if date is not None:
+                        found.append((rank, date))
+    if not found:
+        return None
+    # min() keeps the first date among equally ranked ones
+    return min(found, key=lambda item: item[0])[1].isoformat()
+
+
+@dataclass(frozen=True)
+class ReportFilter:
+    """
+    Restricts retrieval to some of a user's reports: by document id and/or
+    an inclusive range of report dates (ISO strings). Chunks indexed
+    before reports were tracked have neither, so only an unrestricted
+    filter includes them.
+    """
+
+    document_ids: tuple[str, ...] | None = None
+    date_from: str | None = None
+    date_to: str | None = None
+
+    def __bool__(self) -> bool:
+        return bool(self.document_ids is not None or self.date_from or self.date_to)
+
+    def matches(self, document_id: str | None, report_date: str | None) -> bool:
+        if self.document_ids is not None and document_id not in self.document_ids:
+            return False
+        if (self.date_from or self.date_to) and not report_date:
+            return False
+        if self.date_from and report_date < self.date_from:
+            return False
+        if self.date_to and report_date > self.date_to:
+            return False
+        return True
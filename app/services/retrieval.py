@@ -0,0 +1,206 @@
+import asyncio
+import re
+import threading
+import weakref
+from collections import defaultdict
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from app.services.reports import ReportFilter
+
+# Lowercased alphanumeric runs (decimals kept whole), so "HbA1c:" and
+# "hba1c" are the same token
+_TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def mmr_select(
+    query_vector: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.5,
+    relevance: np.ndarray | None = None,
+) -> list[int]:
+    """
+    Maximal marginal relevance over candidate vectors, vectorized.
+
+    The candidate-to-candidate cosine similarity matrix is computed once
+    and each pick only updates a running "most similar selected" vector,
+    instead of recomputing similarities against every selected vector in
+    a Python loop. With relevance=None it picks the same indices as
+    LangChain's maximal_marginal_relevance; a relevance array (e.g. a
+    hybrid dense+lexical score) replaces the query similarity.
+    """
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+    unit = _unit_rows(np.asarray(candidates, dtype=np.float32))
+    if relevance is None:
+        relevance = unit @ _unit_rows(np.asarray(query_vector, dtype=np.float32))
+    pairwise = unit @ unit.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(len(unit), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        np.maximum(redundancy, pairwise[pick], out=redundancy)
+    return selected
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of texts, with NumPy posting lists."""
+
+    def __init__(self, texts, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        postings: dict[str, dict[int, int]] = defaultdict(dict)
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for token in tokens:
+                postings[token][doc_id] = postings[token].get(doc_id, 0) + 1
+        self.size = len(lengths)
+        self._lengths = np.asarray(lengths, dtype=np.float32)
+        self._avg_length = float(self._lengths.mean()) if self.size else 0.0
+        self._postings = {
+            token: (
+                np.fromiter(docs.keys(), dtype=np.int64, count=len(docs)),
+                np.fromiter(docs.values(), dtype=np.float32, count=len(docs)),
+            )
+            for token, docs in postings.items()
+        }
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.size, dtype=np.float32)
+        if not self.size:
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self._lengths / self._avg_length)
+        for token in set(tokenize(query)):
+            if token not in self._postings:
+                continue
+            doc_ids, tf = self._postings[token]
+            idf = np.log1p((self.size - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            scores[doc_ids] += idf * tf * (self.k1 + 1) / (tf + norm[doc_ids])
+        return scores
+
+
+# BM25 indexes are built on first hybrid query and live as long as the
+# loaded vector store does (i.e. until the index cache drops it).
+_bm25_indexes: "weakref.WeakKeyDictionary[Any, BM25Index]" = weakref.WeakKeyDictionary()
+_bm25_lock = threading.Lock()
+
+
+def get_bm25_index(vectorstore) -> BM25Index:
+    """The BM25 index over a loaded MmapVectorStore's chunk texts."""
+    with _bm25_lock:
+        index = _bm25_indexes.get(vectorstore)
+    if index is None:
+        index = BM25Index(vectorstore.iter_texts())
+        with _bm25_lock:
+            _bm25_indexes[vectorstore] = index
+    return index
+
+
+class HybridMMRRetriever(BaseRetriever):
+    """
+    MMR retriever over a memory-mapped per-user index.
+
+    Candidates are the fetch_k nearest vectors, read straight from the
+    mapped matrix (nothing is re-embedded). With bm25_weight > 0 the
+    fetch_k best lexical matches join the candidate set and relevance
+    becomes (1 - w) * cosine + w * normalized BM25, so exact analyte names
+    such as "HbA1c" are not lost to dense-only ranking. A report_filter
+    restricts both candidate sets to the selected reports.
+    """
+
+    vectorstore: Any  # MmapVectorStore
+    k: int = 5
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    bm25_weight: float = 0.0
+    report_filter: ReportFilter | None = None
+
+    def select(self, query: str, query_vector: list[float]) -> list[Document]:
+        return self.select_many([query], [query_vector])[0]
+
+    def select_many(
+        self, queries: list[str], query_vectors: list[list[float]]
+    ) -> list[list[Document]]:
+        """
+        select() for several queries, with one nearest-neighbour search
+        over the whole query matrix.
+        """
+        store = self.vectorstore
+        query_matrix = np.asarray(query_vectors, dtype=np.float32)
+        mask = store.report_mask(self.report_filter) if self.report_filter else None
+        nearest, _ = store.nearest_many(query_matrix, self.fetch_k, mask)
+        return [
+            self._pick(query, query_array, candidates, mask)
+            for query, query_array, candidates in zip(queries, query_matrix, nearest)
+        ]
+
+    def _pick(
+        self,
+        query: str,
+        query_array: np.ndarray,
+        candidates: np.ndarray,
+        mask: np.ndarray | None,
+    ) -> list[Document]:
+        store = self.vectorstore
+        lexical = None
+        if self.bm25_weight > 0:
+            lexical = get_bm25_index(store).scores(query)
+            if mask is not None:
+                lexical = np.where(mask, lexical, 0)
+            top = np.argsort(-lexical, kind="stable")[: self.fetch_k]
+            top = top[lexical[top] > 0]
+            candidates = np.concatenate([candidates, np.setdiff1d(top, candidates)])
+        if not candidates.size:
+            return []
+
+        vectors = store.vectors[candidates]
+        relevance = None
+        if lexical is not None:
+            dense = _unit_rows(vectors) @ _unit_rows(query_array)
+            lexical = lexical[candidates]
+            peak = lexical.max()
+            if peak > 0:
+                lexical = lexical / peak
+            relevance = (1 - self.bm25_weight) * dense + self.bm25_weight * lexical
+        picks = mmr_select(
+            query_array, vectors, self.k, self.lambda_mult, relevance=relevance
+        )
+        return [store.get_document(int(candidates[i])) for i in picks]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return self.select(query, self.vectorstore.embeddings.embed_query(query))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        query_vector = await self.vectorstore.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self.select, query, query_vector)
@@ -0,0 +1,770 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import ExitStack, closing, contextmanager
+from pathlib import Path
+from typing import Any
+
+import faiss
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from app.services.reports import ReportFilter
+from app.services.retrieval import mmr_select
+
+logger = logging.getLogger(__name__)
+
+# Vector ids are (user_num << 32) | seq, so each user owns one contiguous
+# id range and a search can be restricted to it with an IDSelectorRange.
+USER_SHIFT = 32
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    user_num INTEGER NOT NULL UNIQUE,
+    next_seq INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS chunks_user ON chunks (user_id, deleted);
+"""
+
+
+# A shard's base file is this magic, its log generation and the FAISS
+# index serialized; files written before the append log are plain FAISS
+# files (generation 0).
+_BASE_MAGIC = b"RAGSHRD1"
+_BASE_HEADER = struct.Struct("<8sq")
+# Each append log record is (count, dim), count ids, then count vectors
+_RECORD_HEADER = struct.Struct("<qq")
+# The log is folded into the base once it outgrows it (and this size), so
+# the rewrites cost amortized O(1) per appended vector
+_CHECKPOINT_MIN_BYTES = 16 * 1024 * 1024
+
+
+def _id_range(user_num: int) -> tuple[int, int]:
+    return user_num << USER_SHIFT, (user_num + 1) << USER_SHIFT
+
+
+class _ReadWriteLock:
+    """Many concurrent searches of an in-memory shard, or one change to it."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            # Waiting writers go first, so appends are not starved by searches
+            while self._writing or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class _Shard:
+    """
+    A shard's in-memory index and how much of the files on disk it holds:
+    the base file it was loaded from (inode, mtime, size), the log
+    generation and the log bytes applied since.
+    """
+
+    def __init__(self):
+        self.index: faiss.Index | None = None
+        self.base_key: tuple | None = None
+        self.generation = 0
+        self.offset = 0
+        # Guards the index object: searches read, appends and reloads write
+        self.rw = _ReadWriteLock()
+        # Serializes this worker's writers to the shard (with the file lock
+        # across workers)
+        self.write_lock = threading.Lock()
+
+
+def _encode_record(ids: np.ndarray, matrix: np.ndarray) -> bytes:
+    return (
+        _RECORD_HEADER.pack(len(ids), matrix.shape[1])
+        + ids.astype("<i8").tobytes()
+        + matrix.astype("<f4").tobytes()
+    )
+
+
+def _decode_records(data: bytes) -> tuple[list[tuple[np.ndarray, np.ndarray]], int]:
+    """The complete records at the start of data, and the bytes they use."""
+    records = []
+    used = 0
+    while used + _RECORD_HEADER.size <= len(data):
+        count, dim = _RECORD_HEADER.unpack_from(data, used)
+        end = used + _RECORD_HEADER.size + count * 8 + count * dim * 4
+        if end > len(data):
+            # A record still being written by another worker
+            break
+        start = used + _RECORD_HEADER.size
+        ids = np.frombuffer(data, dtype="<i8", count=count, offset=start)
+        vectors = np.frombuffer(
+            data, dtype="<f4", count=count * dim, offset=start + count * 8
+        ).reshape(count, dim)
+        records.append((ids.astype(np.int64), vectors.astype(np.float32)))
+        used = end
+    return records, used
+
+
+class SharedIndexStore:
+    """
+    All users' vectors in a few sharded FAISS indexes instead of one
+    directory per user.
+
+    - Each shard is an IndexIDMap2 over a flat L2 index (the same metric as
+      the per-user indexes); a user's vectors all live in one shard.
+    - Chunk text and metadata live in a SQLite docstore keyed by vector id.
+    - Writes are append-only. Deleting marks rows as tombstones, which
+      searches exclude with an id selector; compact() later removes
+      tombstoned vectors from the shards.
+    - A shard on disk is a base file plus an append log. An add appends
+      one record of its vectors to the log and to the in-memory shard,
+      so its cost does not grow with the shard. Other workers apply the
+      log records they have not seen yet, and reload only when the base
+      changes: when a checkpoint folds the log into a new base (once the
+      log outgrows the base) or compaction rewrites it.
+    - Writers to a shard are serialized by a per-shard lock and file
+      lock; the docstore rows are committed after the vectors are
+      appended, outside those locks.
+    """
+
+    def __init__(self, root: Path, num_shards: int):
+        self.root = root
+        self.num_shards = num_shards
+        self._shards = {shard: _Shard() for shard in range(num_shards)}
+
+    # --- Storage helpers ---
+
+    def _connect(self) -> sqlite3.Connection:
+        # The schema is (re)created whenever the file is missing, e.g. on
+        # first use or after the directory was removed by hand.
+        path = self.root / "docstore.sqlite3"
+        is_new = not path.exists()
+        if is_new:
+            self.root.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        if is_new:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        return conn
+
+    def _shard_path(self, shard: int) -> Path:
+        return self.root / f"shard_{shard}.faiss"
+
+    def _log_path(self, shard: int, generation: int) -> Path:
+        return self.root / f"shard_{shard}.{generation}.log"
+
+    @contextmanager
+    def _write_lock(self, shard: int):
+        """Serializes writers to one shard across threads and processes."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._shards[shard].write_lock, open(
+            self.root / f"shard_{shard}.lock", "w"
+        ) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _base_key(self, shard: int) -> tuple | None:
+        try:
+            stat = os.stat(self._shard_path(shard))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _log_size(self, shard: int, generation: int) -> int:
+        try:
+            return os.stat(self._log_path(shard, generation)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _read_base(self, shard: int) -> tuple[faiss.Index, int]:
+        data = self._shard_path(shard).read_bytes()
+        magic, generation = _BASE_HEADER.unpack_from(data)
+        if magic != _BASE_MAGIC:
+            return faiss.deserialize_index(np.frombuffer(data, dtype=np.uint8)), 0
+        body = np.frombuffer(data, dtype=np.uint8, offset=_BASE_HEADER.size)
+        return faiss.deserialize_index(body), generation
+
+    def _sync(self, shard: int) -> _Shard | None:
+        """
+        Brings the in-memory shard up to date with the files: reloads it
+        if the base changed, else applies the log records it has not seen.
+        None if the shard has no files yet.
+        """
+        state = self._shards[shard]
+        base_key = self._base_key(shard)
+        if (
+            state.index is not None
+            and base_key == state.base_key
+            and self._log_size(shard, state.generation) == state.offset
+        ):
+            return state
+        with state.rw.write():
+            while True:
+                base_key = self._base_key(shard)
+                if base_key is None:
+                    state.index, state.base_key = None, None
+                    return None
+                if base_key != state.base_key or state.index is None:
+                    state.index, state.generation = self._read_base(shard)
+                    state.base_key, state.offset = base_key, 0
+                try:
+                    with open(self._log_path(shard, state.generation), "rb") as log:
+                        log.seek(state.offset)
+                        data = log.read()
+                except FileNotFoundError:
+                    if self._base_key(shard) != state.base_key:
+                        # Checkpointed meanwhile: load the new base instead
+                        continue
+                    data = b""
+                records, used = _decode_records(data)
+                for ids, vectors in records:
+                    state.index.add_with_ids(vectors, ids)
+                state.offset += used
+                return state
+
+    def _write_base(self, shard: int, state: _Shard, generation: int) -> None:
+        """
+        Writes the in-memory shard as a new base starting log generation
+        `generation`, then drops the log it replaces. Under the write lock.
+        """
+        path = self._shard_path(shard)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        with state.rw.read():
+            body = faiss.serialize_index(state.index)
+        with open(tmp_path, "wb") as out:
+            out.write(_BASE_HEADER.pack(_BASE_MAGIC, generation))
+            out.write(body.tobytes())
+        with state.rw.write():
+            os.replace(tmp_path, path)
+            old_generation = state.generation
+            state.base_key = self._base_key(shard)
+            state.generation, state.offset = generation, 0
+        if old_generation != generation:
+            self._log_path(shard, old_generation).unlink(missing_ok=True)
+
+    def _append(
+        self, shard: int, dim: int, ids: np.ndarray, matrix: np.ndarray
+    ) -> None:
+        """Adds vectors to a shard: one log record and an in-memory add."""
+        with self._write_lock(shard):
+            state = self._sync(shard)
+            if state is None:
+                state = self._shards[shard]
+                with state.rw.write():
+                    state.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+                    state.generation = 0
+                self._write_base(shard, state, 0)
+
+            record = _encode_record(ids, matrix)
+            with open(self._log_path(shard, state.generation), "ab") as log:
+                log.write(record)
+            with state.rw.write():
+                state.index.add_with_ids(matrix, ids)
+                state.offset += len(record)
+
+            if state.offset > max(_CHECKPOINT_MIN_BYTES, state.base_key[2]):
+                self._write_base(shard, state, state.generation + 1)
+
+    def _user_row(self, conn: sqlite3.Connection, user_id: str):
+        return conn.execute(
+            "SELECT user_num, next_seq, version FROM users WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+
+    def _ensure_user(self, user_id: str) -> int:
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = self._user_row(conn, user_id)
+            if row is None:
+                user_num = conn.execute(
+                    "SELECT COALESCE(MAX(user_num), -1) + 1 FROM users"
+                ).fetchone()[0]
+                conn.execute(
+                    "INSERT INTO users (user_id, user_num) VALUES (?, ?)",
+                    (user_id, user_num),
+                )
+            else:
+                user_num = row[0]
+            conn.execute("COMMIT")
+        return user_num
+
+    def _dim(self, conn: sqlite3.Connection, default: int | None = None) -> int | None:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        if row is None and default is not None:
+            conn.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (default,))
+            return default
+        return row[0] if row else None
+
+    # --- Public API ---
+
+    def add_chunks(
+        self,
+        user_id: str,
+        texts: list[str],
+        metadatas: list[dict],
+        vectors: list[list[float]],
+        replace: bool = False,
+        replace_document: str | None = None,
+    ) -> None:
+        """
+        Appends a user's chunks. In the same step, replace=True tombstones
+        all of the user's existing chunks, and replace_document only those
+        of that report (a re-upload of it).
+        """
+        user_num = self._ensure_user(user_id)
+        shard = user_num % self.num_shards
+        matrix = np.asarray(vectors, dtype=np.float32)
+
+        # Reserve the ids first (a failed add only leaves a gap)
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                dim = self._dim(conn, default=matrix.shape[1])
+                if matrix.shape[1] != dim:
+                    raise ValueError(
+                        f"Embedding dimension {matrix.shape[1]} does not match "
+                        f"shared index dimension {dim}."
+                    )
+                next_seq = self._user_row(conn, user_id)[1]
+                conn.execute(
+                    "UPDATE users SET next_seq = ? WHERE user_id = ?",
+                    (next_seq + len(texts), user_id),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        ids = np.arange(next_seq, next_seq + len(texts), dtype=np.int64)
+        ids |= np.int64(user_num << USER_SHIFT)
+
+        # Vectors first: a vector without a docstore row is ignored by
+        # searches, a row without a vector would be lost.
+        self._append(shard, dim, ids, matrix)
+
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if replace:
+                    conn.execute(
+                        "UPDATE chunks SET deleted = 1 WHERE user_id = ?", (user_id,)
+                    )
+                elif replace_document is not None:
+                    self._tombstone_document(conn, user_id, replace_document)
+                conn.executemany(
+                    "INSERT INTO chunks (id, user_id, text, metadata) VALUES (?, ?, ?, ?)",
+                    [
+                        (int(i), user_id, text, json.dumps(metadata))
+                        for i, text, metadata in zip(ids, texts, metadatas)
+                    ],
+                )
+                conn.execute(
+                    "UPDATE users SET version = version + 1 WHERE user_id = ?",
+                    (user_id,),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def delete_user(self, user_id: str) -> bool:
+        """Tombstones all of a user's chunks. Returns False if there were none."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                "UPDATE chunks SET deleted = 1 WHERE user_id = ? AND deleted = 0",
+                (user_id,),
+            )
+            conn.execute(
+                "UPDATE users SET version = version + 1 WHERE user_id = ?", (user_id,)
+            )
+            conn.execute("COMMIT")
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def _tombstone_document(
+        conn: sqlite3.Connection, user_id: str, document_id: str
+    ) -> int:
+        return conn.execute(
+            "UPDATE chunks SET deleted = 1 WHERE user_id = ? AND deleted = 0 "
+            "AND json_extract(metadata, '$.document_id') = ?",
+            (user_id, document_id),
+        ).rowcount
+
+    def delete_document(self, user_id: str, document_id: str) -> bool:
+        """Tombstones one report's chunks. Returns False if there were none."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = self._tombstone_document(conn, user_id, document_id)
+            conn.execute(
+                "UPDATE users SET version = version + 1 WHERE user_id = ?", (user_id,)
+            )
+            conn.execute("COMMIT")
+        return deleted > 0
+
+    def has_user(self, user_id: str) -> bool:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM chunks WHERE user_id = ? AND deleted = 0 LIMIT 1",
+                (user_id,),
+            ).fetchone()
+        return row is not None
+
+    def has_document(self, user_id: str, document_id: str) -> bool:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM chunks WHERE user_id = ? AND deleted = 0 "
+                "AND json_extract(metadata, '$.document_id') = ? LIMIT 1",
+                (user_id, document_id),
+            ).fetchone()
+        return row is not None
+
+    def user_version(self, user_id: str) -> tuple | None:
+        """Changes whenever the user's chunks change; None if there are none."""
+        with closing(self._connect()) as conn:
+            row = self._user_row(conn, user_id)
+        if row is None or not self.has_user(user_id):
+            return None
+        return ("shared", row[2])
+
+    def get_texts(self, user_id: str) -> list[str]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT text FROM chunks WHERE user_id = ? AND deleted = 0 ORDER BY id",
+                (user_id,),
+            ).fetchall()
+        return [text for (text,) in rows]
+
+    def get_metadatas(self, user_id: str) -> list[dict]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT metadata FROM chunks WHERE user_id = ? AND deleted = 0 "
+                "ORDER BY id",
+                (user_id,),
+            ).fetchall()
+        return [json.loads(metadata) for (metadata,) in rows]
+
+    def search(
+        self,
+        user_id: str,
+        query_vector: list[float],
+        fetch_k: int,
+        report_filter: ReportFilter | None = None,
+    ) -> list[tuple[Document, float, np.ndarray]]:
+        """
+        Nearest live chunks of one user (of the reports report_filter
+        matches, if given): (document, L2 distance, vector) triples,
+        closest first.
+        """
+        return self.search_many(user_id, [query_vector], fetch_k, report_filter)[0]
+
+    @staticmethod
+    def _matching_ids(
+        conn: sqlite3.Connection, user_id: str, report_filter: ReportFilter
+    ) -> np.ndarray:
+        """Ids of the user's live chunks in the reports the filter matches."""
+        rows = conn.execute(
+            "SELECT id, json_extract(metadata, '$.document_id'), "
+            "json_extract(metadata, '$.report_date') "
+            "FROM chunks WHERE user_id = ? AND deleted = 0",
+            (user_id,),
+        )
+        return np.array(
+            [
+                i
+                for i, document_id, report_date in rows
+                if report_filter.matches(document_id, report_date)
+            ],
+            dtype=np.int64,
+        )
+
+    def search_many(
+        self,
+        user_id: str,
+        query_vectors: list[list[float]],
+        fetch_k: int,
+        report_filter: ReportFilter | None = None,
+    ) -> list[list[tuple[Document, float, np.ndarray]]]:
+        """search() for several query vectors with one FAISS search call."""
+        empty = [[] for _ in query_vectors]
+        with closing(self._connect()) as conn:
+            row = self._user_row(conn, user_id)
+            if row is None:
+                return empty
+            user_num = row[0]
+            dead = np.array(
+                [
+                    i
+                    for (i,) in conn.execute(
+                        "SELECT id FROM chunks WHERE user_id = ? AND deleted = 1",
+                        (user_id,),
+                    )
+                ],
+                dtype=np.int64,
+            )
+            wanted = None
+            if report_filter:
+                wanted = self._matching_ids(conn, user_id, report_filter)
+                if not wanted.size:
+                    return empty
+
+        state = self._sync(user_num % self.num_shards)
+        if state is None:
+            return empty
+
+        # Restrict the search to this user's id range minus tombstones (and
+        # to the filtered reports' chunks). The selector objects must stay
+        # referenced until the search ends.
+        low, high = _id_range(user_num)
+        selector = faiss.IDSelectorRange(low, high)
+        if dead.size:
+            dead_selector = faiss.IDSelectorBatch(dead.size, faiss.swig_ptr(dead))
+            not_dead = faiss.IDSelectorNot(dead_selector)
+            selector = faiss.IDSelectorAnd(selector, not_dead)
+        if wanted is not None:
+            wanted_selector = faiss.IDSelectorBatch(wanted.size, faiss.swig_ptr(wanted))
+            selector = faiss.IDSelectorAnd(selector, wanted_selector)
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        with state.rw.read():
+            distances, ids = state.index.search(
+                queries, fetch_k, params=faiss.SearchParameters(sel=selector)
+            )
+            hits = [
+                [(int(i), float(d)) for i, d in zip(row_ids, row_distances) if i >= 0]
+                for row_ids, row_distances in zip(ids, distances)
+            ]
+            unique = sorted({i for row_hits in hits for i, _ in row_hits})
+            vectors = {i: state.index.reconstruct(i) for i in unique}
+        if not unique:
+            return empty
+        with closing(self._connect()) as conn:
+            rows = {
+                i: (text, metadata)
+                for i, text, metadata in conn.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE deleted = 0 AND id IN "
+                    f"({','.join('?' * len(unique))})",
+                    unique,
+                )
+            }
+        return [
+            [
+                (
+                    Document(page_content=rows[i][0], metadata=json.loads(rows[i][1])),
+                    distance,
+                    vectors[i],
+                )
+                for i, distance in row_hits
+                if i in rows
+            ]
+            for row_hits in hits
+        ]
+
+    def compact(self) -> int:
+        """
+        Removes tombstoned vectors from every shard and their docstore rows.
+        Returns the number of vectors reclaimed.
+        """
+        reclaimed = 0
+        for shard in range(self.num_shards):
+            if not self._shard_path(shard).exists():
+                continue
+            with self._write_lock(shard), closing(self._connect()) as conn:
+                state = self._sync(shard)
+                if state is None:
+                    continue
+                dead = np.array(
+                    [
+                        i
+                        for (i,) in conn.execute(
+                            "SELECT c.id FROM chunks AS c JOIN users AS u "
+                            "ON c.user_id = u.user_id "
+                            "WHERE c.deleted = 1 AND u.user_num % ? = ?",
+                            (self.num_shards, shard),
+                        )
+                    ],
+                    dtype=np.int64,
+                )
+                if not dead.size:
+                    continue
+                with state.rw.write():
+                    state.index.remove_ids(
+                        faiss.IDSelectorBatch(dead.size, faiss.swig_ptr(dead))
+                    )
+                self._write_base(shard, state, state.generation + 1)
+                conn.executemany(
+                    "DELETE FROM chunks WHERE id = ?", [(int(i),) for i in dead]
+                )
+                reclaimed += int(dead.size)
+        return reclaimed
+
+    def clear(self) -> int:
+        """
+        Deletes every user's chunks and empties the shards, under all of
+        the shards' write locks. User rows (and so their id ranges) are
+        kept, so a search that looked a user up before the clear never
+        matches another user's later vectors. Returns the number of chunks
+        deleted.
+        """
+        with ExitStack() as locks:
+            for shard in range(self.num_shards):
+                locks.enter_context(self._write_lock(shard))
+            with closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    deleted = conn.execute("DELETE FROM chunks").rowcount
+                    conn.execute("UPDATE users SET version = version + 1")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            for shard in range(self.num_shards):
+                state = self._sync(shard)
+                if state is None:
+                    continue
+                with state.rw.write():
+                    state.index.reset()
+                self._write_base(shard, state, state.generation + 1)
+        return deleted
+
+    def tombstone_ratio(self) -> float:
+        with closing(self._connect()) as conn:
+            total, dead = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(deleted), 0) FROM chunks"
+            ).fetchone()
+        return dead / total if total else 0.0
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as conn:
+            users, total, dead = conn.execute(
+                "SELECT (SELECT COUNT(*) FROM users), COUNT(*), "
+                "COALESCE(SUM(deleted), 0) FROM chunks"
+            ).fetchone()
+        return {
+            "shards": self.num_shards,
+            "users": users,
+            "chunks": total - dead,
+            "tombstones": dead,
+        }
+
+
+async def compaction_loop(
+    store: SharedIndexStore, interval_seconds: float, min_tombstone_ratio: float
+) -> None:
+    """Periodically reclaims tombstoned vectors once enough have piled up."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            ratio = await asyncio.to_thread(store.tombstone_ratio)
+            if ratio >= min_tombstone_ratio:
+                reclaimed = await asyncio.to_thread(store.compact)
+                logger.info("Shared index compaction reclaimed %d vectors.", reclaimed)
+        except Exception as e:
+            logger.exception("Error compacting shared index: %s", e)
+
+
+class SharedIndexRetriever(BaseRetriever):
+    """
+    MMR retriever over one user's chunks in the shared index. A
+    report_filter restricts the index search itself, so it finds the
+    filtered reports' chunks however far down they rank overall.
+    """
+
+    store: Any
+    user_id: str
+    embeddings: Embeddings
+    k: int = 5
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    report_filter: ReportFilter | None = None
+
+    def _select(self, query_vector: list[float]) -> list[Document]:
+        candidates = self.store.search(
+            self.user_id, query_vector, self.fetch_k, self.report_filter
+        )
+        return self._pick(query_vector, candidates)
+
+    def select_many(
+        self, queries: list[str], query_vectors: list[list[float]]
+    ) -> list[list[Document]]:
+        """
+        MMR picks for several queries, with one search over all of their
+        vectors (queries is only taken for HybridMMRRetriever parity).
+        """
+        candidates = self.store.search_many(
+            self.user_id, query_vectors, self.fetch_k, self.report_filter
+        )
+        return [
+            self._pick(query_vector, row)
+            for query_vector, row in zip(query_vectors, candidates)
+        ]
+
+    def _pick(self, query_vector: list[float], candidates: list) -> list[Document]:
+        if not candidates:
+            return []
+        selected = mmr_select(
+            np.asarray(query_vector, dtype=np.float32),
+            np.stack([vector for _, _, vector in candidates]),
+            self.k,
+            self.lambda_mult,
+        )
+        return [candidates[i][0] for i in selected]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return self._select(self.embeddings.embed_query(query))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        query_vector = await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self._select, query_vector)
@@ -0,0 +1,405 @@
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from app.config import TRACE_LOG_ENABLED
+from app.services.chunking import count_tokens
+
+trace_logger = logging.getLogger("app.trace")
+
+# --- Prometheus-style metrics (per worker) ---
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _value_text(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _label_text(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_label_text(self.labels, key)} {_value_text(value)}"
+                )
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> (bucket counts, sum, count)
+        self._values: dict[tuple[str, ...], tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _label_text(names, key + (f"{bound:g}",))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _label_text(names, key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _label_text(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {_value_text(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "rag_request_duration_seconds",
+    "End-to-end request duration.",
+    ("kind", "route"),
+)
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of request stages (index load, retrieval, prompt, LLM calls, agent steps).",
+    ("stage",),
+)
+TOOL_SECONDS = Histogram(
+    "rag_tool_duration_seconds", "Duration of agent tool calls.", ("tool", "status")
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "LLM tokens by type (estimated when the provider reports no usage).",
+    ("type",),
+)
+AGENT_STEPS = Counter("rag_agent_steps_total", "ReAct agent steps taken.")
+CONTEXT_TOKENS = Counter(
+    "rag_context_tokens_total",
+    "Prompt context tokens (local estimate) as raw chunks and after context assembly.",
+    ("type",),
+)
+AGENT_BUDGET_EXHAUSTED = Counter(
+    "rag_agent_budget_exhausted_total",
+    "Agent runs stopped early with a best-effort answer, by the budget they ran out of.",
+    ("budget",),
+)
+AGENT_REPEATED_TOOL_CALLS = Counter(
+    "rag_agent_repeated_tool_calls_total",
+    "Identical tool calls within one agent run answered from the run's memo.",
+)
+REQUESTS_CANCELLED = Counter(
+    "rag_requests_cancelled_total",
+    "Requests abandoned mid-flight because the client disconnected.",
+    ("kind",),
+)
+METRICS = [
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    TOOL_SECONDS,
+    LLM_TOKENS,
+    AGENT_STEPS,
+    CONTEXT_TOKENS,
+    AGENT_BUDGET_EXHAUSTED,
+    AGENT_REPEATED_TOOL_CALLS,
+    REQUESTS_CANCELLED,
+]
+
+
+def render_metrics(components: dict[str, dict] | None = None) -> str:
+    """
+    Prometheus text exposition of this worker's metrics. Numeric entries
+    of each component's stats dict (e.g. cache counters) are exported as
+    rag_<component>_<key> gauges.
+    """
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    for component, stats in (components or {}).items():
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"rag_{component}_{key}"
+            lines += [f"# TYPE {name} gauge", f"{name} {_value_text(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+# --- Request traces ---
+
+
+@dataclass
+class Span:
+    name: str
+    start: float  # seconds since the trace started
+    duration: float
+    attrs: dict[str, Any] = field(default_factory=dict)
+
+
+class Trace:
+    """The spans of one request, collected in order of completion."""
+
+    def __init__(self, kind: str, **attrs: Any):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans: list[Span] = []
+
+    def add_span(self, name: str, started: float, duration: float, **attrs) -> None:
+        self.spans.append(Span(name, started - self.started, duration, attrs))
+
+    def tokens(self) -> dict[str, int]:
+        usage = {"prompt": 0, "completion": 0}
+        for span in self.spans:
+            usage["prompt"] += span.attrs.get("prompt_tokens", 0)
+            usage["completion"] += span.attrs.get("completion_tokens", 0)
+        return usage
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.id,
+            "kind": self.kind,
+            "timestamp": self.timestamp,
+            "duration": round(time.perf_counter() - self.started, 6),
+            **self.attrs,
+            "tokens": self.tokens(),
+            "spans": [
+                {
+                    "name": span.name,
+                    "start": round(span.start, 6),
+                    "duration": round(span.duration, 6),
+                    **span.attrs,
+                }
+                for span in self.spans
+            ],
+        }
+
+
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def record_span(name: str, started: float, duration: float, **attrs) -> None:
+    """Records a finished span on the current trace and in the stage metrics."""
+    STAGE_SECONDS.observe(duration, stage=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, duration, **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[dict]:
+    """
+    Times a block as a stage of the current request. The yielded dict can
+    be filled with attributes (counts, flags) to attach to the span.
+    """
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        record_span(name, started, time.perf_counter() - started, **attrs)
+
+
+@contextmanager
+def trace_request(kind: str, **attrs: Any) -> Iterator[Trace]:
+    """
+    Collects the spans of one request. On exit the request duration is
+    recorded (labelled with trace.attrs["route"] when set) and, with
+    TRACE_LOG_ENABLED, the whole trace is logged as one JSON line on the
+    "app.trace" logger. A request cancelled because its client went away
+    is counted and marked "cancelled".
+    """
+    trace = Trace(kind, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except (asyncio.CancelledError, GeneratorExit):
+        REQUESTS_CANCELLED.inc(kind=kind)
+        trace.attrs["cancelled"] = True
+        raise
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # Exited from another context, e.g. a streaming generator
+            # closed by a different task after the client disconnected
+            _current_trace.set(None)
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - trace.started,
+            kind=kind,
+            route=trace.attrs.get("route", ""),
+        )
+        if TRACE_LOG_ENABLED:
+            trace_logger.info(json.dumps(trace.to_dict(), default=str))
+
+
+def token_usage(response: LLMResult) -> tuple[int, int] | None:
+    """(prompt, completion) tokens as reported by the provider, if at all."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(
+                getattr(generation, "message", None), "usage_metadata", None
+            )
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return None
+
+
+class TracingCallbackHandler(AsyncCallbackHandler):
+    """
+    Turns LangChain callbacks into spans on the given trace: one "llm"
+    span per model call (with prompt/completion token counts), one "tool"
+    span per tool call and one "agent_step" span per ReAct step (from one
+    agent decision to the next, so it covers the previous observation and
+    the reasoning call).
+    """
+
+    def __init__(self, trace: Trace | None):
+        self.trace = trace
+        self._llm_runs: dict[UUID, tuple[float, int]] = {}
+        self._tool_runs: dict[UUID, tuple[float, str]] = {}
+        self._step_started = time.perf_counter()
+        self._steps = 0
+
+    def _record(self, name: str, started: float, **attrs) -> None:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=name)
+        if self.trace is not None:
+            self.trace.add_span(name, started, duration, **attrs)
+
+    async def on_llm_start(
+        self, serialized: dict, prompts: list[str], *, run_id: UUID, **kwargs
+    ) -> None:
+        self._llm_runs[run_id] = (
+            time.perf_counter(),
+            sum(count_tokens(prompt) for prompt in prompts),
+        )
+
+    async def on_chat_model_start(
+        self, serialized: dict, messages: list, *, run_id: UUID, **kwargs
+    ) -> None:
+        self._llm_runs[run_id] = (
+            time.perf_counter(),
+            sum(
+                count_tokens(str(message.content))
+                for batch in messages
+                for message in batch
+            ),
+        )
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        started, estimated_prompt = self._llm_runs.pop(run_id, (time.perf_counter(), 0))
+        usage = token_usage(response)
+        estimated = usage is None
+        if estimated:
+            completion = sum(
+                count_tokens(generation.text)
+                for generations in response.generations
+                for generation in generations
+            )
+            usage = (estimated_prompt, completion)
+        prompt_tokens, completion_tokens = usage
+        LLM_TOKENS.inc(prompt_tokens, type="prompt")
+        LLM_TOKENS.inc(completion_tokens, type="completion")
+        self._record(
+            "llm",
+            started,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            estimated=estimated,
+        )
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        started, _ = self._llm_runs.pop(run_id, (time.perf_counter(), 0))
+        self._record("llm", started, error=type(error).__name__)
+
+    async def on_tool_start(
+        self, serialized: dict, input_str: str, *, run_id: UUID, **kwargs
+    ) -> None:
+        self._tool_runs[run_id] = (time.perf_counter(), serialized.get("name", ""))
+
+    def _end_tool(self, run_id: UUID, status: str) -> None:
+        started, tool = self._tool_runs.pop(run_id, (time.perf_counter(), ""))
+        TOOL_SECONDS.observe(time.perf_counter() - started, tool=tool, status=status)
+        self._record("tool", started, tool=tool, status=status)
+
+    async def on_tool_end(self, output, *, run_id: UUID, **kwargs) -> None:
+        self._end_tool(run_id, "ok")
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._end_tool(run_id, "error")
+
+    def _end_step(self, final: bool) -> None:
+        self._steps += 1
+        AGENT_STEPS.inc()
+        self._record("agent_step", self._step_started, step=self._steps, final=final)
+        self._step_started = time.perf_counter()
+
+    async def on_agent_action(self, action, *, run_id: UUID, **kwargs) -> None:
+        self._end_step(final=False)
+
+    async def on_agent_finish(self, finish, *, run_id: UUID, **kwargs) -> None:
+        self._end_step(final=True)
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+from app.services.reports import document_id_from_sha256
+
+# Form fields other than the file (user_id) are tiny; anything larger is
+# not a legitimate upload form
+_MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """An upload refused while it was being received."""
+
+    def __init__(self, status_code: int, message: str, filename: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.filename = filename
+
+
+@dataclass
+class ReceivedUpload:
+    path: Path
+    filename: str
+    size: int
+    sha256: str
+    fields: dict[str, str]
+
+    @property
+    def document_id(self) -> str:
+        return document_id_from_sha256(self.sha256)
+
+
+class _PdfForm:
+    """
+    python-multipart callbacks for a form with one PDF file field. File
+    bytes are hashed and size-checked as they are parsed, then queued in
+    `pending` for the caller to write out; other fields are kept in memory.
+    """
+
+    def __init__(self, file_field: str, max_bytes: int):
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.fields: dict[str, str] = {}
+        self.filename: str | None = None
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.pending: list[bytes] = []
+        self.ended = False
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._name: str | None = None
+        self._in_file = False
+        self._value = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field_data,
+            "on_header_value": self._header_value_data,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+            "on_end": self._end,
+        }
+
+    def _part_begin(self) -> None:
+        self._headers = {}
+        self._name = None
+        self._in_file = False
+        self._value = bytearray()
+
+    def _header_field_data(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _header_value_data(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _header_end(self) -> None:
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+
+    def _headers_finished(self) -> None:
+        _, params = parse_options_header(self._headers.get(b"content-disposition"))
+        self._name = params.get(b"name", b"").decode("utf-8", "replace")
+        filename = params.get(b"filename")
+        if self._name != self.file_field or filename is None:
+            return
+        if self.filename is not None:
+            raise UploadRejected(400, "Upload one PDF at a time.", self.filename)
+        self.filename = filename.decode("utf-8", "replace")
+        # Refuse before reading any of the file
+        if not self.filename.endswith(".pdf"):
+            raise UploadRejected(
+                400, "Invalid file type. Only PDF allowed..", self.filename
+            )
+        self._in_file = True
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if not self._in_file:
+            self._value += data[start:end]
+            if len(self._value) > _MAX_FIELD_BYTES:
+                raise UploadRejected(400, f"Form field {self._name!r} is too large.")
+            return
+        block = bytes(data[start:end])
+        self.size += len(block)
+        if self.size > self.max_bytes:
+            raise UploadRejected(
+                413,
+                f"File too large. The limit is {self.max_bytes // (1024 * 1024)} MB.",
+                self.filename,
+            )
+        self.digest.update(block)
+        self.pending.append(block)
+
+    def _part_end(self) -> None:
+        if not self._in_file and self._name:
+            self.fields[self._name] = self._value.decode("utf-8", "replace")
+        self._in_file = False
+
+    def _end(self) -> None:
+        self.ended = True
+
+
+async def areceive_pdf_upload(
+    request: Request, path: Path, max_bytes: int, file_field: str = "file"
+) -> ReceivedUpload:
+    """
+    Streams a multipart/form-data upload straight to `path`.
+
+    The request body is parsed as it arrives: the file's SHA-256 and size
+    are computed on the way to disk, so the PDF is written once, never
+    held in memory whole, and an oversized upload is refused (413) as
+    soon as it crosses max_bytes, or up front from its Content-Length.
+    Raises UploadRejected; a partial file is removed.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected a multipart/form-data upload.")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes + _MAX_FIELD_BYTES:
+        raise UploadRejected(
+            413, f"File too large. The limit is {max_bytes // (1024 * 1024)} MB."
+        )
+
+    form = _PdfForm(file_field, max_bytes)
+    parser = MultipartParser(params[b"boundary"], form.callbacks())
+    try:
+        with path.open("wb") as out:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if form.pending:
+                    block = b"".join(form.pending)
+                    form.pending.clear()
+                    await asyncio.to_thread(out.write, block)
+            parser.finalize()
+        if form.filename is None:
+            raise UploadRejected(400, "No PDF file in the upload.")
+        if not form.ended:
+            raise UploadRejected(400, "The upload was cut off.", form.filename)
+    except MultipartParseError as e:
+        path.unlink(missing_ok=True)
+        raise UploadRejected(400, f"Malformed upload: {e}", form.filename or "")
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+    return ReceivedUpload(
+        path=path,
+        filename=form.filename,
+        size=form.size,
+        sha256=form.digest.hexdigest(),
+        fields=form.fields,
+    )
@@ -1,23 +1,128 @@
+import asyncio
+import logging
 import shutil
-import ocrmypdf
+from datetime import date
 from pathlib import Path
-from app.config import FAISS_INDEX_DIR, GOOGLE_API_KEY
+from typing import Awaitable, Callable
+from app.config import (
+    FAISS_INDEX_DIR,
+    GOOGLE_API_KEY,
+    EMBEDDING_MODEL,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_BYTES,
+    INDEX_CACHE_MAX_BYTES,
+    INDEX_CACHE_IDLE_SECONDS,
+    VECTOR_BACKEND,
+    SHARED_INDEX_DIR,
+    SHARED_INDEX_SHARDS,
+    RETRIEVAL_K,
+    RETRIEVAL_FETCH_K,
+    RETRIEVAL_LAMBDA_MULT,
+    RETRIEVAL_BM25_WEIGHT,
+    LAB_VALUES_DIR,
+    REPORT_SUMMARY_ENABLED,
+    REPORT_SUMMARIES_DIR,
+    PAGE_SUMMARY_MAX_CHARS,
+    REPORT_SUMMARY_MAX_CHARS,
+    SUMMARY_ROLLUP_MAX_CHARS,
+    GET_ALL_CHUNKS_MAX_CHARS,
+    CHUNKING_STRATEGY,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+)
+from app.services.index_cache import IndexCache, index_signature
+from app.services.answer_cache import answer_cache
+from app.services.registry import registry
+from app.services.ocr import aload_pdf_pages
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingStore
+from app.services.embedding_pipeline import aembed_chunks
+from app.services.chunking import get_chunker
+from app.services.mmap_store import (
+    LOCK_DIR,
+    MmapVectorStore,
+    delete_mmap_index,
+    index_write_lock,
+    update_mmap_index,
+    write_mmap_index,
+)
+from app.services.retrieval import HybridMMRRetriever
+from app.services.lab_values import LabValue, LabValueStore, extract_lab_values
+from app.services.report_summary import (
+    ReportSummaryStore,
+    arollup_reports,
+    asummarize_report,
+    format_summary,
+)
+from app.services.reports import (
+    ReportFilter,
+    extract_report_date,
+    report_document_id,
+)
+from app.services.shared_index import SharedIndexStore, SharedIndexRetriever
+from app.services.tracing import span
 
-from langchain_community.document_loaders import PDFPlumberLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
-from langchain_core.vectorstores import VectorStoreRetriever
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
 
 # --- Initialize Global Components ---
 
-# Use the 'models/' prefix for the v1.5 API
-embeddings = GoogleGenerativeAIEmbeddings(
-    model="models/gemini-embedding-001", google_api_key=GOOGLE_API_KEY
-)
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=150, chunk_overlap=20)
+def _build_embeddings() -> CachedEmbeddings:
+    # Imported lazily: the Google client library is slow to import
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    # Use the 'models/' prefix for the v1.5 API
+    # Wrapped in a persistent cache so identical chunks and repeated queries
+    # are only sent to the embedding API once.
+    return CachedEmbeddings(
+        GoogleGenerativeAIEmbeddings(
+            model=EMBEDDING_MODEL, google_api_key=GOOGLE_API_KEY
+        ),
+        model=EMBEDDING_MODEL,
+        store=EmbeddingStore(
+            EMBEDDING_CACHE_DIR / EMBEDDING_MODEL.replace("/", "_"),
+            max_bytes=EMBEDDING_CACHE_MAX_BYTES,
+        ),
+    )
+
+
+registry.register("embeddings", _build_embeddings)
+
+
+def get_embeddings() -> CachedEmbeddings:
+    return registry.get("embeddings")
+
+
+def uses_shared_index() -> bool:
+    return VECTOR_BACKEND == "shared"
+
+
+# Per-user deployments never open the shared index, so warm_up skips it
+if uses_shared_index():
+    registry.register(
+        "shared_index", lambda: SharedIndexStore(SHARED_INDEX_DIR, SHARED_INDEX_SHARDS)
+    )
+
+
+def get_shared_store() -> SharedIndexStore:
+    return registry.get("shared_index")
+
+
+# Written by FAISS.save_local before the mmap layout; converted on first load
+LEGACY_INDEX_FILES = ("index.faiss", "index.pkl")
+
+chunker = get_chunker(CHUNKING_STRATEGY, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS)
+
+lab_value_store = LabValueStore(LAB_VALUES_DIR)
+report_summary_store = ReportSummaryStore(REPORT_SUMMARIES_DIR)
+
+# Per-worker cache of loaded indexes, so a query does not unpickle from disk
+index_cache = IndexCache(
+    max_bytes=INDEX_CACHE_MAX_BYTES, idle_seconds=INDEX_CACHE_IDLE_SECONDS
+)
 
 # --- Helper Function ---
 
@@ -31,110 +136,609 @@ def get_parent_faiss_path() -> Path:
     return FAISS_INDEX_DIR
 
 
+def get_index_version(user_id: str) -> tuple | None:
+    """
+    Identifies the current on-disk version of a user's index (file mtimes
+    and sizes, or the shared index's per-user version), or None if the
+    user has no index.
+    """
+    if uses_shared_index():
+        return get_shared_store().user_version(user_id)
+    return index_signature(get_faiss_path(user_id))
+
+
 # --- Core Service Functions ---
 
 
 def create_vector_store(user_id: str, pdf_path: Path) -> bool:
-    """Processes a PDF and creates a new FAISS vector store for the user."""
+    """
+    Processes a PDF and adds it to the user's vector store.
+    Synchronous wrapper around acreate_vector_store for non-async callers.
+    """
+    return asyncio.run(acreate_vector_store(user_id, pdf_path))
 
-    # Ensure the parent directory exists right before we use it.
-    FAISS_INDEX_DIR.mkdir(exist_ok=True)
-    # ---
 
-    index_path = get_faiss_path(user_id)
+async def acreate_vector_store(
+    user_id: str,
+    pdf_path: Path,
+    on_stage: Callable[[str], Awaitable[None]] | None = None,
+    delete_input: bool = True,
+    filename: str | None = None,
+    document_id: str | None = None,
+) -> bool:
+    """
+    Processes a PDF and adds it as one report to the user's vector store
+    without blocking the event loop: scanned pages are OCR'd in the process
+    pool, text extraction and disk IO run in threads, and each stage is
+    concurrency-limited.
+
+    Earlier reports stay in the index with their vectors as they are; only
+    the new report is OCR'd and embedded. Its chunks carry the report's
+    document_id (a content hash, so re-uploading the same PDF replaces it),
+    report_date (from the report text, else today) and filename. Pass
+    document_id when the upload was already hashed on the way in.
+
+    on_stage is awaited with "ocr", "chunking", "embedding", "indexing" and
+    "summarizing" as the pipeline progresses. With delete_input=False the uploaded PDF is
+    left in place so an interrupted job can be retried.
+    """
 
-    # Clear any old index for this user
-    if index_path.exists():
-        shutil.rmtree(index_path)
+    async def report(stage: str) -> None:
+        if on_stage is not None:
+            await on_stage(stage)
 
-    ocr_pdf_path = pdf_path.with_suffix(".ocr.pdf")
+    # Ensure the parent directory exists right before we use it.
+    FAISS_INDEX_DIR.mkdir(exist_ok=True)
+    # ---
 
     try:
-        # 1. OCR the PDF to make it searchable (from your notebook)
-        print(f"Starting OCR for {pdf_path.name}...")
-        ocrmypdf.ocr(
-            pdf_path, ocr_pdf_path, language="eng", force_ocr=True, progress_bar=False
+        # 1. Extract text page by page, OCR'ing only scanned pages
+        await report("ocr")
+        with span("ocr") as attrs:
+            if document_id is None:
+                document_id = await asyncio.to_thread(report_document_id, pdf_path)
+            docs = await aload_pdf_pages(pdf_path)
+            attrs["pages"] = len(docs)
+        report_info = {
+            "document_id": document_id,
+            "report_date": extract_report_date(docs) or date.today().isoformat(),
+            "filename": filename or pdf_path.name,
+        }
+
+        # 2. Split documents into chunks (layout chunking re-reads the PDF)
+        await report("chunking")
+        with span("chunking") as attrs:
+            chunks = await asyncio.to_thread(chunker.split, pdf_path, docs)
+            for number, chunk in enumerate(chunks):
+                chunk.metadata.update(report_info, chunk_id=f"{document_id}:{number}")
+            attrs["chunks"] = len(chunks)
+
+        # 3. Embed the chunks in concurrent batches, parsing lab tables
+        #    from the same pages meanwhile
+        await report("embedding")
+        lab_task = asyncio.create_task(_aextract_lab_values(pdf_path, docs))
+        with span("embedding"):
+            try:
+                chunks, vectors = await _aembed_all(chunks)
+            except BaseException:
+                lab_task.cancel()
+                raise
+            lab_values = await lab_task
+        for value in lab_values:
+            value.document_id = document_id
+            value.report_date = report_info["report_date"]
+
+        # 4. Add the report to the index, replacing an earlier upload of it
+        await report("indexing")
+        texts = [chunk.page_content for chunk in chunks]
+        metadatas = [chunk.metadata for chunk in chunks]
+        with span("indexing") as attrs:
+            attrs["total_chunks"] = await asyncio.to_thread(
+                _store_report,
+                user_id,
+                document_id,
+                texts,
+                metadatas,
+                vectors,
+                lab_values,
+            )
+        index_cache.invalidate(user_id)
+        answer_cache.invalidate(user_id)
+        logger.info(
+            "Report %s added to the index of %s (%d chunks)",
+            document_id,
+            user_id,
+            len(chunks),
         )
-        print("OCR complete.")
 
-        # 2. Load the OCR'd PDF
-        loader = PDFPlumberLoader(str(ocr_pdf_path))
-        docs = loader.load()
-
-        # 3. Split documents into chunks
-        chunks = text_splitter.split_documents(docs)
-
-        # 4. Create FAISS index from chunks
-        print(f"Creating FAISS index for {user_id}...")
-        vectorstore = FAISS.from_documents(embedding=embeddings, documents=chunks)
-
-        # 5. Save the index locally
-        vectorstore.save_local(str(index_path))
-        print(f"FAISS index saved to {index_path}")
+        # 5. Summarize the report for whole-report questions; the index is
+        #    already queryable while this runs
+        if REPORT_SUMMARY_ENABLED:
+            await report("summarizing")
+            with span("summarizing"):
+                await _asummarize(user_id, report_info, docs)
+            answer_cache.invalidate(user_id)
 
         return True
 
     except Exception as e:
-        print(f"Error creating vector store for {user_id}: {e}")
-        # Clean up failed artifacts
-        if index_path.exists():
-            shutil.rmtree(index_path)
+        # The index is only ever swapped in whole, so a failure leaves the
+        # user's earlier reports untouched
+        logger.error("Error adding report for %s: %s", user_id, e)
         return False
 
     finally:
-        # 6. Clean up temporary files
-        if pdf_path.exists():
+        # 6. Clean up the uploaded file
+        if delete_input and pdf_path.exists():
             pdf_path.unlink()
-        if ocr_pdf_path.exists():
-            ocr_pdf_path.unlink()
+
+
+async def _aextract_lab_values(pdf_path: Path, pages: list[Document]) -> list[LabValue]:
+    """Parses lab rows from the report; a parsing failure never fails ingestion."""
+    try:
+        values = await asyncio.to_thread(extract_lab_values, pdf_path, pages)
+        logger.info("Extracted %d lab values from %s", len(values), pdf_path.name)
+        return values
+    except Exception as e:
+        logger.error("Error extracting lab values from %s: %s", pdf_path.name, e)
+        return []
+
+
+async def _asummarize(user_id: str, report_info: dict, pages: list[Document]) -> None:
+    """
+    Builds and stores the hierarchical summary of one report, reusing page
+    summaries of the user's earlier uploads where pages are unchanged, then
+    rebuilds the roll-up across all of the user's reports. A failure only
+    leaves the user without a summary (getAllChunks then pages raw
+    chunks).
+    """
+    document_id = report_info["document_id"]
+    try:
+        stored = await asyncio.to_thread(report_summary_store.load, user_id)
+        previous = {
+            "pages": [
+                page
+                for summary in (stored or {"reports": {}})["reports"].values()
+                for page in summary["pages"]
+            ]
+        }
+        summary = await asummarize_report(
+            registry.get("llm"),
+            pages,
+            previous,
+            page_max_chars=PAGE_SUMMARY_MAX_CHARS,
+            report_max_chars=REPORT_SUMMARY_MAX_CHARS,
+            rollup_max_chars=SUMMARY_ROLLUP_MAX_CHARS,
+        )
+        summary.update(report_info)
+
+        def store() -> None:
+            with index_write_lock(get_faiss_path(user_id)):
+                report_summary_store.replace_report(user_id, document_id, summary)
+
+        await asyncio.to_thread(store)
+        logger.info(
+            "Report summary saved for %s (%d/%d page summaries reused)",
+            user_id,
+            summary["reused_pages"],
+            len(pages),
+        )
+        await _arebuild_rollup(user_id)
+    except Exception as e:
+        logger.error("Error summarizing report for %s: %s", user_id, e)
+
+
+async def _arebuild_rollup(user_id: str) -> None:
+    """
+    Rebuilds the summary across all of a user's report summaries. It is
+    not saved if a report was added or removed meanwhile; that change
+    rebuilds it again.
+    """
+    stored = await asyncio.to_thread(report_summary_store.load, user_id)
+    if stored is None:
+        return
+    reports = sorted(
+        stored["reports"].items(), key=lambda item: item[1].get("report_date") or ""
+    )
+    rollup = await arollup_reports(
+        registry.get("llm"),
+        [summary for _, summary in reports],
+        report_max_chars=REPORT_SUMMARY_MAX_CHARS,
+        rollup_max_chars=SUMMARY_ROLLUP_MAX_CHARS,
+    )
+
+    def store() -> bool:
+        with index_write_lock(get_faiss_path(user_id)):
+            return report_summary_store.save_rollup(
+                user_id, rollup, [document_id for document_id, _ in reports]
+            )
+
+    if await asyncio.to_thread(store):
+        answer_cache.invalidate(user_id)
+
+
+async def _aembed_all(
+    chunks: list[Document],
+) -> tuple[list[Document], list[list[float]]]:
+    """Embeds all chunks, returning them with their vectors in matching order."""
+    if not chunks:
+        raise ValueError("No text chunks to index.")
+    docs: list[Document] = []
+    vectors: list[list[float]] = []
+    async for batch, batch_vectors in aembed_chunks(chunks, get_embeddings()):
+        docs += batch
+        vectors += batch_vectors
+    return docs, vectors
 
 
 def delete_vector_store(user_id: str) -> bool:
-    """Deletes a user's FAISS index folder."""
+    """
+    Deletes a user's FAISS index folder (or tombstones their shared chunks)
+    under the user's write lock. Queries already reading the index finish
+    on the files they mapped.
+    """
     index_path = get_faiss_path(user_id)
+    with index_write_lock(index_path):
+        lab_value_store.delete(user_id)
+        report_summary_store.delete(user_id)
+        index_cache.invalidate(user_id)
+        answer_cache.invalidate(user_id)
+
+        if uses_shared_index():
+            deleted = get_shared_store().delete_user(user_id)
+            logger.info("Deleted shared index chunks for %s: %s", user_id, deleted)
+            return deleted
 
-    if index_path.exists():
         try:
-            shutil.rmtree(index_path)
-            print(f"Deleted index for {user_id}")
-            return True
+            deleted = delete_mmap_index(index_path)
         except Exception as e:
-            print(f"Error deleting index for {user_id}: {e}")
+            logger.error("Error deleting index for %s: %s", user_id, e)
             return False
 
-    print(f"Index not found for {user_id}, nothing to delete.")
-    return False  # False because it didn't exist to be deleted
+    if deleted:
+        logger.info("Deleted index for %s", user_id)
+    else:
+        logger.info("Index not found for %s, nothing to delete.", user_id)
+    return deleted  # False if it didn't exist to be deleted
+
+
+def delete_all_vector_stores() -> None:
+    """
+    Deletes every user's index, each under its own write lock so no
+    in-flight upload writes into a deleted index, then the remaining
+    per-user data (lab values, summaries). The shared index is cleared
+    through its store, under its shard locks. The lock files are kept: a
+    writer may be waiting on one.
+    """
+    prefix = get_faiss_path("").name
+    for entry in FAISS_INDEX_DIR.glob(f"{prefix}*"):
+        if entry.is_dir():
+            delete_vector_store(entry.name[len(prefix) :])
+    if SHARED_INDEX_DIR.exists():
+        store = (
+            get_shared_store()
+            if uses_shared_index()
+            else SharedIndexStore(SHARED_INDEX_DIR, SHARED_INDEX_SHARDS)
+        )
+        store.clear()
+    for entry in FAISS_INDEX_DIR.iterdir():
+        if entry.name == LOCK_DIR or entry == SHARED_INDEX_DIR:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+    index_cache.clear()
+    answer_cache.clear()
+
+
+def _store_report(
+    user_id: str,
+    document_id: str,
+    texts: list[str],
+    metadatas: list[dict],
+    vectors: list[list[float]],
+    lab_values: list[LabValue],
+) -> int:
+    """
+    Writes one report's chunks and lab values, replacing an earlier upload
+    of it, all under the user's write lock. Returns the user's chunk count
+    (per-user indexes only).
+    """
+    with index_write_lock(get_faiss_path(user_id)):
+        total = len(texts)
+        if uses_shared_index():
+            get_shared_store().add_chunks(
+                user_id, texts, metadatas, vectors, replace_document=document_id
+            )
+        else:
+            total = _update_index(
+                get_faiss_path(user_id),
+                texts,
+                metadatas,
+                vectors,
+                lambda metadata: metadata.get("document_id") == document_id,
+            )
+        lab_value_store.replace_report(user_id, document_id, lab_values)
+    return total
+
+
+def _update_index(
+    index_path: Path,
+    texts: list[str],
+    metadatas: list[dict],
+    vectors: list[list[float]],
+    drop: Callable[[dict], bool],
+) -> int:
+    """Applies one change to a per-user index (see update_mmap_index)."""
+    with index_write_lock(index_path):
+        _convert_legacy_index_once(index_path)
+        return update_mmap_index(index_path, texts, metadatas, vectors, drop)
+
+
+def remove_report(user_id: str, document_id: str) -> bool:
+    """
+    Removes one report from a user's index.
+    Synchronous wrapper around aremove_report for non-async callers.
+    """
+    return asyncio.run(aremove_report(user_id, document_id))
+
+
+async def aremove_report(user_id: str, document_id: str) -> bool:
+    """
+    Removes one report's chunks, lab values and summary from a user's
+    index without re-embedding the others, then rebuilds the summary
+    across the remaining reports. Returns False if the user has no such
+    report.
+    """
+    if not await asyncio.to_thread(_remove_report, user_id, document_id):
+        return False
+    if REPORT_SUMMARY_ENABLED:
+        try:
+            await _arebuild_rollup(user_id)
+        except Exception as e:
+            logger.error("Error summarizing reports for %s: %s", user_id, e)
+    return True
+
+
+def _remove_report(user_id: str, document_id: str) -> bool:
+    """Removes one report under the user's write lock."""
+    with index_write_lock(get_faiss_path(user_id)):
+        reports = list_reports(user_id) or []
+        if not any(r["document_id"] == document_id for r in reports):
+            return False
+
+        if uses_shared_index():
+            get_shared_store().delete_document(user_id, document_id)
+        else:
+            _update_index(
+                get_faiss_path(user_id),
+                [],
+                [],
+                None,
+                lambda metadata: metadata.get("document_id") == document_id,
+            )
+        lab_value_store.remove_report(user_id, document_id)
+        report_summary_store.remove_report(user_id, document_id)
+    index_cache.invalidate(user_id)
+    answer_cache.invalidate(user_id)
+    logger.info("Removed report %s from the index of %s", document_id, user_id)
+    return True
+
+
+def has_report(user_id: str, document_id: str) -> bool:
+    """True if the user's index already holds the report with this id."""
+    if uses_shared_index():
+        return get_shared_store().has_document(user_id, document_id)
+    vectorstore = load_vector_store(user_id)
+    if vectorstore is None:
+        return False
+    document_ids, _ = vectorstore.report_columns()
+    return bool((document_ids == document_id).any())
 
 
-def load_vector_store(user_id: str) -> FAISS | None:
-    """Loads an existing FAISS vector store for a user."""
+def list_reports(user_id: str) -> list[dict] | None:
+    """
+    The reports in a user's index, oldest report date first:
+    {"document_id", "report_date", "filename", "chunks"} each. Chunks
+    indexed before reports were tracked are listed with document_id None.
+    None if the user has no index.
+    """
+    if uses_shared_index():
+        store = get_shared_store()
+        if not store.has_user(user_id):
+            return None
+        metadatas = store.get_metadatas(user_id)
+    else:
+        vectorstore = load_vector_store(user_id)
+        if vectorstore is None:
+            return None
+        metadatas = vectorstore.iter_metadatas()
+
+    reports: dict[str | None, dict] = {}
+    for metadata in metadatas:
+        document_id = metadata.get("document_id")
+        if document_id not in reports:
+            reports[document_id] = {
+                "document_id": document_id,
+                "report_date": metadata.get("report_date"),
+                "filename": metadata.get("filename"),
+                "chunks": 0,
+            }
+        reports[document_id]["chunks"] += 1
+    return sorted(reports.values(), key=lambda r: r["report_date"] or "")
+
+
+def _has_legacy_index(index_path: Path) -> bool:
+    return index_signature(index_path) is None and all(
+        (index_path / name).exists() for name in LEGACY_INDEX_FILES
+    )
+
+
+def _convert_legacy_index_once(index_path: Path) -> None:
+    """
+    Converts a legacy index under the user's write lock. The check is
+    repeated inside the lock: an upload (or another reader) may have
+    written an mmap version meanwhile, which a late conversion of the
+    old files would replace.
+    """
+    if not _has_legacy_index(index_path):
+        return
+    with index_write_lock(index_path):
+        if _has_legacy_index(index_path):
+            _convert_legacy_index(index_path)
+
+
+def _convert_legacy_index(index_path: Path) -> None:
+    """Rewrites a FAISS.save_local index in the mmap layout."""
+    logger.info("Converting legacy FAISS index at %s", index_path)
+    legacy = FAISS.load_local(
+        str(index_path), get_embeddings(), allow_dangerous_deserialization=True
+    )
+    count = legacy.index.ntotal
+    docs = [
+        legacy.docstore.search(legacy.index_to_docstore_id[i]) for i in range(count)
+    ]
+    write_mmap_index(
+        index_path,
+        [doc.page_content for doc in docs],
+        [doc.metadata for doc in docs],
+        legacy.index.reconstruct_n(0, count),
+    )
+
+
+def _load_from_disk(user_id: str, index_path: Path) -> MmapVectorStore | None:
+    try:
+        return MmapVectorStore(index_path, get_embeddings())
+    except Exception as e:
+        logger.error("Error loading index for %s: %s", user_id, e)
+        return None
+
+
+def load_vector_store(user_id: str) -> MmapVectorStore | None:
+    """
+    Loads an existing vector store for a user.
+    Served from the in-memory index cache unless the files on disk changed;
+    a miss only memory-maps the index files.
+    """
     index_path = get_faiss_path(user_id)
-    print(f"Index path is {index_path}")
 
     if not index_path.exists():
-        print(f"No index found for user {user_id}")
+        logger.debug("No index found for user %s", user_id)
+        index_cache.invalidate(user_id)
         return None
 
-    try:
-        return FAISS.load_local(
-            str(index_path), embeddings, allow_dangerous_deserialization=True
-        )
-    except Exception as e:
-        print(f"Error loading FAISS index for {user_id}: {e}")
+    if _has_legacy_index(index_path):
+        try:
+            _convert_legacy_index_once(index_path)
+        except Exception as e:
+            logger.error("Error converting FAISS index for %s: %s", user_id, e)
+            return None
+
+    return index_cache.get(
+        user_id, index_path, lambda: _load_from_disk(user_id, index_path)
+    )
+
+
+def get_user_chunks(user_id: str) -> list[str] | None:
+    """Returns the text of every chunk in a user's index, or None if none."""
+    if uses_shared_index():
+        store = get_shared_store()
+        return store.get_texts(user_id) if store.has_user(user_id) else None
+
+    vectorstore = load_vector_store(user_id)
+    if vectorstore is None:
         return None
+    return list(vectorstore.iter_texts())
 
 
-def get_retriever(user_id: str) -> VectorStoreRetriever | None:
+def get_user_chunks_page(
+    user_id: str, page: int, page_size: int
+) -> tuple[list[str], int] | None:
     """
-    Loads the FAISS index for a user and returns it as a retriever.
+    One page (1-based) of a user's raw chunks, with the total page count;
+    None if the user has no index.
+    """
+    start = (page - 1) * page_size
+    if uses_shared_index():
+        chunks = get_user_chunks(user_id)
+        if chunks is None:
+            return None
+        total = len(chunks)
+        selected = chunks[start : start + page_size]
+    else:
+        vectorstore = load_vector_store(user_id)
+        if vectorstore is None:
+            return None
+        total = len(vectorstore)
+        selected = [
+            vectorstore.get_text(i) for i in range(start, min(start + page_size, total))
+        ]
+    return selected, max(1, -(-total // page_size))
+
+
+def get_report_summary(user_id: str) -> list[str] | None:
+    """
+    The bounded whole-report view (summary across reports, out-of-range
+    values, page summaries), or None unless the summary covers every
+    report in the user's index.
+    """
+    stored = report_summary_store.load(user_id)
+    if stored is None:
+        return None
+    reports = list_reports(user_id) or []
+    covered = {report["document_id"] for report in reports}
+    if not reports or covered != set(stored["rollup_of"]):
+        return None
+    summaries = [stored["reports"][report["document_id"]] for report in reports]
+    return format_summary(
+        stored["rollup"],
+        summaries,
+        lab_value_store.load(user_id),
+        GET_ALL_CHUNKS_MAX_CHARS,
+    )
+
+
+def get_retriever(
+    user_id: str, report_filter: ReportFilter | None = None
+) -> BaseRetriever | None:
+    """
+    Loads the FAISS index for a user and returns it as a retriever,
+    restricted to some of their reports when a report_filter is given.
     This is based on Cell 31 of your notebook.
     """
-    print(f"🔍 Loading FAISS index and creating retriever for user: {user_id} ...")
+    if uses_shared_index():
+        store = get_shared_store()
+        if not store.has_user(user_id):
+            return None
+        return SharedIndexRetriever(
+            store=store,
+            user_id=user_id,
+            embeddings=get_embeddings(),
+            k=RETRIEVAL_K,
+            fetch_k=RETRIEVAL_FETCH_K,
+            lambda_mult=RETRIEVAL_LAMBDA_MULT,
+            report_filter=report_filter,
+        )
+
     vectorstore = load_vector_store(user_id)
 
     if vectorstore:
-        # You can customize search_type and search_kwargs here if needed
-        # e.g., return vectorstore.as_retriever(search_type="mmr", search_kwargs={"k": 5})
-        return vectorstore.as_retriever(search_type="mmr", search_kwargs={"k": 5})
+        # Vectorized MMR (optionally BM25-hybrid) over the mapped vectors
+        return HybridMMRRetriever(
+            vectorstore=vectorstore,
+            k=RETRIEVAL_K,
+            fetch_k=RETRIEVAL_FETCH_K,
+            lambda_mult=RETRIEVAL_LAMBDA_MULT,
+            bm25_weight=RETRIEVAL_BM25_WEIGHT,
+            report_filter=report_filter,
+        )
     else:
         return None
+
+
+async def aget_retriever(
+    user_id: str, report_filter: ReportFilter | None = None
+) -> BaseRetriever | None:
+    """Async variant of get_retriever; a cold index load runs in a thread."""
+    return await asyncio.to_thread(get_retriever, user_id, report_filter)
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import weakref
+from contextlib import closing
+from pathlib import Path
+from typing import Protocol
+
+from app.config import (
+    WEB_SEARCH_BACKEND,
+    WEB_SEARCH_POOL_SIZE,
+    WEB_SEARCH_TIMEOUT_SECONDS,
+    WEB_SEARCH_MAX_RESULTS,
+    WEB_SEARCH_CACHE_PATH,
+    WEB_SEARCH_CACHE_TTL_SECONDS,
+    WEB_SEARCH_CACHE_MAX_ENTRIES,
+)
+from app.services.concurrency import stage_limit
+from app.services.registry import registry
+
+# A search result as returned by backends: {"title", "href", "body"}
+SearchResult = dict[str, str]
+
+
+def normalize_query(query: str) -> str:
+    """'  Normal range for TSH? ' and 'normal range for tsh' share a cache key."""
+    text = unicodedata.normalize("NFKC", query).lower()
+    return " ".join(re.findall(r"\w+(?:[.+/-]\w+)*", text))
+
+
+class SearchBackend(Protocol):
+    async def asearch(self, query: str, max_results: int) -> list[SearchResult]: ...
+
+
+class DuckDuckGoBackend:
+    """
+    DuckDuckGo text search with a small pool of reused DDGS clients (each
+    keeps its HTTP connections open), run in threads so the event loop is
+    never blocked.
+    """
+
+    def __init__(self, pool_size: int, timeout: float):
+        # Imported lazily so tests with a stub backend need no network stack
+        from ddgs import DDGS
+
+        self._clients: "queue.Queue" = queue.Queue()
+        for _ in range(pool_size):
+            self._clients.put(DDGS(timeout=max(1, int(timeout))))
+
+    def _search(self, query: str, max_results: int) -> list[SearchResult]:
+        client = self._clients.get()
+        try:
+            return client.text(query, max_results=max_results) or []
+        finally:
+            self._clients.put(client)
+
+    async def asearch(self, query: str, max_results: int) -> list[SearchResult]:
+        return await asyncio.to_thread(self._search, query, max_results)
+
+
+def dedupe_results(results: list[SearchResult]) -> list[SearchResult]:
+    """Drops results repeating an earlier link or snippet."""
+    seen_links, seen_bodies, unique = set(), set(), []
+    for result in results:
+        link = (result.get("href") or "").rstrip("/").lower()
+        body = normalize_query(result.get("body") or "")
+        if (link and link in seen_links) or (body and body in seen_bodies):
+            continue
+        seen_links.add(link)
+        seen_bodies.add(body)
+        unique.append(result)
+    return unique
+
+
+def format_results(results: list[SearchResult]) -> str:
+    if not results:
+        return "No good search results found."
+    return "\n".join(
+        f"- {result.get('title', '').strip()}: {result.get('body', '').strip()}"
+        for result in results
+    )
+
+
+class SearchCache:
+    """
+    Persistent TTL cache of deduplicated search results in SQLite, keyed by
+    normalized query and shared by every worker. At most max_entries are
+    kept; the oldest are dropped first.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "query TEXT PRIMARY KEY, results TEXT NOT NULL, "
+                    "created REAL NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS results_created ON results (created)"
+                )
+                self._initialized = True
+        return conn
+
+    def get(self, query: str) -> list[SearchResult] | None:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT results FROM results WHERE query = ? AND created > ?",
+                (query, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, query: str, results: list[SearchResult]) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (query, results, created) "
+                "VALUES (?, ?, ?)",
+                (query, json.dumps(results), time.time()),
+            )
+            conn.execute(
+                "DELETE FROM results WHERE created <= ? OR query IN ("
+                "SELECT query FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (time.time() - self.ttl_seconds, self.max_entries),
+            )
+
+    def clear(self) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM results")
+
+
+class WebSearch:
+    """
+    The agent's web search: cached, coalesced and time-bounded.
+
+    A query is normalized, then served from the persistent cache when a
+    fresh entry exists. Otherwise identical searches already in flight on
+    this worker are awaited instead of repeated, and the backend call is
+    abandoned after timeout seconds so a slow search cannot stall the
+    agent (timeouts and errors are not cached).
+    """
+
+    def __init__(
+        self,
+        backend: SearchBackend,
+        cache: SearchCache | None,
+        timeout: float,
+        max_results: int,
+    ):
+        self.backend = backend
+        self.cache = cache
+        self.timeout = timeout
+        self.max_results = max_results
+        # In-flight searches by normalized query, per event loop
+        self._inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.backend_calls = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def _afetch(self, key: str) -> list[SearchResult]:
+        self.backend_calls += 1
+        async with stage_limit("search"):
+            results = await asyncio.wait_for(
+                self.backend.asearch(key, self.max_results), self.timeout
+            )
+        results = dedupe_results(results)
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, key, results)
+        return results
+
+    async def asearch(self, query: str) -> str:
+        self.requests += 1
+        key = normalize_query(query)
+        if not key:
+            return "No search query given."
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                self.cache_hits += 1
+                return format_results(cached)
+
+        inflight = self._inflight.setdefault(asyncio.get_running_loop(), {})
+        task = inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._afetch(key))
+            inflight[key] = task
+            task.add_done_callback(lambda _: inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        try:
+            # Shielded so one caller giving up does not cancel the others
+            return format_results(await asyncio.shield(task))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return f"Web search timed out after {self.timeout:g}s; answer without it."
+        except Exception as e:
+            self.errors += 1
+            return f"Web search failed ({e}); answer without it."
+
+    def search(self, query: str) -> str:
+        """Synchronous wrapper for callers outside an event loop."""
+        return asyncio.run(self.asearch(query))
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "backend_calls": self.backend_calls,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+
+def _build_web_search() -> WebSearch:
+    if WEB_SEARCH_BACKEND == "stub":
+        from app.services.fake_backends import FakeSearchBackend
+
+        backend = FakeSearchBackend()
+    else:
+        backend = DuckDuckGoBackend(WEB_SEARCH_POOL_SIZE, WEB_SEARCH_TIMEOUT_SECONDS)
+    return WebSearch(
+        backend,
+        SearchCache(
+            WEB_SEARCH_CACHE_PATH,
+            WEB_SEARCH_CACHE_TTL_SECONDS,
+            WEB_SEARCH_CACHE_MAX_ENTRIES,
+        ),
+        WEB_SEARCH_TIMEOUT_SECONDS,
+        WEB_SEARCH_MAX_RESULTS,
+    )
+
+
+registry.register("web_search", _build_web_search)
+
+
+def get_web_search() -> WebSearch:
+    return registry.get("web_search")
@@ -0,0 +1,137 @@
+"""
+Offline evaluation of the chunking strategies in app.services.chunking.
+
+For each sample report and strategy it reports the chunk count, mean
+chunk size in tokens, index size on disk (mmap layout), embedding time
+through the batched pipeline, and retrieval hit rate. Questions are
+generated from the report's own structured lab values ("What is my
+<analyte>?"); a hit means one of the top-k chunks contains the analyte
+together with its value and reference range, i.e. everything needed to
+answer without another lookup.
+
+Embeddings come from FakeEmbeddings in bag-of-words mode, so no API key
+is needed and similarity still follows shared words.
+
+    python -m benchmarks.chunking report1.pdf report2.pdf --k 3 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+from app.services.chunking import CHUNKERS, count_tokens, get_chunker
+from app.services.embedding_pipeline import aembed_chunks
+from app.services.fake_backends import FakeEmbeddings
+from app.services.lab_values import LabValue, extract_lab_values
+from app.services.mmap_store import MmapVectorStore, write_mmap_index
+from app.services.ocr import aload_pdf_pages
+from app.services.retrieval import HybridMMRRetriever
+
+
+def is_hit(value: LabValue, texts: list[str]) -> bool:
+    needles = [value.analyte, value.value_text] + (
+        [value.reference] if value.reference else []
+    )
+    squashed = [" ".join(text.split()) for text in texts]
+    return any(all(needle in text for needle in needles) for text in squashed)
+
+
+async def evaluate(pdf_path: Path, strategy: str, args: argparse.Namespace) -> dict:
+    pages = await aload_pdf_pages(pdf_path)
+    values = extract_lab_values(pdf_path, pages)
+    chunker = get_chunker(strategy, args.max_tokens, args.overlap_tokens)
+    chunks = chunker.split(pdf_path, pages)
+
+    embeddings = FakeEmbeddings(
+        dim=args.dim,
+        latency=args.latency,
+        per_text_latency=args.per_text_latency,
+        bag_of_words=True,
+    )
+    started = time.perf_counter()
+    ordered, vectors = [], []
+    async for batch, batch_vectors in aembed_chunks(chunks, embeddings):
+        ordered += batch
+        vectors += batch_vectors
+    embed_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "index"
+        write_mmap_index(
+            path,
+            [chunk.page_content for chunk in ordered],
+            [chunk.metadata for chunk in ordered],
+            vectors,
+        )
+        index_bytes = sum(f.stat().st_size for f in path.iterdir())
+        retriever = HybridMMRRetriever(
+            vectorstore=MmapVectorStore(path, embeddings),
+            k=args.k,
+            fetch_k=args.fetch_k,
+            bm25_weight=args.bm25_weight,
+        )
+        hits = [
+            is_hit(
+                value,
+                [
+                    doc.page_content
+                    for doc in retriever.invoke(f"What is my {value.analyte}?")
+                ],
+            )
+            for value in values
+        ]
+
+    return {
+        "chunks": len(chunks),
+        "tokens": (
+            statistics.mean(count_tokens(c.page_content) for c in chunks)
+            if chunks
+            else 0
+        ),
+        "index_bytes": index_bytes,
+        "embed_seconds": embed_seconds,
+        "questions": len(hits),
+        "hit_rate": sum(hits) / len(hits) if hits else float("nan"),
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    print(
+        f"{'report':>24} {'strategy':>10} {'chunks':>7} {'tokens':>7} "
+        f"{'index KB':>9} {'embed s':>8} {'questions':>9} {'hit rate':>9}"
+    )
+    for pdf in args.pdfs:
+        for strategy in args.strategies:
+            result = await evaluate(Path(pdf), strategy, args)
+            print(
+                f"{Path(pdf).name[-24:]:>24} {strategy:>10} {result['chunks']:>7} "
+                f"{result['tokens']:>7.1f} {result['index_bytes'] / 1024:>9.1f} "
+                f"{result['embed_seconds']:>8.2f} {result['questions']:>9} "
+                f"{result['hit_rate']:>9.0%}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--strategies", nargs="+", default=list(CHUNKERS))
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--overlap-tokens", type=int, default=20)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--bm25-weight", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--per-text-latency", type=float, default=0.001)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
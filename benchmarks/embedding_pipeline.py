@@ -0,0 +1,95 @@
+"""
+Offline throughput benchmark for the embedding stage.
+
+Compares a single FAISS.afrom_documents call against the ingestion path
+(batched, concurrent embedding via vector_store._aembed_all, then
+write_mmap_index), using the local FakeEmbeddings backend (no network,
+no API key needed).
+
+    python -m benchmarks.embedding_pipeline --chunks 2000 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from app.services import embedding_pipeline, vector_store
+from app.services.fake_backends import FakeEmbeddings
+from app.services.mmap_store import MmapVectorStore, write_mmap_index
+from app.services.registry import registry
+
+
+def make_chunks(count: int, size: int) -> list[Document]:
+    return [
+        Document(
+            page_content=f"Chunk {i}: "
+            + "Hemoglobin 13.5 g/dL 13.0-17.0 " * (size // 32),
+            metadata={"page": i // 20},
+        )
+        for i in range(count)
+    ]
+
+
+async def run(args: argparse.Namespace) -> None:
+    chunks = make_chunks(args.chunks, args.chunk_size)
+
+    baseline = FakeEmbeddings(
+        dim=args.dim, latency=args.latency, per_text_latency=args.per_text_latency
+    )
+    started = time.perf_counter()
+    await FAISS.afrom_documents(chunks, baseline)
+    baseline_seconds = time.perf_counter() - started
+
+    pipelined = FakeEmbeddings(
+        dim=args.dim,
+        latency=args.latency,
+        per_text_latency=args.per_text_latency,
+        rate_limit_probability=args.rate_limit_probability,
+    )
+    registry.override("embeddings", pipelined)
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        docs, vectors = await vector_store._aembed_all(chunks)
+        await asyncio.to_thread(
+            write_mmap_index,
+            Path(tmp),
+            [doc.page_content for doc in docs],
+            [doc.metadata for doc in docs],
+            vectors,
+        )
+        pipeline_seconds = time.perf_counter() - started
+        indexed = len(MmapVectorStore(Path(tmp), pipelined))
+
+    print(f"chunks: {len(chunks)}  indexed: {indexed}")
+    print(
+        f"afrom_documents: {baseline_seconds:.3f}s "
+        f"({len(chunks) / baseline_seconds:.0f} chunks/s, {baseline.requests} requests)"
+    )
+    print(
+        f"pipeline:        {pipeline_seconds:.3f}s "
+        f"({len(chunks) / pipeline_seconds:.0f} chunks/s, {pipelined.requests} requests)"
+    )
+    print(f"batch metrics:   {embedding_pipeline.metrics.stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=150)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--per-text-latency", type=float, default=0.0005)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
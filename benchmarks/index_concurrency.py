@@ -0,0 +1,211 @@
+"""
+Per-user index reads and writes under mixed load from several processes,
+the way gunicorn workers share a data volume.
+
+Writer processes keep appending reports to random users' indexes with
+update_mmap_index (the upload path: lock, read, rewrite, publish a new
+version). Reader processes keep querying random users through an
+IndexCache, as /query does: a signature check per query, a reload when
+another process has published a new version, then a nearest-neighbour
+search.
+
+Reports per role: operations, throughput, p50/p95/p99 latency, and the
+errors that the versioning and locking rule out:
+- missing: a reader found no index for a user that already had one
+- torn: a reader saw an index whose vectors, texts and metadata disagree
+- lost: appends missing from the final index (two writers raced)
+- failed: writes that raised
+
+    python -m benchmarks.index_concurrency --readers 6 --writers 2 --users 8 --seconds 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import numpy as np
+
+from app.services.index_cache import IndexCache
+from app.services.mmap_store import (
+    MmapVectorStore,
+    update_mmap_index,
+    write_mmap_index,
+)
+
+
+def user_path(root: Path, user: int) -> Path:
+    return root / f"faiss_index_user{user}"
+
+
+def report(writer: int, number: int, chunks: int, dim: int, rng) -> tuple:
+    document_id = f"w{writer}-{number}"
+    texts = [f"{document_id} chunk {i}" for i in range(chunks)]
+    metadatas = [{"document_id": document_id, "chunk": i} for i in range(chunks)]
+    vectors = rng.standard_normal((chunks, dim), dtype=np.float32)
+    return texts, metadatas, vectors
+
+
+def writer(args: argparse.Namespace, root: Path, number: int, results) -> None:
+    rng = np.random.default_rng(number)
+    pick = random.Random(number)
+    latencies, appended, failed = [], {}, 0
+    deadline = time.monotonic() + args.seconds
+    written = 0
+    while time.monotonic() < deadline:
+        user = pick.randrange(args.users)
+        texts, metadatas, vectors = report(
+            number, written, args.chunks_per_report, args.dim, rng
+        )
+        written += 1
+        started = time.perf_counter()
+        try:
+            update_mmap_index(user_path(root, user), texts, metadatas, vectors)
+        except Exception:
+            failed += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        appended[user] = appended.get(user, 0) + len(texts)
+        time.sleep(args.write_interval)
+    results.put(("writer", latencies, {"appended": appended, "failed": failed}))
+
+
+def check_consistent(store: MmapVectorStore) -> bool:
+    """Every row has a vector, a text and metadata that belong together."""
+    count = len(store)
+    if store._offsets.shape[1] != count + 1 or len(store._norms) != count:
+        return False
+    for i in {0, count // 2, count - 1}:
+        metadata = store.get_metadata(i)
+        expected = f"{metadata['document_id']} chunk {metadata['chunk']}"
+        if store.get_text(i) != expected:
+            return False
+    return True
+
+
+def reader(args: argparse.Namespace, root: Path, number: int, results) -> None:
+    rng = np.random.default_rng(1000 + number)
+    pick = random.Random(1000 + number)
+    cache = IndexCache(max_bytes=1 << 40, idle_seconds=3600)
+    latencies = []
+    errors = {"missing": 0, "torn": 0}
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        user = pick.randrange(args.users)
+        path = user_path(root, user)
+        query = rng.standard_normal(args.dim, dtype=np.float32)
+        started = time.perf_counter()
+        try:
+            store = cache.get(str(user), path, lambda: MmapVectorStore(path, None))
+        except FileNotFoundError:
+            store = None
+        if store is None:
+            errors["missing"] += 1
+            continue
+        try:
+            ids, _ = store.nearest(query, args.k)
+            docs = [store.get_document(int(i)) for i in ids]
+            consistent = len(docs) == min(args.k, len(store)) and check_consistent(
+                store
+            )
+        except Exception:
+            consistent = False
+        latencies.append(time.perf_counter() - started)
+        if not consistent:
+            errors["torn"] += 1
+    results.put(("reader", latencies, errors))
+
+
+def percentile(samples: list[float], p: float) -> float:
+    samples = sorted(samples)
+    return samples[int(p * (len(samples) - 1))] if samples else float("nan")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=6)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--initial-chunks", type=int, default=200)
+    parser.add_argument("--chunks-per-report", type=int, default=40)
+    parser.add_argument("--write-interval", type=float, default=0.01)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        rng = np.random.default_rng(0)
+        for user in range(args.users):
+            texts, metadatas, vectors = report(
+                -1, user, args.initial_chunks, args.dim, rng
+            )
+            write_mmap_index(user_path(root, user), texts, metadatas, vectors)
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=reader, args=(args, root, i, results))
+            for i in range(args.readers)
+        ] + [
+            multiprocessing.Process(target=writer, args=(args, root, i, results))
+            for i in range(args.writers)
+        ]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        by_role: dict[str, list[float]] = {"reader": [], "writer": []}
+        errors = {"missing": 0, "torn": 0, "lost": 0, "failed": 0}
+        appended: dict[int, int] = {}
+        for role, latencies, extra in collected:
+            by_role[role] += latencies
+            if role == "reader":
+                for key, value in extra.items():
+                    errors[key] += value
+            else:
+                errors["failed"] += extra["failed"]
+                for user, count in extra["appended"].items():
+                    appended[user] = appended.get(user, 0) + count
+        for user in range(args.users):
+            expected = args.initial_chunks + appended.get(user, 0)
+            try:
+                actual = len(MmapVectorStore(user_path(root, user), None))
+            except FileNotFoundError:
+                actual = 0
+            errors["lost"] += expected - actual
+
+    print(
+        f"readers: {args.readers}  writers: {args.writers}  users: {args.users}  "
+        f"seconds: {args.seconds:g}"
+    )
+    print(
+        f"{'role':>8} {'ops':>7} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'mean ms':>8}"
+    )
+    for role, latencies in by_role.items():
+        if not latencies:
+            continue
+        print(
+            f"{role:>8} {len(latencies):>7} {len(latencies) / args.seconds:>8.1f} "
+            f"{1000 * percentile(latencies, 0.5):>8.2f} "
+            f"{1000 * percentile(latencies, 0.95):>8.2f} "
+            f"{1000 * percentile(latencies, 0.99):>8.2f} "
+            f"{1000 * statistics.mean(latencies):>8.2f}"
+        )
+    print(
+        f"errors: {errors['missing']} missing, {errors['torn']} torn, "
+        f"{errors['lost']} lost appends, {errors['failed']} failed writes"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Offline load test of the HTTP API with every external service faked.
+
+Gemini chat and embeddings, the web search backend and Tesseract OCR are
+replaced by the deterministic fakes in app.services.fake_backends, each
+with configurable latency, so the run needs no network or API key and
+can run in CI. The real FastAPI app (lifespan included) is driven
+through an in-process ASGI client: first concurrent /api/upload calls
+(each waited on until its ingestion job is done), then concurrent
+/api/query calls mixing lab-value, report, whole-report and web-search
+questions. With --batch, each user then sends all of those questions at
+once to /api/query/batch.
+
+Reports, per phase and per stage (from the request traces, see
+app.services.tracing): p50/p95/p99 latency, throughput, and peak RSS of
+this process plus its OCR worker processes while the stage ran.
+
+    python -m benchmarks.load_test --users 20 --queries 200 --concurrency 16 \\
+        --llm-latency 0.5 --embed-latency 0.1 --ocr-latency 0.5
+"""
+
+import argparse
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+os.environ.setdefault("ADMIN", "offline-benchmark")
+
+QUESTIONS = [
+    "What is my Hemoglobin?",
+    "Is my fasting glucose normal?",
+    "What does the interpretation section of my report say?",
+    "Which tests in my report were done on the sample collected?",
+    "Summarize my whole report.",
+    "Search online for the latest LDL cholesterol guidelines.",
+]
+PANEL = [
+    ("Hemoglobin", "g/dL", "13.0-17.0", (11, 18)),
+    ("WBC Count", "10^3/uL", "4.0-11.0", (3, 12)),
+    ("Platelet Count", "10^3/uL", "150-450", (120, 500)),
+    ("Total Cholesterol", "mg/dL", "<200", (150, 260)),
+    ("HDL Cholesterol", "mg/dL", ">40", (30, 70)),
+    ("LDL Cholesterol", "mg/dL", "<130", (80, 190)),
+    ("HbA1c", "%", "4.0-5.6", (4, 8)),
+    ("Glucose, Fasting", "mg/dL", "70-99", (70, 140)),
+    ("TSH", "uIU/mL", "0.4-4.0", (0.2, 6)),
+    ("Creatinine", "mg/dL", "0.7-1.3", (0.5, 1.8)),
+]
+
+
+def make_report(path: Path, text_pages: int, scanned_pages: int, seed: int) -> None:
+    """
+    A synthetic lab report: text_pages with a text layer (lab table plus
+    an interpretation paragraph) followed by scanned_pages blank pages,
+    which have no text layer and so go through (fake) OCR.
+    """
+    import pikepdf
+
+    rng = random.Random(seed)
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(
+        pikepdf.Dictionary(
+            Type=pikepdf.Name.Font,
+            Subtype=pikepdf.Name.Type1,
+            BaseFont=pikepdf.Name.Helvetica,
+            Encoding=pikepdf.Name.WinAnsiEncoding,
+        )
+    )
+    for page in range(text_pages):
+        lines = [
+            "CITY DIAGNOSTICS LABORATORY",
+            f"Patient: Test User {seed}  Page {page + 1}",
+            "Sample collected 2024-03-02, reported 2024-03-03.",
+            "",
+            "Test Result Unit Reference Range",
+        ]
+        lines += [
+            f"{name} {rng.uniform(low, high):.1f} {unit} {reference}"
+            for name, unit, reference, (low, high) in PANEL
+        ]
+        lines += ["", "Interpretation:"] + [
+            "Values outside the reference interval should be interpreted "
+            "together with clinical findings."
+        ] * 4
+        text = " ".join(
+            "("
+            + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            + ") '"
+            for line in lines
+        )
+        contents = pdf.make_stream(f"BT /F1 10 Tf 14 TL 50 800 Td {text} ET".encode())
+        pdf.pages.append(
+            pikepdf.Page(
+                pikepdf.Dictionary(
+                    Type=pikepdf.Name.Page,
+                    MediaBox=[0, 0, 595, 842],
+                    Resources=pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font)),
+                    Contents=contents,
+                )
+            )
+        )
+    for _ in range(scanned_pages):
+        pdf.add_blank_page(page_size=(595, 842))
+    pdf.save(path)
+
+
+def tree_rss_mb() -> float:
+    """Resident memory of this process and all its descendants (Linux)."""
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total, pending = 0, [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/statm") as statm:
+                total += int(statm.read().split()[1]) * page_size
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as children:
+                    pending += [int(child) for child in children.read().split()]
+        except (OSError, ValueError):
+            continue
+    return total / 2**20
+
+
+class RssSampler:
+    """Samples tree_rss_mb() in a thread so a busy event loop cannot skew it."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.times: list[float] = []
+        self.values: list[float] = []
+        self._stop = asyncio.Event()
+
+    async def run(self) -> None:
+        while not self._stop.is_set():
+            rss = await asyncio.to_thread(tree_rss_mb)
+            self.times.append(time.time())
+            self.values.append(rss)
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def peak(self, start: float, end: float) -> float | None:
+        lo = bisect.bisect_left(self.times, start)
+        hi = bisect.bisect_right(self.times, end)
+        window = self.values[lo:hi]
+        if not window and lo < len(self.values):
+            window = [self.values[lo]]  # span shorter than the interval
+        return max(window) if window else None
+
+
+class TraceCollector(logging.Handler):
+    """Keeps the JSON request traces logged on the app.trace logger."""
+
+    def __init__(self):
+        super().__init__()
+        self.traces: list[dict] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.traces.append(json.loads(record.getMessage()))
+
+
+def percentiles(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    pick = lambda p: samples[int(p * (len(samples) - 1))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def print_row(name: str, samples: list[float], wall: float, peak: float | None):
+    stats = percentiles(samples)
+    peak_text = f"{peak:8.0f}" if peak is not None else f"{'-':>8}"
+    print(
+        f"{name:>24} {len(samples):>6} {len(samples) / wall:>8.2f} "
+        f"{1000 * stats['p50']:>9.1f} {1000 * stats['p95']:>9.1f} "
+        f"{1000 * stats['p99']:>9.1f} {peak_text}"
+    )
+
+
+def print_header(title: str) -> None:
+    print(f"\n{title}")
+    print(
+        f"{'':>24} {'count':>6} {'per s':>8} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'peak MB':>8}"
+    )
+
+
+async def run(args: argparse.Namespace, data_dir: Path) -> None:
+    # Imported here: app.config reads the environment set up in main()
+    import httpx
+
+    from app.main import app
+    from app.services.embedding_cache import CachedEmbeddings, EmbeddingStore
+    from app.services.fake_backends import (
+        FakeChatModel,
+        FakeEmbeddings,
+        FakeSearchBackend,
+        fake_ocr_page,
+    )
+    from app.services.registry import registry
+    from app.services.web_search import WebSearch
+
+    registry.override(
+        "llm",
+        FakeChatModel(
+            latency=args.llm_latency,
+            per_token_latency=args.llm_token_latency,
+            tool_steps=args.tool_steps,
+        ),
+    )
+    registry.override(
+        "embeddings",
+        CachedEmbeddings(
+            FakeEmbeddings(
+                dim=args.dim,
+                latency=args.embed_latency,
+                per_text_latency=args.embed_text_latency,
+                bag_of_words=True,
+            ),
+            "fake",
+            EmbeddingStore(data_dir / "embedding_cache", 256 * 2**20),
+        ),
+    )
+    registry.override(
+        "web_search",
+        WebSearch(FakeSearchBackend(latency=args.search_latency), None, 10, 5),
+    )
+    registry.override(
+        "ocr_page", functools.partial(fake_ocr_page, latency=args.ocr_latency)
+    )
+
+    collector = TraceCollector()
+    trace_logger = logging.getLogger("app.trace")
+    trace_logger.addHandler(collector)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+    reports = data_dir / "reports"
+    reports.mkdir()
+    for user in range(args.users):
+        make_report(
+            reports / f"user{user}.pdf", args.text_pages, args.scanned_pages, user
+        )
+
+    sampler = RssSampler(args.rss_interval)
+    sampler_task = asyncio.create_task(sampler.run())
+    limit = asyncio.Semaphore(args.concurrency)
+    phases: dict[str, tuple[list[float], int, float, float, float]] = {}
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://load-test", timeout=None
+        ) as client:
+
+            async def upload(user: int) -> float:
+                async with limit:
+                    started = time.perf_counter()
+                    pdf = (reports / f"user{user}.pdf").read_bytes()
+                    response = await client.post(
+                        "/api/upload",
+                        data={"user_id": f"user{user}"},
+                        files={"file": ("report.pdf", pdf, "application/pdf")},
+                    )
+                    job_id = response.json()["job_id"]
+                    while True:
+                        job = (await client.get(f"/api/jobs/{job_id}")).json()
+                        if job["stage"] in ("done", "failed"):
+                            break
+                        await asyncio.sleep(args.poll_interval)
+                    if job["stage"] == "failed":
+                        raise RuntimeError(job.get("error") or "ingestion failed")
+                    return time.perf_counter() - started
+
+            async def query(number: int) -> float:
+                async with limit:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/api/query",
+                        json={
+                            "user_id": f"user{number % args.users}",
+                            "query": QUESTIONS[number % len(QUESTIONS)],
+                            "no_cache": not args.use_cache,
+                        },
+                    )
+                    if response.status_code != 200:
+                        raise RuntimeError(response.text)
+                    return time.perf_counter() - started
+
+            async def batch(user: int) -> float:
+                async with limit:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/api/query/batch",
+                        json={
+                            "user_id": f"user{user}",
+                            "queries": QUESTIONS,
+                            "no_cache": not args.use_cache,
+                        },
+                    )
+                    if response.status_code != 200:
+                        raise RuntimeError(response.text)
+                    return time.perf_counter() - started
+
+            for phase, call, count in [
+                ("upload", upload, args.users),
+                ("query", query, args.queries),
+                ("batch", batch, args.users if args.batch else 0),
+            ]:
+                if not count:
+                    continue
+                wall_start, started = time.time(), time.perf_counter()
+                results = await asyncio.gather(
+                    *(call(i) for i in range(count)), return_exceptions=True
+                )
+                wall = time.perf_counter() - started
+                samples = [r for r in results if isinstance(r, float)]
+                errors = len(results) - len(samples)
+                phases[phase] = (samples, errors, wall, wall_start, time.time())
+
+    sampler.stop()
+    await sampler_task
+
+    print(
+        f"users: {args.users}  queries: {args.queries}  "
+        f"concurrency: {args.concurrency}  ingest workers: {args.ingest_workers}"
+    )
+    print_header("Phases (client-side, per request)")
+    for phase, (samples, errors, wall, start, end) in phases.items():
+        if samples:
+            print_row(phase, samples, wall, sampler.peak(start, end))
+        if errors:
+            print(f"{'':>24} {errors} {phase} request(s) failed")
+
+    by_stage: dict[str, list[float]] = defaultdict(list)
+    stage_peaks: dict[str, float] = {}
+    tokens = {"prompt": 0, "completion": 0}
+    context = {"raw_tokens": 0, "tokens": 0}
+    stopped: dict[str, int] = defaultdict(int)
+    for trace in collector.traces:
+        group = trace["kind"] if trace["kind"] in ("ingest", "batch") else "query"
+        by_stage[f"{trace['kind']}:{trace.get('route') or 'total'}"].append(
+            trace["duration"]
+        )
+        for key in tokens:
+            tokens[key] += trace["tokens"][key]
+        for span in trace["spans"]:
+            if span["name"] == "context":
+                for key in context:
+                    context[key] += span[key]
+            elif span["name"] == "agent_stopped":
+                stopped[span["budget"]] += 1
+            name = f"{group}/{span['name']}"
+            by_stage[name].append(span["duration"])
+            start = trace["timestamp"] + span["start"]
+            peak = sampler.peak(start, start + span["duration"])
+            if peak is not None:
+                stage_peaks[name] = max(stage_peaks.get(name, 0), peak)
+
+    print_header("Stages (from request traces)")
+    for name in sorted(by_stage):
+        group = name.split("/")[0].split(":")[0]
+        wall = phases["upload" if group == "ingest" else group][2]
+        print_row(name, by_stage[name], wall, stage_peaks.get(name))
+    print(f"\nLLM tokens: {tokens['prompt']} prompt, {tokens['completion']} completion")
+    if context["raw_tokens"]:
+        print(
+            f"Context tokens: {context['raw_tokens']} as raw chunks, "
+            f"{context['tokens']} assembled "
+            f"({1 - context['tokens'] / context['raw_tokens']:.0%} saved)"
+        )
+    if stopped:
+        print(
+            "Agent runs stopped by a budget: "
+            + ", ".join(
+                f"{count} {budget}" for budget, count in sorted(stopped.items())
+            )
+        )
+    if sampler.values:
+        print(f"Peak RSS (process tree): {max(sampler.values):.0f} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--ingest-workers", type=int, default=2)
+    parser.add_argument("--text-pages", type=int, default=3)
+    parser.add_argument("--scanned-pages", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-token-latency", type=float, default=0.0)
+    parser.add_argument("--tool-steps", type=int, default=1)
+    parser.add_argument("--embed-latency", type=float, default=0.1)
+    parser.add_argument("--embed-text-latency", type=float, default=0.0)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--ocr-latency", type=float, default=0.5)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--use-cache", action="store_true")
+    parser.add_argument("--batch", action="store_true")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--rss-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="load_test_") as tmp:
+        os.environ["DATA_DIR"] = tmp
+        os.environ["INGEST_WORKERS"] = str(args.ingest_workers)
+        os.environ["TRACE_LOG_ENABLED"] = "true"
+        os.environ["LOG_LEVEL"] = "WARNING"
+        asyncio.run(run(args, Path(tmp)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Micro-benchmark of the retrieval step: LangChain's as_retriever(
+search_type="mmr") over a FAISS index (the previous get_retriever path)
+against HybridMMRRetriever over the same vectors in the mmap layout,
+dense-only and with BM25 blended in.
+
+Query embeddings come from a warm FakeEmbeddings cache, so the timings
+are search + MMR only.
+
+    python -m benchmarks.retrieval --chunks 2000 --fetch-k 50 --queries 300
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from app.services.fake_backends import FakeEmbeddings
+from app.services.mmap_store import MmapVectorStore, write_mmap_index
+from app.services.retrieval import HybridMMRRetriever
+
+ANALYTES = ["HbA1c", "Hemoglobin", "LDL", "HDL", "TSH", "Creatinine", "ALT", "Ferritin"]
+
+
+class MemoEmbeddings(Embeddings):
+    """Remembers query vectors so repeated queries time retrieval only."""
+
+    def __init__(self, underlying: Embeddings):
+        self.underlying = underlying
+        self.queries: dict[str, list[float]] = {}
+
+    def embed_documents(self, texts):
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text):
+        if text not in self.queries:
+            self.queries[text] = self.underlying.embed_query(text)
+        return self.queries[text]
+
+
+def timed(retriever, queries: list[str]) -> tuple[list[float], list[list[str]]]:
+    for query in queries:  # warm caches (query vectors, BM25 index)
+        retriever.invoke(query)
+    samples, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        docs = retriever.invoke(query)
+        samples.append(time.perf_counter() - started)
+        results.append([doc.page_content for doc in docs])
+    return samples, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--bm25-weight", type=float, default=0.3)
+    args = parser.parse_args()
+
+    embeddings = MemoEmbeddings(FakeEmbeddings(dim=args.dim, latency=0))
+    texts = [
+        f"{ANALYTES[i % len(ANALYTES)]} {i % 97}.{i % 10} units page {i // 20}"
+        for i in range(args.chunks)
+    ]
+    metadatas = [{"page": i // 20} for i in range(args.chunks)]
+    queries = [
+        f"what is my {ANALYTES[q % len(ANALYTES)]} value {q}?"
+        for q in range(args.queries)
+    ]
+
+    faiss_store = FAISS.from_texts(texts, embeddings, metadatas=metadatas)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "index"
+        write_mmap_index(
+            path,
+            texts,
+            metadatas,
+            faiss_store.index.reconstruct_n(0, faiss_store.index.ntotal),
+        )
+        mmap_store = MmapVectorStore(path, embeddings)
+
+        retrievers = {
+            "as_retriever(mmr)": faiss_store.as_retriever(
+                search_type="mmr",
+                search_kwargs={"k": args.k, "fetch_k": args.fetch_k},
+            ),
+            "vectorized mmr": HybridMMRRetriever(
+                vectorstore=mmap_store, k=args.k, fetch_k=args.fetch_k
+            ),
+            "vectorized mmr+bm25": HybridMMRRetriever(
+                vectorstore=mmap_store,
+                k=args.k,
+                fetch_k=args.fetch_k,
+                bm25_weight=args.bm25_weight,
+            ),
+        }
+        print(f"chunks: {args.chunks}  k: {args.k}  fetch_k: {args.fetch_k}")
+        baseline = None
+        for name, retriever in retrievers.items():
+            samples, results = timed(retriever, queries)
+            if baseline is None:
+                baseline = results
+            same = sum(a == b for a, b in zip(results, baseline)) / len(results)
+            # Share of returned chunks that name the analyte asked about
+            hits = statistics.mean(
+                sum(query.split()[3] in text for text in docs) / len(docs)
+                for query, docs in zip(queries, results)
+            )
+            print(
+                f"{name:>20}: p50 {1e6 * statistics.median(samples):.0f}us  "
+                f"max {1e6 * max(samples):.0f}us  "
+                f"same as baseline: {same:.0%}  analyte hit rate: {hits:.0%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Query latency and memory of the per-user index layout versus the shared
+multi-tenant index (app.services.shared_index), on synthetic users.
+
+Each layout is measured in its own subprocess so peak RSS is not mixed
+up between them. "cold" loads a user's index from disk for every query
+(the per-user layout with an empty index cache); "warm" keeps every
+loaded index in memory (a full cache).
+
+    python -m benchmarks.shared_index --users 200 --chunks 300 --queries 500
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from app.services.fake_backends import FakeEmbeddings
+from app.services.shared_index import SharedIndexStore
+
+
+def user_vectors(user: int, chunks: int, dim: int) -> np.ndarray:
+    rng = np.random.default_rng(user)
+    vectors = rng.standard_normal((chunks, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build(args: argparse.Namespace, root: Path) -> list[float]:
+    """Writes both layouts; returns the duration of each shared-index add."""
+    embeddings = FakeEmbeddings(dim=args.dim)
+    store = SharedIndexStore(root / "shared", args.shards)
+    adds = []
+    for user in range(args.users):
+        vectors = user_vectors(user, args.chunks, args.dim)
+        texts = [f"user {user} chunk {i} " + "x" * 120 for i in range(args.chunks)]
+        metadatas = [{"page": i // 20} for i in range(args.chunks)]
+        FAISS.from_embeddings(
+            list(zip(texts, vectors.tolist())), embeddings, metadatas=metadatas
+        ).save_local(str(root / f"faiss_index_user{user}"))
+        started = time.perf_counter()
+        store.add_chunks(f"user{user}", texts, metadatas, vectors)
+        adds.append(time.perf_counter() - started)
+    return adds
+
+
+def percentiles(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50_ms": 1000 * statistics.median(samples),
+        "p95_ms": 1000 * samples[int(0.95 * (len(samples) - 1))],
+    }
+
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def measure(args: argparse.Namespace, root: Path, layout: str) -> dict:
+    """Runs in the child process: one layout, many random (user, query) pairs."""
+    baseline_rss = current_rss_mb()
+    embeddings = FakeEmbeddings(dim=args.dim)
+    store = SharedIndexStore(root / "shared", args.shards)
+    loaded: dict[str, FAISS] = {}
+    rng = random.Random(0)
+    samples = []
+    for q in range(args.queries):
+        user = f"user{rng.randrange(args.users)}"
+        query = embeddings.embed_query(f"query {q}")
+        started = time.perf_counter()
+        if layout == "shared":
+            store.search(user, query, args.fetch_k)
+        else:
+            vectorstore = loaded.get(user) if layout == "warm" else None
+            if vectorstore is None:
+                vectorstore = FAISS.load_local(
+                    str(root / f"faiss_index_{user}"),
+                    embeddings,
+                    allow_dangerous_deserialization=True,
+                )
+                if layout == "warm":
+                    loaded[user] = vectorstore
+            vectorstore.max_marginal_relevance_search_by_vector(
+                query, k=5, fetch_k=args.fetch_k
+            )
+        samples.append(time.perf_counter() - started)
+    return {
+        "layout": layout,
+        **percentiles(samples),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_growth_mb": current_rss_mb() - baseline_rss,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--root", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--layout", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.layout:
+        print(json.dumps(measure(args, args.root, args.layout)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        started = time.perf_counter()
+        adds = build(args, root)
+        print(
+            f"built {args.users} users x {args.chunks} chunks "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        # An add should not slow down as the shards fill up
+        tenth = max(1, len(adds) // 10)
+        print(
+            f"shared adds: p50 {1000 * statistics.median(adds[:tenth]):.2f}ms "
+            f"for the first 10% of users, "
+            f"{1000 * statistics.median(adds[-tenth:]):.2f}ms for the last 10%"
+        )
+        for layout in ("cold", "warm", "shared"):
+            child = subprocess.run(
+                [sys.executable, "-m", "benchmarks.shared_index"]
+                + sys.argv[1:]
+                + ["--root", str(root), "--layout", layout],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            print(
+                f"{layout:>6}: p50 {result['p50_ms']:.2f}ms  "
+                f"p95 {result['p95_ms']:.2f}ms  "
+                f"peak RSS {result['peak_rss_mb']:.0f}MB "
+                f"(+{result['rss_growth_mb']:.0f}MB while querying)"
+            )
+
+
+if __name__ == "__main__":
+    main()
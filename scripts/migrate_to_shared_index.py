@@ -0,0 +1,106 @@
+"""
+Copies every per-user index (faiss_indexes/faiss_index_<user>, in the mmap
+or the legacy FAISS.save_local layout) into the shared multi-tenant index,
+reusing the stored vectors so nothing is re-embedded.
+
+    VECTOR_BACKEND=shared python -m scripts.migrate_to_shared_index [--delete-old]
+
+Users are migrated with replace=True, so running it again is safe.
+"""
+
+import argparse
+import logging
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from app.config import (
+    FAISS_INDEX_DIR,
+    LOG_LEVEL,
+    SHARED_INDEX_DIR,
+    SHARED_INDEX_SHARDS,
+)
+from app.services.index_cache import index_signature
+from app.services.mmap_store import MmapVectorStore, delete_mmap_index, index_write_lock
+from app.services.shared_index import SharedIndexStore
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "faiss_index_"
+
+
+class StoredVectorsOnly(Embeddings):
+    """Loads indexes without an embedding model: vectors are read back out."""
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError("The migration never embeds text.")
+
+    def embed_query(self, text: str) -> list[float]:
+        raise NotImplementedError("The migration never embeds text.")
+
+
+def migrate_user(store: SharedIndexStore, user_id: str, index_path) -> int:
+    if index_signature(index_path) is not None:
+        vectorstore = MmapVectorStore(index_path, StoredVectorsOnly())
+        docs = list(vectorstore.iter_documents())
+        vectors = vectorstore.vectors
+    else:
+        legacy = FAISS.load_local(
+            str(index_path),
+            StoredVectorsOnly(),
+            allow_dangerous_deserialization=True,
+        )
+        docs = [
+            legacy.docstore.search(legacy.index_to_docstore_id[i])
+            for i in range(legacy.index.ntotal)
+        ]
+        vectors = legacy.index.reconstruct_n(0, len(docs))
+    if not docs:
+        return 0
+    store.add_chunks(
+        user_id,
+        [doc.page_content for doc in docs],
+        [doc.metadata for doc in docs],
+        vectors,
+        replace=True,
+    )
+    return len(docs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--delete-old",
+        action="store_true",
+        help="remove each per-user index folder after it has been migrated",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    store = SharedIndexStore(SHARED_INDEX_DIR, SHARED_INDEX_SHARDS)
+    paths = sorted(FAISS_INDEX_DIR.glob(f"{PREFIX}*"))
+    migrated = 0
+    for index_path in paths:
+        user_id = index_path.name[len(PREFIX) :]
+        # Under the user's write lock, so an upload cannot land in the old
+        # index between copying and deleting it
+        with index_write_lock(index_path):
+            try:
+                count = migrate_user(store, user_id, index_path)
+            except Exception as e:
+                logger.exception("Error migrating %s: %s", user_id, e)
+                continue
+            migrated += 1
+            logger.info("Migrated %s: %d chunks", user_id, count)
+            if args.delete_old:
+                delete_mmap_index(index_path)
+
+    logger.info(
+        "Migrated %d/%d users. Shared index: %s", migrated, len(paths), store.stats()
+    )
+
+
+if __name__ == "__main__":
+    main()
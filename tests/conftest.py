@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+import pytest
+
+# app.config reads these at import time, before any test module imports app
+os.environ.setdefault("GOOGLE_API_KEY", "offline-tests")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="health-rag-tests-"))
+os.environ.setdefault("WEB_SEARCH_BACKEND", "stub")
+
+from app.services.registry import registry  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    """Clients overridden by a test do not leak into the next one."""
+    registry.reset()
+    yield
+    registry.reset()
@@ -0,0 +1,53 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.services import agent_service
+from app.services.agent_budget import AgentBudget
+from app.services.registry import registry
+
+
+def use_llm(responses: list[str], sleep: float | None = None) -> None:
+    registry.override("llm", FakeListChatModel(responses=responses, sleep=sleep))
+    registry.override("agent_executor", agent_service._build_agent_executor())
+
+
+def test_wall_clock_budget_returns_best_effort_answer():
+    # Every reasoning step outlasts the whole budget
+    use_llm(["Thought: check\nAction: search\nAction Input: statins"], sleep=0.3)
+
+    message, stopped = asyncio.run(
+        agent_service._ainvoke_agent(
+            "Is my LDL high?", [], AgentBudget(max_seconds=0.1)
+        )
+    )
+
+    assert stopped == "seconds"
+    assert message
+    assert message != agent_service.STOPPED_FALLBACK_MESSAGE
+
+
+def test_iteration_budget_stops_the_agent():
+    use_llm(
+        [
+            f"Thought: check\nAction: getReportChunks\nAction Input: u1 {page}"
+            for page in range(1, 20)
+        ]
+    )
+
+    message, stopped = asyncio.run(
+        agent_service._ainvoke_agent(
+            "Is my LDL high?", [], AgentBudget(max_iterations=2)
+        )
+    )
+
+    assert stopped == "iterations"
+    assert message
+
+
+def test_finished_run_is_not_stopped():
+    use_llm(["Thought: I know\nFinal Answer: Your LDL is fine."])
+
+    message, stopped = asyncio.run(agent_service._ainvoke_agent("Is my LDL high?", []))
+
+    assert (message, stopped) == ("Your LDL is fine.", None)
@@ -0,0 +1,31 @@
+from langchain_core.documents import Document
+
+from app.services.chunking import count_tokens
+from app.services.context import assemble_context
+
+
+def chunk(text: str, page: int, number: int) -> Document:
+    return Document(
+        page_content=text,
+        metadata={"page": page, "chunk_id": f"r1:{number}", "document_id": "r1"},
+    )
+
+
+def test_first_line_over_the_budget_is_cut_to_fit():
+    docs = [
+        chunk("LDL cholesterol 160 mg/dL above range " * 40, 0, 0),
+        chunk("HDL 40 mg/dL", 1, 7),
+    ]
+
+    context = assemble_context(docs, 20)
+
+    assert context.text.startswith("[Page 1]\nLDL cholesterol 160 mg/dL")
+    assert context.tokens == count_tokens(context.text) <= 20
+    assert context.truncated
+    assert context.passages == 1
+
+
+def test_line_is_kept_without_header_when_the_header_fills_the_budget():
+    context = assemble_context([chunk("LDL cholesterol 160 mg/dL", 0, 0)], 2)
+
+    assert context.text == "LDL cholesterol"
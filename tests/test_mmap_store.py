@@ -0,0 +1,63 @@
+import threading
+
+import numpy as np
+
+from app.services.mmap_store import (
+    MmapVectorStore,
+    index_write_lock,
+    update_mmap_index,
+    write_mmap_index,
+)
+
+
+def write_version(path, name: str, count: int) -> None:
+    write_mmap_index(
+        path,
+        [f"{name}:{i}" for i in range(count)],
+        [{"version": name} for _ in range(count)],
+        np.full((count, 4), float(count), dtype=np.float32),
+    )
+
+
+def test_reader_keeps_its_version_across_swaps_and_pruning(tmp_path):
+    path = tmp_path / "faiss_index_u1"
+    write_version(path, "v1", 2)
+    reader = MmapVectorStore(path, None)
+
+    write_version(path, "v2", 3)
+    write_version(path, "v3", 4)
+
+    # v1 is pruned (one old version is kept), but the open reader still
+    # reads the files it mapped
+    assert sorted(entry.name for entry in path.iterdir()) == [
+        "CURRENT",
+        "v000002",
+        "v000003",
+    ]
+    assert [reader.get_text(i) for i in range(len(reader))] == ["v1:0", "v1:1"]
+    assert reader.vectors.tolist() == [[2.0] * 4] * 2
+    latest = MmapVectorStore(path, None)
+    assert len(latest) == 4
+    assert latest.get_metadata(0) == {"version": "v3"}
+
+
+def test_write_lock_is_reentrant_and_excludes_other_threads(tmp_path):
+    path = tmp_path / "faiss_index_u1"
+    write_version(path, "v1", 2)
+    other_done = threading.Event()
+
+    def other_writer():
+        write_version(path, "other", 1)
+        other_done.set()
+
+    with index_write_lock(path):
+        # A helper taking the lock again in the same thread does not block
+        update_mmap_index(path, ["mine"], [{}], np.zeros((1, 4), dtype=np.float32))
+        thread = threading.Thread(target=other_writer)
+        thread.start()
+        assert not other_done.wait(0.2)
+        assert len(MmapVectorStore(path, None)) == 3
+    thread.join(5)
+
+    assert other_done.is_set()
+    assert MmapVectorStore(path, None).get_text(0) == "other:0"
@@ -0,0 +1,89 @@
+import asyncio
+from typing import Any
+
+from langchain_core.documents import Document
+from langchain_core.language_models.chat_models import SimpleChatModel
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.services import report_summary, vector_store
+from app.services.registry import registry
+
+
+class EchoSummaries(SimpleChatModel):
+    """Summarizes a page as its text and a roll-up as the labels it combines."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "echo-summaries"
+
+    def _call(self, messages: list, stop: Any = None, **kwargs: Any) -> str:
+        prompt = messages[-1].content
+        if prompt.startswith("Combine these summaries of a patient's lab reports"):
+            return "rollup of " + " + ".join(
+                line.split(" (")[0]
+                for line in prompt.splitlines()
+                if line.startswith("Report of")
+            )
+        return prompt.splitlines()[-1]
+
+
+def add_report(user_id: str, document_id: str, report_date: str, text: str) -> None:
+    report_info = {
+        "document_id": document_id,
+        "report_date": report_date,
+        "filename": f"{document_id}.pdf",
+    }
+    vector_store._store_report(
+        user_id,
+        document_id,
+        [text],
+        [dict(report_info, chunk_id=f"{document_id}:0")],
+        [[float(len(text)), 1.0, 0.0, 0.0]],
+        [],
+    )
+    page = Document(page_content=text, metadata={"page": 0})
+    asyncio.run(vector_store._asummarize(user_id, report_info, [page]))
+
+
+def test_summary_covers_every_report_and_follows_removal():
+    registry.override("llm", EchoSummaries())
+    add_report("summaries-user", "jan", "2024-01-10", "LDL 160 mg/dL high")
+    add_report("summaries-user", "jun", "2024-06-10", "LDL 110 mg/dL normal")
+
+    view = vector_store.get_report_summary("summaries-user")
+
+    assert view[0] == (
+        "Report summary: rollup of Report of 2024-01-10 + Report of 2024-06-10"
+    )
+    assert "Report of 2024-06-10 (jun.pdf), page 1: LDL 110 mg/dL normal" in view
+    assert "Report of 2024-01-10 (jan.pdf), page 1: LDL 160 mg/dL high" in view
+
+    assert vector_store.remove_report("summaries-user", "jan")
+
+    assert vector_store.get_report_summary("summaries-user") == [
+        "Report summary: Page 1: LDL 110 mg/dL normal",
+        "Page 1: LDL 110 mg/dL normal",
+    ]
+
+
+def test_rollup_terminates_when_each_summary_fills_a_group():
+    # Every summary alone is too large to share a group under the old split
+    llm = FakeListChatModel(responses=["x" * 80] * 20)
+    level = [f"Page {page}: " + "y" * 80 for page in range(9)]
+
+    rollup = asyncio.run(
+        asyncio.wait_for(
+            report_summary._arollup(
+                llm,
+                report_summary.ROLLUP_PROMPT,
+                level,
+                report_max_chars=80,
+                rollup_max_chars=100,
+            ),
+            timeout=10,
+        )
+    )
+
+    assert rollup == "x" * 80
+    # 9 -> 5 -> 3 -> 2 -> 1 summaries
+    assert llm.i == 11
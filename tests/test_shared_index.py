@@ -0,0 +1,161 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+
+from app.services import shared_index
+from app.services.fake_backends import FakeEmbeddings
+from app.services.mmap_store import write_mmap_index
+from app.services.reports import ReportFilter
+from app.services.shared_index import SharedIndexRetriever, SharedIndexStore
+from scripts import migrate_to_shared_index
+
+DIM = 4
+
+
+def vectors(count: int, offset: float) -> np.ndarray:
+    """count distinct vectors around (offset, 0, 0, 0)."""
+    matrix = np.zeros((count, DIM), dtype=np.float32)
+    matrix[:, 0] = offset
+    matrix[:, 1] = np.arange(count, dtype=np.float32) / 1000
+    return matrix
+
+
+def add_report(
+    store: SharedIndexStore, user_id: str, document_id: str, matrix: np.ndarray
+) -> None:
+    store.add_chunks(
+        user_id,
+        [f"{user_id}:{document_id}:{i}" for i in range(len(matrix))],
+        [{"document_id": document_id} for _ in range(len(matrix))],
+        matrix,
+        replace_document=document_id,
+    )
+
+
+@pytest.fixture
+def store(tmp_path) -> SharedIndexStore:
+    return SharedIndexStore(tmp_path / "shared", 2)
+
+
+def test_report_filter_finds_chunks_ranked_below_the_fetch_window(store):
+    add_report(store, "u1", "recent", vectors(200, 0.0))
+    add_report(store, "u1", "old", vectors(3, 50.0))
+    retriever = SharedIndexRetriever(
+        store=store,
+        user_id="u1",
+        embeddings=FakeEmbeddings(dim=DIM),
+        k=2,
+        fetch_k=5,
+        report_filter=ReportFilter(document_ids=("old",)),
+    )
+
+    [picked] = retriever.select_many(["ldl"], [[0.0] * DIM])
+
+    assert len(picked) == 2
+    assert {doc.metadata["document_id"] for doc in picked} == {"old"}
+
+
+def test_clear_empties_every_worker_view_and_accepts_new_chunks(store):
+    add_report(store, "u1", "a", vectors(5, 0.0))
+    add_report(store, "u2", "b", vectors(5, 0.0))
+    other_worker = SharedIndexStore(store.root, store.num_shards)
+    assert other_worker.search("u1", [0.0] * DIM, 3)
+
+    assert store.clear() == 10
+
+    assert not other_worker.search("u1", [0.0] * DIM, 3)
+    assert not other_worker.has_user("u2")
+    add_report(store, "u3", "c", vectors(2, 0.0))
+    assert [
+        doc.page_content for doc, _, _ in other_worker.search("u3", [0.0] * DIM, 5)
+    ] == [
+        "u3:c:0",
+        "u3:c:1",
+    ]
+    assert not other_worker.search("u1", [0.0] * DIM, 3)
+
+
+def test_users_sharing_a_shard_only_see_their_own_chunks(tmp_path):
+    # In one shard, users sit in adjacent id ranges; identical vectors
+    # make any leak across a range boundary rank first
+    store = SharedIndexStore(tmp_path / "shared", 1)
+    for user in range(6):
+        add_report(store, f"u{user}", "a", vectors(3, 0.0))
+
+    for user in range(6):
+        hits = store.search(f"u{user}", [0.0] * DIM, 10)
+        assert [doc.page_content for doc, _, _ in hits] == [
+            f"u{user}:a:{i}" for i in range(3)
+        ]
+    assert store.search("nobody", [0.0] * DIM, 10) == []
+
+
+def test_deleted_report_is_hidden_then_reclaimed_by_compaction(store):
+    add_report(store, "u1", "old", vectors(4, 0.0))
+    add_report(store, "u1", "new", vectors(2, 1.0))
+    other_worker = SharedIndexStore(store.root, store.num_shards)
+    other_worker.search("u1", [0.0] * DIM, 10)
+
+    assert store.delete_document("u1", "old")
+    assert {
+        doc.metadata["document_id"]
+        for doc, _, _ in other_worker.search("u1", [0.0] * DIM, 10)
+    } == {"new"}
+
+    assert store.compact() == 4
+    assert store.stats()["tombstones"] == 0
+    for worker in (store, other_worker):
+        shard = worker._sync(worker._ensure_user("u1") % worker.num_shards)
+        assert shard.index.ntotal == 2
+        hits = worker.search("u1", [0.0] * DIM, 10)
+        assert [doc.page_content for doc, _, _ in hits] == ["u1:new:0", "u1:new:1"]
+
+
+def test_appends_are_replayed_from_the_log_after_a_reload(store, monkeypatch):
+    add_report(store, "u1", "a", vectors(3, 0.0))
+    reader = SharedIndexStore(store.root, store.num_shards)
+    assert len(reader.search("u1", [0.0] * DIM, 10)) == 3
+
+    # Appended to the log only, then folded into a new base by a checkpoint
+    add_report(store, "u1", "b", vectors(2, 0.0))
+    assert len(reader.search("u1", [0.0] * DIM, 10)) == 5
+    monkeypatch.setattr(shared_index, "_CHECKPOINT_MIN_BYTES", 0)
+    add_report(store, "u1", "c", vectors(1, 0.0))
+    shard = store._ensure_user("u1") % store.num_shards
+    assert store._shards[shard].generation == 1
+    assert not list(store.root.glob("shard_*.log"))
+
+    # A record still being written is skipped until it is complete
+    log_path = store._log_path(shard, store._shards[shard].generation)
+    with open(log_path, "ab") as log:
+        log.write(shared_index._RECORD_HEADER.pack(1, DIM))
+
+    for worker in (reader, SharedIndexStore(store.root, store.num_shards)):
+        assert len(worker.search("u1", [0.0] * DIM, 10)) == 6
+
+
+def test_migration_copies_mmap_and_legacy_indexes(store, tmp_path):
+    write_mmap_index(
+        tmp_path / "faiss_index_m1",
+        ["a", "b"],
+        [{"document_id": "m"}] * 2,
+        vectors(2, 0.0),
+    )
+    FAISS.from_texts(
+        ["x", "y", "z"], FakeEmbeddings(dim=DIM), metadatas=[{"document_id": "l"}] * 3
+    ).save_local(str(tmp_path / "faiss_index_l1"))
+
+    assert (
+        migrate_to_shared_index.migrate_user(store, "m1", tmp_path / "faiss_index_m1")
+        == 2
+    )
+    assert (
+        migrate_to_shared_index.migrate_user(store, "l1", tmp_path / "faiss_index_l1")
+        == 3
+    )
+
+    assert store.get_texts("m1") == ["a", "b"]
+    assert store.get_texts("l1") == ["x", "y", "z"]
+    assert [doc.page_content for doc, _, _ in store.search("m1", [0.0] * DIM, 1)] == [
+        "a"
+    ]
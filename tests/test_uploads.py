@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import endpoints
+from app.config import TEMP_UPLOAD_DIR
+from app.services import ingest_jobs, uploads
+
+PDF = b"%PDF-1.4\n" + b"0" * 4096
+
+
+def temp_uploads() -> set[str]:
+    return {path.stem for path in TEMP_UPLOAD_DIR.glob("*.pdf")}
+
+
+@pytest.fixture
+def client() -> TestClient:
+    ingest_jobs.init_db()
+    app = FastAPI()
+    app.include_router(endpoints.router, prefix="/api")
+    return TestClient(app)
+
+
+def upload(client: TestClient, user_id: str, body: bytes = PDF):
+    return client.post(
+        "/api/upload",
+        data={"user_id": user_id},
+        files={"file": ("report.pdf", body, "application/pdf")},
+    )
+
+
+class StreamedRequest:
+    """The parts of a Request that areceive_pdf_upload reads, with no
+    Content-Length, so the size limit is only enforced while streaming."""
+
+    def __init__(self, body: bytes, boundary: str):
+        self.headers = {"content-type": f"multipart/form-data; boundary={boundary}"}
+        self._body = body
+
+    async def stream(self):
+        for start in range(0, len(self._body), 1024):
+            yield self._body[start : start + 1024]
+
+
+def test_upload_over_the_limit_is_refused_with_413(client, monkeypatch):
+    monkeypatch.setattr(endpoints, "UPLOAD_MAX_BYTES", 1024)
+    before = temp_uploads()
+
+    response = upload(client, "big-upload-user")
+
+    assert response.status_code == 413
+    assert response.json()["statusCode"] == 413
+    assert temp_uploads() == before
+
+
+def test_streamed_upload_is_cut_off_at_the_limit(tmp_path):
+    boundary = "limit-test"
+    body = (
+        (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="report.pdf"\r\n'
+            "Content-Type: application/pdf\r\n\r\n"
+        ).encode()
+        + PDF
+        + f"\r\n--{boundary}--\r\n".encode()
+    )
+    path = tmp_path / "upload.pdf"
+
+    with pytest.raises(uploads.UploadRejected) as rejected:
+        asyncio.run(
+            uploads.areceive_pdf_upload(StreamedRequest(body, boundary), path, 2048)
+        )
+
+    assert rejected.value.status_code == 413
+    assert rejected.value.filename == "report.pdf"
+    assert not path.exists()
+
+
+def test_identical_upload_in_progress_is_coalesced(client):
+    before = temp_uploads()
+    first = upload(client, "duplicate-user").json()
+    second = upload(client, "duplicate-user").json()
+    other_user = upload(client, "another-user").json()
+
+    assert first["statusCode"] == second["statusCode"] == 202
+    assert second["job_id"] == first["job_id"]
+    assert second["message"] == "An identical report is already being processed."
+    assert other_user["job_id"] != first["job_id"]
+    # The duplicate's file is dropped; the queued jobs keep theirs
+    assert temp_uploads() - before == {first["job_id"], other_user["job_id"]}
@@ -0,0 +1,43 @@
+import threading
+import time
+
+from langchain_community.vectorstores import FAISS
+
+from app.services import vector_store
+from app.services.fake_backends import FakeEmbeddings
+from app.services.registry import registry
+
+
+def test_legacy_index_is_converted_exactly_once(monkeypatch):
+    embeddings = FakeEmbeddings(dim=4)
+    registry.override("embeddings", embeddings)
+    index_path = vector_store.get_faiss_path("legacy-user")
+    FAISS.from_texts(
+        ["LDL 160", "HDL 40"], embeddings, metadatas=[{"document_id": "old"}] * 2
+    ).save_local(str(index_path))
+
+    conversions = []
+    convert = vector_store._convert_legacy_index
+
+    def counting_convert(path):
+        conversions.append(path)
+        time.sleep(0.2)  # every reader finds the legacy files meanwhile
+        convert(path)
+
+    monkeypatch.setattr(vector_store, "_convert_legacy_index", counting_convert)
+    loaded = []
+    start = threading.Barrier(4)
+
+    def read():
+        start.wait()
+        loaded.append(vector_store.load_vector_store("legacy-user"))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+
+    assert conversions == [index_path]
+    assert [len(store) for store in loaded] == [2] * 4
+    assert vector_store.list_reports("legacy-user")[0]["chunks"] == 2